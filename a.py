@@ -13,6 +13,7 @@ from routes.expenses import expenses_bp
 from routes.reports import reports_bp
 from routes.dashboard import dashboard_bp
 from routes.settings import settings_bp
+import rate_limiter
 
 load_dotenv()
 
@@ -84,6 +85,9 @@ app.register_blueprint(reports_bp)
 app.register_blueprint(dashboard_bp)
 app.register_blueprint(settings_bp)
 
+# Rate limits run before any view, so throttled requests never reach the database
+rate_limiter.init_app(app)
+
 
 @app.template_filter('datetimeformat')
 def datetimeformat(value, format='%Y-%m-%d %H:%M:%S'):
@@ -154,6 +158,14 @@ if __name__ == '__main__':
     print(f"Supabase URL configured: {'Yes' if app.config.get('SUPABASE_URL') else 'No'}")
     print(f"Mail Server configured: {'Yes' if app.config.get('MAIL_SERVER') else 'No'}")
     
+    if app.config.get('PESAPAL_RECONCILE_ENABLED'):
+        from payment_reconciler import start_reconciler
+        start_reconciler()
+    
+    if app.config.get('REORDER_ALERTS_ENABLED'):
+        from reorder_alerts import start_scheduler
+        start_scheduler()
+    
     from waitress import serve
 
     serve(app, host='0.0.0.0', port=5555)
\ No newline at end of file
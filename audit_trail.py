@@ -0,0 +1,231 @@
+# audit_trail.py
+"""
+Audit log viewer queries.
+
+Logs are read newest first with (created_at, id) cursors (same format as
+sales_history), and each page is one select with the user's name and role
+embedded. The total comes from PostgREST's count mode in
+AUDIT_LOG_COUNT_MODE ('estimated' by default, so large histories are not
+counted row by row).
+
+The action and user dropdowns and the summary cards read audit_log_facets
+(migrations/0007), a per-business snapshot of counts. When a snapshot is
+older than AUDIT_FACETS_REFRESH_SECONDS it is served as is and rebuilt in the
+background; until the migration is applied the users table and a fixed action
+list are used instead.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import Config
+from sales_history import encode_cursor, decode_cursor
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+FACETS_CACHE_SECONDS = 60
+FILTERS = ('start_date', 'end_date', 'action', 'user_id')
+COUNT_MODES = ('exact', 'planned', 'estimated')
+
+LOG_COLUMNS = 'id, user_id, action, description, details, ip_address, user_agent, created_at, ' \
+              'users(first_name, last_name, role)'
+
+DEFAULT_ACTIONS = ('login', 'logout', 'sale', 'refund', 'product_create', 'product_update', 'product_delete',
+                   'user_create', 'user_update', 'user_delete', 'stock_adjustment', 'settings_update')
+
+_facets = {}
+_refreshing = set()
+_facets_lock = threading.Lock()
+
+
+def clean_filters(args):
+    """The supported filters from request args, without empty or malformed values"""
+    filters = {key: args.get(key).strip() for key in FILTERS if args.get(key) and args.get(key).strip()}
+    if 'user_id' in filters:
+        try:
+            filters['user_id'] = str(uuid.UUID(filters['user_id']))
+        except ValueError:
+            del filters['user_id']
+    return filters
+
+
+def _apply_filters(query, filters):
+    if filters.get('start_date'):
+        query = query.gte('created_at', f"{filters['start_date']}T00:00:00")
+    if filters.get('end_date'):
+        query = query.lte('created_at', f"{filters['end_date']}T23:59:59")
+    if filters.get('action'):
+        query = query.eq('action', filters['action'])
+    if filters.get('user_id'):
+        query = query.eq('user_id', filters['user_id'])
+    return query
+
+
+def _keyset(query, cursor, before):
+    created_at, log_id = cursor
+    op = 'lt' if before else 'gt'
+    return query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{log_id})')
+
+
+def _user_name(user):
+    return f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+
+
+def fetch_page(supabase, business_id, filters=None, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    One page of audit logs, newest first
+
+    Args:
+        after: Cursor of the last row of the previous page (older logs)
+        before: Cursor of the first row of the following page (newer logs)
+
+    Returns:
+        dict: logs (with user_name and user_role), next_cursor, prev_cursor, total
+    """
+    filters = filters or {}
+    per_page = min(max(int(per_page), 1), MAX_PAGE_SIZE)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if not after_key else None
+    count_mode = Config.AUDIT_LOG_COUNT_MODE if Config.AUDIT_LOG_COUNT_MODE in COUNT_MODES else 'estimated'
+
+    query = supabase.table('audit_logs') \
+        .select(LOG_COLUMNS, count=count_mode) \
+        .eq('business_id', business_id)
+    query = _apply_filters(query, filters)
+
+    if before_key:
+        query = _keyset(query, before_key, before=False)
+        response = query.order('created_at').order('id').limit(per_page + 1).execute()
+        rows = response.data or []
+        logs = list(reversed(rows[:per_page]))
+        has_newer, has_older = len(rows) > per_page, True
+    else:
+        if after_key:
+            query = _keyset(query, after_key, before=True)
+        response = query.order('created_at', desc=True).order('id', desc=True).limit(per_page + 1).execute()
+        rows = response.data or []
+        logs = rows[:per_page]
+        has_newer, has_older = bool(after_key), len(rows) > per_page
+
+    for log in logs:
+        user = log.pop('users', None) or {}
+        log['user_name'] = _user_name(user) or None
+        log['user_role'] = user.get('role')
+
+    return {
+        'logs': logs,
+        'next_cursor': encode_cursor(logs[-1]) if logs and has_older else None,
+        'prev_cursor': encode_cursor(logs[0]) if logs and has_newer else None,
+        # The cursor condition narrows the count, so only the unpaged count is the total
+        'total': response.count if not (after_key or before_key) else None
+    }
+
+
+def count_since(supabase, business_id, start):
+    """Exact number of logs since `start` (an ISO timestamp); bounded by the created_at index"""
+    try:
+        response = supabase.table('audit_logs') \
+            .select('id', count='exact') \
+            .eq('business_id', business_id) \
+            .gte('created_at', start) \
+            .limit(1) \
+            .execute()
+        return response.count or 0
+    except Exception as e:
+        print(f"⚠️ Could not count audit logs: {str(e)}")
+        return 0
+
+
+def refresh_facets(supabase, business_id=None):
+    """Rebuild the facet snapshot of a business (every business when None)"""
+    response = supabase.rpc('refresh_audit_log_facets', {'p_business_id': business_id}).execute()
+    if business_id:
+        with _facets_lock:
+            _facets.pop(business_id, None)
+    return response.data
+
+
+def _refresh_in_background(supabase, business_id):
+    with _facets_lock:
+        if business_id in _refreshing:
+            return
+        _refreshing.add(business_id)
+
+    def run():
+        try:
+            refresh_facets(supabase, business_id)
+        except Exception as e:
+            print(f"⚠️ Audit log facet refresh failed: {str(e)}")
+        finally:
+            with _facets_lock:
+                _refreshing.discard(business_id)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _load_facets(supabase, business_id):
+    response = supabase.table('audit_log_facets') \
+        .select('facet, value, label, detail, count, refreshed_at') \
+        .eq('business_id', business_id) \
+        .order('count', desc=True) \
+        .execute()
+    return response.data or []
+
+
+def _fallback_facets(supabase, business_id):
+    users = supabase.table('users') \
+        .select('id, first_name, last_name, role') \
+        .eq('business_id', business_id) \
+        .order('first_name') \
+        .execute().data or []
+    return {
+        'actions': [{'value': action, 'label': action.replace('_', ' ').title(), 'count': None}
+                    for action in DEFAULT_ACTIONS],
+        'users': [{'id': user['id'], 'name': _user_name(user), 'role': user.get('role'), 'count': None}
+                  for user in users],
+        'refreshed_at': None
+    }
+
+
+def get_facets(supabase, business_id):
+    """
+    Filter dropdown values with their counts, most frequent first
+
+    Returns:
+        dict: actions [{value, label, count}], users [{id, name, role, count}], refreshed_at
+    """
+    now = time.monotonic()
+    with _facets_lock:
+        cached = _facets.get(business_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    try:
+        rows = _load_facets(supabase, business_id)
+        if not rows:
+            # First visit: build the snapshot once in-line
+            refresh_facets(supabase, business_id)
+            rows = _load_facets(supabase, business_id)
+
+        refreshed_at = min((row['refreshed_at'] for row in rows), default=None)
+        if refreshed_at:
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(refreshed_at.replace('Z', '+00:00'))
+            if age.total_seconds() > Config.AUDIT_FACETS_REFRESH_SECONDS:
+                _refresh_in_background(supabase, business_id)
+
+        facets = {
+            'actions': [{'value': row['value'], 'label': row['label'] or row['value'], 'count': row['count']}
+                        for row in rows if row['facet'] == 'action'],
+            'users': [{'id': row['value'], 'name': row['label'] or 'Unknown user', 'role': row['detail'],
+                       'count': row['count']}
+                      for row in rows if row['facet'] == 'user'],
+            'refreshed_at': refreshed_at
+        }
+    except Exception as e:
+        print(f"⚠️ Audit log facets unavailable: {str(e)}")
+        facets = _fallback_facets(supabase, business_id)
+
+    with _facets_lock:
+        _facets[business_id] = (now + FACETS_CACHE_SECONDS, facets)
+    return facets
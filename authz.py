@@ -0,0 +1,183 @@
+# authz.py
+"""
+Authorisation: effective roles and permissions per user, cached.
+
+A user's principal is resolved once from their users row and the role it
+points to (user_roles, loaded whole since it is small), then kept in memory
+so the route decorators check it with a dict lookup and a set membership
+test, without a database call.
+
+Every principal carries the generation it was built in. Changing an
+employee invalidates that user; changing or deleting a role bumps the
+generation, which retires every cached principal at once. Principals and
+the role table also expire after AUTHZ_CACHE_SECONDS, so changes made by
+another process are picked up; a reloaded role table that differs from the
+cached one bumps the generation as well.
+"""
+import threading
+import time
+
+from flask import session
+
+from config import Config
+
+SALES_ROLES = frozenset(['admin', 'manager', 'cashier', 'sales', 'employee'])
+ROLE_FLAGS = ('can_manage_users', 'can_manage_roles', 'can_view_analytics', 'can_manage_settings')
+USER_COLUMNS = 'id, role, role_id, is_admin, is_active, business_id'
+PAGE_SIZE = 1000
+
+_principals = {}
+_roles = {}
+_roles_expires = [0]
+_generation = [0]
+_lock = threading.Lock()
+
+
+class Principal:
+    """Effective access of one user"""
+    __slots__ = ('user_id', 'role', 'is_admin', 'is_active', 'permissions', 'generation', 'expires')
+
+    def __init__(self, user_id, role, is_admin, is_active, permissions, generation, expires):
+        self.user_id = user_id
+        self.role = role
+        self.is_admin = is_admin
+        self.is_active = is_active
+        self.permissions = permissions
+        self.generation = generation
+        self.expires = expires
+
+    def has_role(self, roles):
+        return self.role in roles
+
+    def can(self, permission):
+        return self.is_admin or permission in self.permissions
+
+
+def _supabase():
+    from routes.auth import get_supabase
+    return get_supabase()
+
+
+def _roles_stale():
+    return _roles_expires[0] <= time.monotonic()
+
+
+def _load_roles(supabase):
+    # Paged, so PostgREST's max-rows cap cannot cut the role table short
+    roles = {}
+    offset = 0
+    while True:
+        response = supabase.table('user_roles') \
+            .select('id, name, is_admin, permissions, ' + ', '.join(ROLE_FLAGS)) \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        data = response.data or []
+        roles.update({role['id']: role for role in data})
+        if len(data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    with _lock:
+        if roles != _roles:
+            # Principals built from the old table are stale (e.g. a role edited by another worker)
+            _generation[0] += 1
+            _roles.clear()
+            _roles.update(roles)
+        _roles_expires[0] = time.monotonic() + Config.AUTHZ_CACHE_SECONDS
+
+
+def build_principal(user, generation=None):
+    """Principal from a users row (id, role, role_id, is_admin, is_active)"""
+    role_row = _roles.get(user.get('role_id')) if user.get('role_id') else None
+    role = (role_row or {}).get('name') or user.get('role') or 'employee'
+    is_admin = bool(user.get('is_admin') or (role_row or {}).get('is_admin') or role == 'admin')
+
+    permissions = set()
+    if role_row:
+        permissions.update(flag[len('can_'):] for flag in ROLE_FLAGS if role_row.get(flag))
+        extra = role_row.get('permissions') or {}
+        if isinstance(extra, dict):
+            permissions.update(name for name, allowed in extra.items() if allowed)
+
+    return Principal(
+        user_id=user['id'],
+        role=role,
+        is_admin=is_admin,
+        is_active=user.get('is_active') is not False,
+        permissions=frozenset(permissions),
+        generation=_generation[0] if generation is None else generation,
+        expires=time.monotonic() + Config.AUTHZ_CACHE_SECONDS
+    )
+
+
+def prime(user, supabase=None):
+    """Cache the principal of a users row already in hand (at login); None if roles cannot be read"""
+    try:
+        if _roles_stale():
+            _load_roles(supabase or _supabase())
+    except Exception as e:
+        print(f"⚠️ Could not load roles: {str(e)}")
+        return None
+    principal = build_principal(user)
+    with _lock:
+        _principals[user['id']] = principal
+    return principal
+
+
+def get_principal(user_id):
+    """The cached principal of a user, resolving it on a miss; None for unknown users"""
+    principal = _principals.get(user_id)
+    if principal and principal.generation == _generation[0] and principal.expires > time.monotonic():
+        return principal
+
+    supabase = _supabase()
+    if _roles_stale():
+        _load_roles(supabase)
+    generation = _generation[0]
+    response = supabase.table('users') \
+        .select(USER_COLUMNS) \
+        .eq('id', user_id) \
+        .limit(1) \
+        .execute()
+    if not response.data:
+        return None
+
+    principal = build_principal(response.data[0], generation)
+    with _lock:
+        # A principal built across an invalidation is used once but not kept
+        if _generation[0] == generation:
+            _principals[user_id] = principal
+    return principal
+
+
+def current():
+    """Principal of the logged-in user, with the session's role fields kept in step; None when logged out"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    try:
+        principal = get_principal(user_id)
+    except Exception as e:
+        # Without the database, fall back to what the session recorded at login
+        print(f"⚠️ Could not resolve permissions: {str(e)}")
+        return Principal(user_id, session.get('user_role', 'employee'), bool(session.get('is_admin')),
+                         True, frozenset(), -1, 0)
+
+    if principal and (session.get('user_role') != principal.role or session.get('is_admin') != principal.is_admin):
+        session['user_role'] = principal.role
+        session['is_admin'] = principal.is_admin
+    return principal
+
+
+def invalidate_user(user_id):
+    """Re-resolve a user's access on their next request (call after changing the employee)"""
+    with _lock:
+        _principals.pop(user_id, None)
+
+
+def invalidate_roles():
+    """Re-resolve every user's access (call after adding, changing or deleting a role)"""
+    with _lock:
+        _generation[0] += 1
+        _roles_expires[0] = 0
@@ -0,0 +1,260 @@
+# cart_store.py
+"""
+Server-side cart storage for the sales terminal.
+
+The Flask session only carries a short cart id; the cart itself lives in an
+in-process store (default) or in the shared ``terminal_carts`` table
+(migrations/0018) when the app runs on several workers
+(CART_STORE_BACKEND=supabase).
+
+Each cart line is a compact list ``[quantity, price, tax_rate, name, unit]``
+keyed by product id, and the cart keeps running subtotal/tax totals so every
+mutation and totals lookup is O(1).
+"""
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from flask import session
+from config import Config
+
+QTY, PRICE, TAX_RATE, NAME, UNIT = range(5)
+HUNDRED = Decimal('100')
+
+
+class Cart:
+    """Cart with compact lines and running totals"""
+
+    __slots__ = ('lines', 'subtotal', 'tax_total')
+
+    def __init__(self, lines=None):
+        self.lines = {}
+        self.subtotal = Decimal('0')
+        self.tax_total = Decimal('0')
+        for product_id, line in (lines or {}).items():
+            self.set_quantity(product_id, line[QTY], line)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __contains__(self, product_id):
+        return product_id in self.lines
+
+    @staticmethod
+    def _line_amounts(quantity, line):
+        line_subtotal = Decimal(str(line[PRICE])) * quantity
+        line_tax = line_subtotal * Decimal(str(line[TAX_RATE])) / HUNDRED
+        return line_subtotal, line_tax
+
+    def quantity(self, product_id):
+        line = self.lines.get(product_id)
+        return line[QTY] if line else 0
+
+    def set_quantity(self, product_id, quantity, product=None):
+        """
+        Set a line's quantity, adding the line if needed (quantity <= 0 removes it)
+
+        Args:
+            product_id: Product id
+            quantity: New quantity
+            product: Product data for new lines, either a compact line or a
+                dict with name, price, tax_rate and unit
+        """
+        line = self.lines.get(product_id)
+        if line is None:
+            if quantity <= 0 or product is None:
+                return
+            if isinstance(product, dict):
+                line = [0, float(product['price']), float(product.get('tax_rate') or 0),
+                        product.get('name'), product.get('unit') or '']
+            else:
+                line = [0, float(product[PRICE]), float(product[TAX_RATE] or 0),
+                        product[NAME], product[UNIT] or '']
+            self.lines[product_id] = line
+
+        delta = int(quantity) - line[QTY]
+        if delta:
+            line_subtotal, line_tax = self._line_amounts(delta, line)
+            self.subtotal += line_subtotal
+            self.tax_total += line_tax
+            line[QTY] += delta
+
+        if line[QTY] <= 0:
+            del self.lines[product_id]
+
+    def add(self, product_id, quantity, product=None):
+        self.set_quantity(product_id, self.quantity(product_id) + int(quantity), product)
+
+    def remove(self, product_id):
+        self.set_quantity(product_id, 0)
+
+    def clear(self):
+        self.lines.clear()
+        self.subtotal = Decimal('0')
+        self.tax_total = Decimal('0')
+
+    def totals(self):
+        """Cart totals in the shape calculate_cart_totals returns"""
+        if not self.lines:
+            return {'subtotal': 0, 'tax_total': 0, 'total': 0}
+        return {
+            'subtotal': round(float(self.subtotal), 2),
+            'tax_total': round(float(self.tax_total), 2),
+            'total': round(float(self.subtotal + self.tax_total), 2)
+        }
+
+    def item(self, product_id):
+        """Expand one line into the dict shape templates and checkout use"""
+        line = self.lines[product_id]
+        return {
+            'id': product_id,
+            'name': line[NAME],
+            'price': line[PRICE],
+            'tax_rate': line[TAX_RATE],
+            'unit': line[UNIT],
+            'quantity': line[QTY]
+        }
+
+    def to_dict(self):
+        """Expand all lines into the legacy session cart shape"""
+        return {product_id: self.item(product_id) for product_id in self.lines}
+
+    def dumps(self):
+        return json.dumps(self.lines, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, data):
+        if not data:
+            return cls()
+        return cls(json.loads(data) if isinstance(data, str) else data)
+
+    @classmethod
+    def from_legacy(cls, cart_dict):
+        """Build a cart from the old session format {product_id: {...}}"""
+        cart = cls()
+        for product_id, item in (cart_dict or {}).items():
+            cart.set_quantity(product_id, item.get('quantity', 0), item)
+        return cart
+
+
+class MemoryCartBackend:
+    """In-process cart store with idle expiry"""
+
+    def __init__(self, ttl_seconds):
+        self.ttl = ttl_seconds
+        self._carts = {}
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now):
+        if now - self._last_sweep < 300:
+            return
+        self._last_sweep = now
+        expired = [cid for cid, (_, seen) in self._carts.items() if now - seen > self.ttl]
+        for cart_id in expired:
+            del self._carts[cart_id]
+
+    def load(self, cart_id):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._carts.get(cart_id)
+            if entry is None:
+                return Cart()
+            self._carts[cart_id] = (entry[0], now)
+            return entry[0]
+
+    def save(self, cart_id, cart):
+        with self._lock:
+            self._carts[cart_id] = (cart, time.monotonic())
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+
+class SupabaseCartBackend:
+    """Shared cart store in the terminal_carts table (for multi-worker deployments)"""
+
+    def __init__(self):
+        self._supabase = None
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            from supabase import create_client
+            self._supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+        return self._supabase
+
+    def load(self, cart_id):
+        try:
+            response = self.supabase.table('terminal_carts') \
+                .select('lines') \
+                .eq('id', cart_id) \
+                .limit(1) \
+                .execute()
+            if response.data:
+                return Cart.loads(response.data[0]['lines'])
+        except Exception as e:
+            print(f"❌ Error loading cart {cart_id}: {str(e)}")
+        return Cart()
+
+    def save(self, cart_id, cart):
+        try:
+            self.supabase.table('terminal_carts').upsert({
+                'id': cart_id,
+                'business_id': session.get('business_id'),
+                'lines': cart.lines,
+                'updated_at': 'now()'
+            }).execute()
+        except Exception as e:
+            print(f"❌ Error saving cart {cart_id}: {str(e)}")
+
+    def delete(self, cart_id):
+        try:
+            self.supabase.table('terminal_carts').delete().eq('id', cart_id).execute()
+        except Exception as e:
+            print(f"❌ Error deleting cart {cart_id}: {str(e)}")
+
+
+def _create_backend():
+    if Config.CART_STORE_BACKEND == 'supabase':
+        return SupabaseCartBackend()
+    return MemoryCartBackend(Config.CART_TTL_HOURS * 3600)
+
+
+cart_backend = _create_backend()
+
+
+def get_cart_id():
+    """Get the cart id for the current session, creating one if needed"""
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        cart_id = uuid.uuid4().hex
+        session['cart_id'] = cart_id
+    return cart_id
+
+
+def get_session_cart():
+    """Load the current session's cart"""
+    cart_id = get_cart_id()
+
+    # Move carts left in the cookie by older versions into the store
+    if 'cart' in session:
+        cart = Cart.from_legacy(session.pop('cart'))
+        cart_backend.save(cart_id, cart)
+        return cart
+
+    return cart_backend.load(cart_id)
+
+
+def save_session_cart(cart):
+    """Persist the current session's cart"""
+    cart_backend.save(get_cart_id(), cart)
+
+
+def clear_session_cart():
+    """Empty the current session's cart"""
+    cart_backend.delete(get_cart_id())
@@ -0,0 +1,271 @@
+# catalog_snapshot.py
+"""
+Versioned per-business catalogue snapshots for sales terminals.
+
+A snapshot holds one compact row per active product::
+
+    [id, name, sku, barcode, price, tax_rate, stock, category_id, unit, image_url]
+
+Every change to a row bumps the snapshot version (a millisecond timestamp,
+so versions keep increasing across restarts) and is written to a change log.
+Terminals fetch the full snapshot once and then ask for ``since=<version>``
+to receive only the rows changed or removed after that version.
+
+Product and stock writes call ``mark_changed`` so the next request refetches
+just those products; a periodic full refresh catches writes made by other
+processes and is diffed against the current rows, so deltas stay exact.
+"""
+import bisect
+import gzip
+import json
+import threading
+import time
+
+from config import Config
+
+FIELDS = ['id', 'name', 'sku', 'barcode', 'price', 'tax_rate', 'stock', 'category_id', 'unit', 'image_url']
+ID, NAME, SKU, BARCODE, PRICE, TAX_RATE, STOCK, CATEGORY_ID, UNIT, IMAGE_URL = range(len(FIELDS))
+PAGE_SIZE = 1000
+CHUNK_SIZE = 200
+MAX_LOG_ENTRIES = 5000
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_listeners = []
+
+
+def _next_version(current):
+    return max(current + 1, int(time.time() * 1000))
+
+
+def _row(product):
+    stock = sum(lot['quantity'] for lot in product.get('product_lots') or [])
+    return [
+        product['id'],
+        product['name'],
+        product.get('sku'),
+        product.get('barcode'),
+        float(product.get('selling_price') or 0),
+        float(product.get('tax_rate') or 0),
+        stock,
+        product.get('category_id'),
+        product.get('unit') or '',
+        product.get('image_url'),
+    ]
+
+
+def _fetch_rows(supabase, business_id, product_ids=None):
+    """Fetch catalogue rows with stock, either for the given ids or the whole catalogue"""
+    select = 'id, name, sku, barcode, selling_price, tax_rate, category_id, unit, image_url, is_active, product_lots(quantity)'
+    rows = {}
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        for i in range(0, len(product_ids), CHUNK_SIZE):
+            response = supabase.table('products') \
+                .select(select) \
+                .eq('business_id', business_id) \
+                .in_('id', product_ids[i:i + CHUNK_SIZE]) \
+                .execute()
+            for product in response.data or []:
+                if product.get('is_active', True):
+                    rows[product['id']] = _row(product)
+        return rows
+
+    offset = 0
+    while True:
+        response = supabase.table('products') \
+            .select(select) \
+            .eq('business_id', business_id) \
+            .eq('is_active', True) \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        data = response.data or []
+        for product in data:
+            rows[product['id']] = _row(product)
+        if len(data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    return rows
+
+
+def add_listener(listener):
+    """Register listener(business_id, changed_rows, removed_ids, full) called after each snapshot change"""
+    _listeners.append(listener)
+
+
+class CatalogSnapshot:
+    """Catalogue rows for one business plus a change log for delta sync"""
+
+    def __init__(self, business_id):
+        self.business_id = business_id
+        self.rows = {}
+        self.version = 0
+        self.base_version = 0
+        self.log_versions = []
+        self.log_ids = []
+        self.refreshed_at = 0
+        self.dirty = set()
+        self.dirty_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self._full_body = None
+        self._full_gzip = None
+
+    def _apply(self, new_rows, checked_ids):
+        """Diff fetched rows against the snapshot and record changes under a new version"""
+        changed = {}
+        removed = []
+        for product_id in checked_ids:
+            new = new_rows.get(product_id)
+            if new == self.rows.get(product_id):
+                continue
+            if new is None:
+                del self.rows[product_id]
+                removed.append(product_id)
+            else:
+                self.rows[product_id] = new
+                changed[product_id] = new
+
+        if not changed and not removed:
+            return False
+
+        self.version = _next_version(self.version)
+        for product_id in list(changed) + removed:
+            self.log_versions.append(self.version)
+            self.log_ids.append(product_id)
+
+        # Keep the log bounded; older clients get a full snapshot instead
+        if len(self.log_ids) > MAX_LOG_ENTRIES:
+            cut = len(self.log_ids) - MAX_LOG_ENTRIES // 2
+            self.base_version = self.log_versions[cut - 1]
+            del self.log_versions[:cut]
+            del self.log_ids[:cut]
+
+        self._full_body = None
+        self._full_gzip = None
+
+        for listener in _listeners:
+            try:
+                listener(self.business_id, changed, removed, False)
+            except Exception as e:
+                print(f"⚠️ Catalog listener failed: {str(e)}")
+        return True
+
+    def _take_dirty(self):
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def refresh(self, supabase):
+        """Bring the snapshot up to date: full load, periodic full diff, or dirty products only"""
+        with self.lock:
+            now = time.monotonic()
+
+            if not self.version:
+                self._take_dirty()
+                self.rows = _fetch_rows(supabase, self.business_id)
+                self.version = self.base_version = _next_version(0)
+                self.refreshed_at = now
+                print(f"✅ Catalog snapshot built for {self.business_id}: {len(self.rows)} products")
+                for listener in _listeners:
+                    try:
+                        listener(self.business_id, self.rows, [], True)
+                    except Exception as e:
+                        print(f"⚠️ Catalog listener failed: {str(e)}")
+                return
+
+            if now - self.refreshed_at > Config.CATALOG_SNAPSHOT_TTL_SECONDS:
+                self._take_dirty()
+                new_rows = _fetch_rows(supabase, self.business_id)
+                self._apply(new_rows, set(new_rows) | set(self.rows))
+                self.refreshed_at = now
+                return
+
+            dirty = self._take_dirty()
+            if dirty:
+                try:
+                    self._apply(_fetch_rows(supabase, self.business_id, dirty), dirty)
+                except Exception:
+                    with self.dirty_lock:
+                        self.dirty |= dirty
+                    raise
+
+    def changes_since(self, since):
+        """Rows changed and ids removed after `since`, or None if the log no longer covers it"""
+        if since < self.base_version or since > self.version:
+            return None
+        start = bisect.bisect_right(self.log_versions, since)
+        product_ids = dict.fromkeys(self.log_ids[start:])
+        products = [self.rows[pid] for pid in product_ids if pid in self.rows]
+        removed = [pid for pid in product_ids if pid not in self.rows]
+        return products, removed
+
+    def render(self, since=None, compress=False):
+        """
+        Serialise the snapshot or a delta
+
+        Returns:
+            tuple: (etag, body bytes); the gzip body has its own strong ETag
+        """
+        # Strong ETags must differ between encodings of the same representation
+        suffix = '-gzip' if compress else ''
+        with self.lock:
+            delta = self.changes_since(since) if since is not None else None
+
+            if delta is None:
+                etag = f'"{self.business_id}:{self.version}{suffix}"'
+                if self._full_body is None:
+                    self._full_body = json.dumps({
+                        'version': self.version,
+                        'full': True,
+                        'fields': FIELDS,
+                        'products': list(self.rows.values()),
+                    }, separators=(',', ':')).encode('utf-8')
+                if not compress:
+                    return etag, self._full_body
+                if self._full_gzip is None:
+                    self._full_gzip = gzip.compress(self._full_body, compresslevel=6)
+                return etag, self._full_gzip
+
+            products, removed = delta
+            etag = f'"{self.business_id}:{since}-{self.version}{suffix}"'
+            body = json.dumps({
+                'version': self.version,
+                'full': False,
+                'since': since,
+                'fields': FIELDS,
+                'products': products,
+                'removed': removed,
+            }, separators=(',', ':')).encode('utf-8')
+            return etag, gzip.compress(body, compresslevel=6) if compress else body
+
+
+def get_snapshot(supabase, business_id):
+    """Get the up-to-date catalogue snapshot for a business"""
+    with _snapshots_lock:
+        snapshot = _snapshots.get(business_id)
+        if snapshot is None:
+            snapshot = CatalogSnapshot(business_id)
+            _snapshots[business_id] = snapshot
+    snapshot.refresh(supabase)
+    return snapshot
+
+
+def mark_changed(business_id, product_ids=None):
+    """
+    Record that products changed so the next snapshot request refetches them
+
+    Args:
+        business_id: Business whose catalogue changed
+        product_ids: Changed product ids (None forces a full refresh)
+    """
+    snapshot = _snapshots.get(business_id)
+    if snapshot is None:
+        return
+    if product_ids is None:
+        snapshot.refreshed_at = 0
+        return
+    with snapshot.dirty_lock:
+        snapshot.dirty.update(pid for pid in product_ids if pid)
@@ -7,18 +7,30 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     
+    # Password hashing: 'scrypt' or 'pbkdf2', cost = scrypt N or PBKDF2 iterations (0 uses the default)
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_COST = int(os.getenv('PASSWORD_HASH_COST', 0))
+    
+    # Cached user permissions (seconds; role and employee changes invalidate immediately)
+    AUTHZ_CACHE_SECONDS = int(os.getenv('AUTHZ_CACHE_SECONDS', 300))
+    
     # Supabase Configuration
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_KEY = os.getenv('SUPABASE_KEY')
     SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
     
+    # Direct Postgres connection (migrations and maintenance scripts)
+    DATABASE_URL = os.getenv('DATABASE_URL')
+    
     # Email Configuration
     MAIL_SERVER = os.getenv('MAIL_SERVER')
     MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
     MAIL_USE_TLS = os.getenv('MAIL_USE_TLS', 'True') == 'True'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
-    
+    MAIL_POOL_BATCH_SIZE = int(os.getenv('MAIL_POOL_BATCH_SIZE', 50))
+    MAIL_POOL_IDLE_TIMEOUT = int(os.getenv('MAIL_POOL_IDLE_TIMEOUT', 60))
+
     # Cloudinary Configuration
     CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME')
     CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY')
@@ -32,6 +44,12 @@ class Config:
     PESAPAL_CONSUMER_KEY = os.getenv('PESAPAL_CONSUMER_KEY')
     PESAPAL_CONSUMER_SECRET = os.getenv('PESAPAL_CONSUMER_SECRET')
     PESAPAL_IPN_URL = os.getenv('PESAPAL_IPN_URL')
+    PESAPAL_API_URL = os.getenv('PESAPAL_API_URL', 'https://pay.pesapal.com/v3/api/')
+    PESAPAL_RECONCILE_ENABLED = os.getenv('PESAPAL_RECONCILE_ENABLED', 'True') == 'True'
+    PESAPAL_RECONCILE_INTERVAL_SECONDS = int(os.getenv('PESAPAL_RECONCILE_INTERVAL_SECONDS', 120))
+    PESAPAL_RECONCILE_BATCH_SIZE = int(os.getenv('PESAPAL_RECONCILE_BATCH_SIZE', 50))
+    PESAPAL_STATUS_RATE_LIMIT = float(os.getenv('PESAPAL_STATUS_RATE_LIMIT', 5))
+    PESAPAL_PENDING_EXPIRY_HOURS = int(os.getenv('PESAPAL_PENDING_EXPIRY_HOURS', 24))
     
     # Additional Email Config
     EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
@@ -39,5 +57,49 @@ class Config:
     SMTP_SERVER = os.getenv('SMTP_SERVER')
     SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
     
+    # Reorder Alerts
+    REORDER_ALERTS_ENABLED = os.getenv('REORDER_ALERTS_ENABLED', 'False') == 'True'
+    REORDER_ALERT_INTERVAL_MINUTES = int(os.getenv('REORDER_ALERT_INTERVAL_MINUTES', 60))
+    
+    # History partition retention in months (0 keeps everything)
+    AUDIT_LOG_RETENTION_MONTHS = int(os.getenv('AUDIT_LOG_RETENTION_MONTHS', 24))
+    AUTH_LOG_RETENTION_MONTHS = int(os.getenv('AUTH_LOG_RETENTION_MONTHS', 12))
+    INVENTORY_MOVEMENT_RETENTION_MONTHS = int(os.getenv('INVENTORY_MOVEMENT_RETENTION_MONTHS', 0))
+    
+    # Cold-history Parquet archive (months older than ARCHIVE_AFTER_MONTHS)
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    ARCHIVE_AFTER_MONTHS = int(os.getenv('ARCHIVE_AFTER_MONTHS', 12))
+    
+    # Trend cube chart cache (seconds)
+    TREND_CUBE_CACHE_SECONDS = int(os.getenv('TREND_CUBE_CACHE_SECONDS', 60))
+    
+    # Audit log viewer: total count mode ('estimated', 'planned' or 'exact') and facet refresh interval
+    AUDIT_LOG_COUNT_MODE = os.getenv('AUDIT_LOG_COUNT_MODE', 'estimated')
+    AUDIT_FACETS_REFRESH_SECONDS = int(os.getenv('AUDIT_FACETS_REFRESH_SECONDS', 900))
+    
+    # Pre-rendered receipts: in-process cache size and thermal printer line width (characters)
+    RECEIPT_CACHE_SIZE = int(os.getenv('RECEIPT_CACHE_SIZE', 500))
+    RECEIPT_LINE_WIDTH = int(os.getenv('RECEIPT_LINE_WIDTH', 32))
+    
+    # Sales Terminal Catalog Snapshot (full refresh interval)
+    CATALOG_SNAPSHOT_TTL_SECONDS = int(os.getenv('CATALOG_SNAPSHOT_TTL_SECONDS', 900))
+    
+    # Sales Terminal Cart Store ('memory' or 'supabase')
+    CART_STORE_BACKEND = os.getenv('CART_STORE_BACKEND', 'memory')
+    CART_TTL_HOURS = int(os.getenv('CART_TTL_HOURS', 12))
+    
     PRINTER_IP = os.getenv('PRINTER_IP', '192.168.1.100')
-    PRINTER_PORT = int(os.getenv('PRINTER_PORT', 9100))
\ No newline at end of file
+    PRINTER_PORT = int(os.getenv('PRINTER_PORT', 9100))
+    PRINTER_ENABLED = os.getenv('PRINTER_ENABLED', 'False') == 'True'
+    PRINTER_TYPE = os.getenv('PRINTER_TYPE', 'network')  # 'network' or 'usb'
+    PRINTER_VENDOR_ID = int(os.getenv('PRINTER_VENDOR_ID', '0'), 16)
+    PRINTER_PRODUCT_ID = int(os.getenv('PRINTER_PRODUCT_ID', '0'), 16)
+    PRINTER_TIMEOUT_SECONDS = int(os.getenv('PRINTER_TIMEOUT_SECONDS', 5))
+    PRINTER_MAX_ATTEMPTS = int(os.getenv('PRINTER_MAX_ATTEMPTS', 5))
+    PRINTER_HEALTH_CHECK_SECONDS = int(os.getenv('PRINTER_HEALTH_CHECK_SECONDS', 30))
+    
+    # Rate limits ('memory' or 'supabase' to share counters between workers)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    LOGIN_FAILURE_LIMIT = int(os.getenv('LOGIN_FAILURE_LIMIT', 5))
+    LOGIN_FAILURE_WINDOW_SECONDS = int(os.getenv('LOGIN_FAILURE_WINDOW_SECONDS', 900))
\ No newline at end of file
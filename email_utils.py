@@ -1,9 +1,6 @@
 
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.image import MIMEImage
 from config import Config
+from mail_service import build_message, get_mailer
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -34,28 +31,13 @@ def send_email(to_email, subject, html_content, text_content=None, from_email=No
             return False
         
         # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = from_addr
-        msg['To'] = to_email
-        msg['Date'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %z")
-        
-        # Add text part
-        if text_content:
-            text_part = MIMEText(text_content, 'plain')
-            msg.attach(text_part)
-        
-        # Add HTML part
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            if Config.MAIL_USE_TLS:
-                server.starttls()
-            server.login(username, password)
-            server.send_message(msg)
-        
+        msg = build_message(to_email, subject, html_content, text_content, from_addr)
+
+        # Send over the shared SMTP session instead of a fresh connection per email
+        mailer = get_mailer(smtp_server, smtp_port, username, password, Config.MAIL_USE_TLS)
+        if not mailer.send(msg):
+            return False
+
         print(f"✅ Email sent successfully to {to_email}")
         return True
         
@@ -63,6 +45,43 @@ def send_email(to_email, subject, html_content, text_content=None, from_email=No
         print(f"❌ Error sending email: {str(e)}")
         return False
 
+def send_bulk_email(recipients, subject, html_content, text_content=None):
+    """
+    Send the same rendered email to several recipients over one SMTP session
+
+    Args:
+        recipients: List of recipient email addresses
+        subject: Email subject
+        html_content: HTML email body
+        text_content: Plain text email body (optional)
+
+    Returns:
+        int: Number of emails accepted by the server
+    """
+    try:
+        smtp_server = os.getenv('SMTP_SERVER')
+        smtp_port = os.getenv('SMTP_PORT')
+        username = os.getenv('EMAIL_ADDRESS')
+        password = os.getenv('EMAIL_PASSWORD')
+        from_addr = Config.MAIL_USERNAME or username
+
+        if not all([smtp_server, username, password]):
+            print("❌ Email configuration missing")
+            return 0
+
+        messages = [build_message(to_email, subject, html_content, text_content, from_addr)
+                    for to_email in recipients]
+
+        mailer = get_mailer(smtp_server, smtp_port, username, password, Config.MAIL_USE_TLS)
+        sent = mailer.send_many(messages)
+
+        print(f"✅ Bulk email sent to {sent}/{len(messages)} recipients")
+        return sent
+
+    except Exception as e:
+        print(f"❌ Error sending bulk email: {str(e)}")
+        return 0
+
 def generate_reorder_alert_email(business_info, low_stock_products, logo_url=None):
     """
     Generate HTML email for reorder alerts
@@ -496,6 +515,10 @@ def generate_reorder_alert_email(business_info, low_stock_products, logo_url=Non
     html = html.replace("{{APP_URL}}", Config.APP_URL)
     
     # Generate plain text version
+    product_lines = ''.join(
+        f"• {p.get('name')} (SKU: {p.get('sku', 'N/A')}): {p.get('current_stock', 0)} in stock (Reorder at: {p.get('reorder_level', 0)})\n"
+        for p in low_stock_products
+    )
     text_content = f"""
     REORDER ALERT - {business_name}
     ================================
@@ -511,7 +534,7 @@ def generate_reorder_alert_email(business_info, low_stock_products, logo_url=Non
     - Low Stock Items: {total_low_stock - total_critical}
     
     LOW STOCK PRODUCTS:
-    {''.join([f"• {p.get('name')} (SKU: {p.get('sku', 'N/A')}): {p.get('current_stock', 0)} in stock (Reorder at: {p.get('reorder_level', 0)})\n" for p in low_stock_products])}
+    {product_lines}
     
     ACTION REQUIRED:
     Please log in to your inventory management system to review and reorder these items:
@@ -0,0 +1,610 @@
+# history_archive.py
+"""
+Cold-history archive: closed months of sales, sale_items, expenses and
+inventory_movements stored as zstd-compressed Parquet files on local disk.
+
+Layout::
+
+    ARCHIVE_DIR/<table>/business_id=<id>/<YYYY-MM>.parquet
+    ARCHIVE_DIR/manifest.json      {business_id: {table: "YYYY-MM-01"}}
+
+The manifest holds a watermark per business and table: every month before it
+is in the archive. Reports read rows before the watermark from Parquet and
+only query Supabase for rows on or after it, so nothing is counted twice
+whether or not the live rows were purged.
+
+Expenses are placed by the user-entered expense_date, so one can be entered
+into a month that is already archived. Archived expense rows are stamped
+with archived_at (migrations/0013); reports also read live expenses below
+the watermark that have no stamp, and the next archive run adds them to
+their month. Sales cannot change once archived: refunds of archived sales
+are refused (see refund_engine).
+
+    python history_archive.py archive [--business ID] [--before YYYY-MM] [--purge]
+    python history_archive.py status
+"""
+import argparse
+import json
+import os
+import threading
+from datetime import date, datetime, timezone
+
+from config import Config
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PAGE_SIZE = 1000
+CHUNK_SIZE = 200
+
+# Columns kept per table, the column that places a row in a month, and how to scope it to a business
+TABLES = {
+    'sales': {
+        'columns': [
+            ('id', 'string'), ('business_id', 'string'), ('invoice_number', 'string'),
+            ('customer_name', 'string'), ('subtotal', 'float'), ('tax_amount', 'float'),
+            ('discount_amount', 'float'), ('total_amount', 'float'), ('refund_amount', 'float'),
+            ('payment_method', 'string'), ('payment_status', 'string'), ('sold_by', 'string'),
+            ('created_at', 'timestamp'),
+        ],
+        'date_column': 'created_at',
+        'business_filter': 'business_id',
+        'embed': None,
+    },
+    'sale_items': {
+        'columns': [
+            ('id', 'string'), ('sale_id', 'string'), ('product_id', 'string'),
+            ('product_name', 'string'), ('sku', 'string'), ('quantity', 'int'),
+            ('unit_price', 'float'), ('tax_rate', 'float'), ('total_price', 'float'),
+            ('created_at', 'timestamp'),
+        ],
+        'date_column': 'created_at',
+        'business_filter': 'sales.business_id',
+        'embed': 'sales!inner(business_id)',
+    },
+    'expenses': {
+        'columns': [
+            ('id', 'string'), ('business_id', 'string'), ('expense_date', 'date'),
+            ('vendor', 'string'), ('description', 'string'), ('category', 'string'),
+            ('amount', 'float'), ('payment_method', 'string'), ('status', 'string'),
+            ('created_at', 'timestamp'),
+        ],
+        'date_column': 'expense_date',
+        'business_filter': 'business_id',
+        'embed': None,
+        # Live rows carry archived_at once archived (rows can arrive below the watermark)
+        'stamped': True,
+    },
+    'inventory_movements': {
+        'columns': [
+            ('id', 'string'), ('product_id', 'string'), ('lot_id', 'string'),
+            ('movement_type', 'string'), ('quantity', 'int'), ('reference', 'string'),
+            ('notes', 'string'), ('created_by', 'string'), ('created_at', 'timestamp'),
+        ],
+        'date_column': 'created_at',
+        'business_filter': 'products.business_id',
+        'embed': 'products!inner(business_id)',
+    },
+}
+
+_manifest_cache = {'mtime': None, 'data': {}}
+_manifest_lock = threading.Lock()
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from supabase import create_client
+        _client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+    return _client
+
+
+def archive_available():
+    return pa is not None
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _month_start(value):
+    return _to_date(value).replace(day=1)
+
+
+def _next_month(month):
+    return date(month.year + (month.month // 12), month.month % 12 + 1, 1)
+
+
+def _months_back(month, count):
+    index = month.year * 12 + month.month - 1 - count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _bound(value, column_type):
+    """Report date bounds as comparable Arrow scalars (dates mean midnight UTC, like the live queries)"""
+    if column_type == 'date':
+        return pa.scalar(_to_date(value), pa.date32())
+    if isinstance(value, str) and len(value) > 10:
+        moment = _parse_timestamp(value)
+    else:
+        day = _to_date(value)
+        moment = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return pa.scalar(moment, pa.timestamp('us', tz='UTC'))
+
+
+def _manifest_path():
+    return os.path.join(Config.ARCHIVE_DIR, 'manifest.json')
+
+
+def load_manifest():
+    """Archive watermarks, re-read only when the file changes"""
+    path = _manifest_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+
+    with _manifest_lock:
+        if _manifest_cache['mtime'] != mtime:
+            with open(path, encoding='utf-8') as f:
+                _manifest_cache['data'] = json.load(f)
+            _manifest_cache['mtime'] = mtime
+        return _manifest_cache['data']
+
+
+def _set_watermark(business_id, table, month):
+    with _manifest_lock:
+        path = _manifest_path()
+        manifest = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        manifest.setdefault(business_id, {})[table] = month.isoformat()
+
+        os.makedirs(Config.ARCHIVE_DIR, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def archived_through(business_id, table):
+    """First month not in the archive for a business/table (None if nothing is archived)"""
+    if not archive_available():
+        return None
+    watermark = load_manifest().get(business_id, {}).get(table)
+    return date.fromisoformat(watermark) if watermark else None
+
+
+def split_range(business_id, table, start_date, end_date):
+    """
+    Split a report range between the archive and the live table
+
+    Returns:
+        tuple: (archive_until, live_start). archive_until is the watermark if part
+        of the range is archived (else None); live_start is where the live query
+        should start (None if the whole range is archived).
+
+    For stamped tables (expenses) query the whole range live as well, keeping
+    rows below archive_until only when archived_at is null.
+    """
+    watermark = archived_through(business_id, table)
+    if watermark is None or watermark <= _to_date(start_date):
+        return None, start_date
+    if watermark > _to_date(end_date):
+        return watermark, None
+    return watermark, watermark.isoformat()
+
+
+def _month_path(table, business_id, month):
+    return os.path.join(Config.ARCHIVE_DIR, table, f'business_id={business_id}', f'{month:%Y-%m}.parquet')
+
+
+def _schema(table):
+    types = {
+        'string': pa.string(),
+        'float': pa.float64(),
+        'int': pa.int64(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'date': pa.date32(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in TABLES[table]['columns']])
+
+
+def read_archive(business_id, table, start_date, end_date, columns=None):
+    """
+    Archived rows of a business with start_date <= date <= end_date, before the watermark
+
+    Returns:
+        pyarrow.Table (empty if nothing is archived for the range)
+    """
+    spec = TABLES[table]
+    date_column = spec['date_column']
+    column_type = dict(spec['columns'])[date_column]
+    schema = _schema(table)
+    if columns:
+        schema = pa.schema([schema.field(name) for name in columns])
+
+    watermark = archived_through(business_id, table)
+    if watermark is None:
+        return schema.empty_table()
+
+    read_columns = list(schema.names)
+    if date_column not in read_columns:
+        read_columns.append(date_column)
+
+    tables = []
+    month = _month_start(start_date)
+    last = min(_month_start(end_date), _months_back(watermark, 1))
+    while month <= last:
+        path = _month_path(table, business_id, month)
+        if os.path.exists(path):
+            tables.append(pq.read_table(path, columns=read_columns))
+        month = _next_month(month)
+
+    if not tables:
+        return schema.empty_table()
+
+    data = pa.concat_tables(tables)
+    dates = data[date_column]
+    mask = pc.and_(
+        pc.and_(pc.greater_equal(dates, _bound(start_date, column_type)),
+                pc.less_equal(dates, _bound(end_date, column_type))),
+        pc.less(dates, _bound(watermark, column_type))
+    )
+    return data.filter(mask).select(schema.names)
+
+
+def _grouped_sums(data, key, value):
+    """{key: {'count': n, 'amount': sum}} for an Arrow table"""
+    if data.num_rows == 0:
+        return {}
+    grouped = data.group_by(key).aggregate([(value, 'sum'), (value, 'count')])
+    return {
+        row[key]: {'count': row[f'{value}_count'], 'amount': row[f'{value}_sum'] or 0}
+        for row in grouped.to_pylist()
+    }
+
+
+def sales_aggregates(business_id, start_date, end_date):
+    """Report totals for archived sales in a range (zeros if nothing is archived)"""
+    result = {
+        'count': 0, 'total_revenue': 0, 'total_tax': 0, 'total_discount': 0,
+        'total_subtotal': 0, 'payment_statuses': {}, 'daily': {}
+    }
+    if not archive_available():
+        return result
+
+    data = read_archive(business_id, 'sales', start_date, end_date, columns=[
+        'total_amount', 'tax_amount', 'discount_amount', 'subtotal', 'payment_status', 'created_at'
+    ])
+    if data.num_rows == 0:
+        return result
+
+    result['count'] = data.num_rows
+    result['total_revenue'] = pc.sum(data['total_amount']).as_py() or 0
+    result['total_tax'] = pc.sum(data['tax_amount']).as_py() or 0
+    result['total_discount'] = pc.sum(data['discount_amount']).as_py() or 0
+    result['total_subtotal'] = pc.sum(data['subtotal']).as_py() or 0
+    result['payment_statuses'] = _grouped_sums(
+        pa.table({'payment_status': pc.fill_null(data['payment_status'], 'pending'),
+                  'total_amount': data['total_amount']}),
+        'payment_status', 'total_amount'
+    )
+
+    days = pc.cast(data['created_at'], pa.date32())
+    daily = _grouped_sums(pa.table({'day': days, 'total_amount': data['total_amount']}), 'day', 'total_amount')
+    result['daily'] = {day.isoformat(): values for day, values in daily.items()}
+    return result
+
+
+def expense_aggregates(business_id, start_date, end_date):
+    """Report totals for archived expenses in a range (zeros if nothing is archived)"""
+    result = {'count': 0, 'total_amount': 0, 'categories': {}, 'statuses': {}}
+    if not archive_available():
+        return result
+
+    data = read_archive(business_id, 'expenses', start_date, end_date, columns=['category', 'amount', 'status'])
+    if data.num_rows == 0:
+        return result
+
+    result['count'] = data.num_rows
+    result['total_amount'] = pc.sum(data['amount']).as_py() or 0
+    result['categories'] = _grouped_sums(
+        pa.table({'category': pc.fill_null(data['category'], 'Uncategorized'), 'amount': data['amount']}),
+        'category', 'amount'
+    )
+    result['statuses'] = _grouped_sums(
+        pa.table({'status': pc.fill_null(data['status'], 'approved'), 'amount': data['amount']}),
+        'status', 'amount'
+    )
+    return result
+
+
+def _select(table):
+    spec = TABLES[table]
+    columns = ', '.join(name for name, _ in spec['columns'])
+    return f"{columns}, {spec['embed']}" if spec['embed'] else columns
+
+
+def _fetch_month(supabase, table, business_id, month):
+    """All live rows of a business for one month"""
+    spec = TABLES[table]
+    date_column = spec['date_column']
+    rows = []
+    offset = 0
+    while True:
+        response = supabase.table(table) \
+            .select(_select(table)) \
+            .eq(spec['business_filter'], business_id) \
+            .gte(date_column, month.isoformat()) \
+            .lt(date_column, _next_month(month).isoformat()) \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        data = response.data or []
+        rows.extend(data)
+        if len(data) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+def _first_live_month(supabase, table, business_id):
+    spec = TABLES[table]
+    response = supabase.table(table) \
+        .select(f"{spec['date_column']}{', ' + spec['embed'] if spec['embed'] else ''}") \
+        .eq(spec['business_filter'], business_id) \
+        .order(spec['date_column']) \
+        .limit(1) \
+        .execute()
+    if not response.data:
+        return None
+    return _month_start(response.data[0][spec['date_column']])
+
+
+def _to_arrow(table, rows):
+    columns = TABLES[table]['columns']
+    values = {}
+    for name, kind in columns:
+        column = [row.get(name) for row in rows]
+        if kind == 'timestamp':
+            column = [_parse_timestamp(value) for value in column]
+        elif kind == 'date':
+            column = [_to_date(value) if value else None for value in column]
+        elif kind == 'float':
+            column = [float(value) if value is not None else None for value in column]
+        values[name] = column
+    return pa.table(values, schema=_schema(table))
+
+
+def write_month(table, business_id, month, rows):
+    """Write (or merge into) one month's Parquet file; rows already archived are replaced by id"""
+    path = _month_path(table, business_id, month)
+    data = _to_arrow(table, rows)
+
+    if os.path.exists(path):
+        existing = pq.read_table(path)
+        keep = pc.invert(pc.is_in(existing['id'], value_set=data['id']))
+        data = pa.concat_tables([existing.filter(keep), data])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(data, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+    return data.num_rows
+
+
+def _chunks(items):
+    for i in range(0, len(items), CHUNK_SIZE):
+        yield items[i:i + CHUNK_SIZE]
+
+
+def _stamp_archived(supabase, table, rows):
+    now = datetime.now(timezone.utc).isoformat()
+    for chunk in _chunks([row['id'] for row in rows]):
+        supabase.table(table).update({'archived_at': now}, returning='minimal').in_('id', chunk).execute()
+
+
+def _archive_late_rows(supabase, table, business_id, watermark):
+    """Add live rows that arrived below the watermark after their month was archived"""
+    spec = TABLES[table]
+    date_column = spec['date_column']
+    rows = []
+    offset = 0
+    while True:
+        response = supabase.table(table) \
+            .select(_select(table)) \
+            .eq(spec['business_filter'], business_id) \
+            .lt(date_column, watermark.isoformat()) \
+            .is_('archived_at', 'null') \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        data = response.data or []
+        rows.extend(data)
+        if len(data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(_month_start(row[date_column]), []).append(row)
+    for month, month_rows in by_month.items():
+        write_month(table, business_id, month, month_rows)
+    _stamp_archived(supabase, table, rows)
+    return len(rows)
+
+
+def _is_missing_function(error):
+    return getattr(error, 'code', None) == 'PGRST202' or 'Could not find the function' in str(error)
+
+
+def _archived_expense_ids(supabase, business_id, month):
+    """Ids of the month's expenses known to be in the archive"""
+    ids = []
+    offset = 0
+    while True:
+        response = supabase.table('expenses') \
+            .select('id') \
+            .eq('business_id', business_id) \
+            .gte('expense_date', month.isoformat()) \
+            .lt('expense_date', _next_month(month).isoformat()) \
+            .not_.is_('archived_at', 'null') \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        data = response.data or []
+        ids.extend(row['id'] for row in data)
+        if len(data) < PAGE_SIZE:
+            return ids
+        offset += PAGE_SIZE
+
+
+def _purge_rows(supabase, table, ids):
+    """
+    Delete archived rows through archive_purge() (migrations/0015) so the trend
+    cube keeps them; without it the rows are deleted directly and leave the cube
+    """
+    for chunk in _chunks(ids):
+        try:
+            supabase.rpc('archive_purge', {'p_table': table, 'p_ids': chunk}).execute()
+            continue
+        except Exception as e:
+            if not _is_missing_function(e):
+                raise
+            print("⚠️ archive_purge() not installed, purged rows are removed from the trend cube")
+
+        if table == 'sales':
+            supabase.table('payment_sessions').delete(returning='minimal').in_('sale_id', chunk).execute()
+            supabase.table('sale_items').delete(returning='minimal').in_('sale_id', chunk).execute()
+            supabase.table('sales').delete(returning='minimal').in_('id', chunk).execute()
+        elif table == 'expenses':
+            supabase.table('expenses').delete(returning='minimal') \
+                .in_('id', chunk) \
+                .not_.is_('archived_at', 'null') \
+                .execute()
+        else:
+            supabase.table(table).delete(returning='minimal').in_('id', chunk).execute()
+
+
+def purge_month(supabase, business_id, month):
+    """
+    Delete one archived month from the live tables
+
+    Refunded sales (and their items) stay live because refunds reference them;
+    reports ignore them anyway since they fall before the watermark. The trend
+    cube keeps the purged rows.
+    """
+    sales = _fetch_month(supabase, 'sales', business_id, month)
+    sale_ids = [sale['id'] for sale in sales]
+    refunded = set()
+    for chunk in _chunks(sale_ids):
+        response = supabase.table('refunds').select('sale_id').in_('sale_id', chunk).execute()
+        refunded.update(row['sale_id'] for row in response.data or [])
+    sale_ids = [sale_id for sale_id in sale_ids if sale_id not in refunded]
+    _purge_rows(supabase, 'sales', sale_ids)
+
+    # Only rows known to be in the archive
+    _purge_rows(supabase, 'expenses', _archived_expense_ids(supabase, business_id, month))
+
+    movement_ids = [row['id'] for row in _fetch_month(supabase, 'inventory_movements', business_id, month)]
+    _purge_rows(supabase, 'inventory_movements', movement_ids)
+
+    print(f"✅ Purged {month:%Y-%m} for {business_id} ({len(refunded)} refunded sales kept)")
+
+
+def archive_business(supabase, business_id, before, purge=False):
+    """
+    Archive every closed month before `before` for one business
+
+    Returns:
+        dict: Table -> rows archived
+    """
+    archived = {}
+    for table, spec in TABLES.items():
+        watermark = archived_through(business_id, table)
+        month = watermark or _first_live_month(supabase, table, business_id)
+        archived[table] = 0
+        if watermark and spec.get('stamped'):
+            archived[table] += _archive_late_rows(supabase, table, business_id, watermark)
+        while month is not None and month < before:
+            rows = _fetch_month(supabase, table, business_id, month)
+            if rows:
+                write_month(table, business_id, month, rows)
+                archived[table] += len(rows)
+                if spec.get('stamped'):
+                    _stamp_archived(supabase, table, rows)
+            month = _next_month(month)
+            _set_watermark(business_id, table, month)
+
+    if purge:
+        # Only months that every table has archived can be purged
+        watermark = min(archived_through(business_id, table) or date.min for table in TABLES)
+        live_months = [_first_live_month(supabase, table, business_id) for table in ('sales', 'expenses')]
+        month = min((m for m in live_months if m), default=None)
+        while month is not None and month < watermark:
+            purge_month(supabase, business_id, month)
+            month = _next_month(month)
+
+    return archived
+
+
+def run_archive(before=None, business_id=None, purge=False):
+    """Archive closed months for one or all businesses"""
+    if not archive_available():
+        print("❌ pyarrow is not installed; archiving is unavailable")
+        return {}
+
+    supabase = get_client()
+    before = _month_start(before) if before else _months_back(date.today().replace(day=1), Config.ARCHIVE_AFTER_MONTHS)
+
+    if business_id:
+        business_ids = [business_id]
+    else:
+        response = supabase.table('businesses').select('id').execute()
+        business_ids = [row['id'] for row in response.data or []]
+
+    results = {}
+    for bid in business_ids:
+        try:
+            results[bid] = archive_business(supabase, bid, before, purge)
+            print(f"✅ Archived {bid} before {before:%Y-%m}: {results[bid]}")
+        except Exception as e:
+            print(f"❌ Archiving failed for {bid}: {str(e)}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive closed months of history to Parquet')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    archive_parser = subparsers.add_parser('archive', help='Archive closed months')
+    archive_parser.add_argument('--business', default=None, help='Only this business id')
+    archive_parser.add_argument('--before', default=None, help='Archive months before YYYY-MM '
+                                '(default: ARCHIVE_AFTER_MONTHS ago)')
+    archive_parser.add_argument('--purge', action='store_true', help='Delete archived rows from the live tables')
+    subparsers.add_parser('status', help='Show archive watermarks')
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        run_archive(f'{args.before}-01' if args.before else None, args.business, args.purge)
+    else:
+        for bid, tables in sorted(load_manifest().items()):
+            print(bid)
+            for table_name, watermark in sorted(tables.items()):
+                print(f"  {table_name}: archived before {watermark}")
@@ -0,0 +1,202 @@
+# login_pipeline.py
+"""
+Login side-writes and cached business membership.
+
+Only the credential check and the session setup run while a user waits at
+login. Login stats (last_login, login_count), password rehashes (see
+passwords.py) and auth_logs rows are queued
+on a background writer that flushes them in batches: one bulk auth_logs
+insert and one record_logins() call (migrations/0010) per batch, so a shift
+change where every cashier signs in at once costs a few writes in total
+instead of three per login.
+
+Users whose business is not on their users row are resolved through
+business_users once and remembered for MEMBERSHIP_CACHE_SECONDS.
+"""
+import atexit
+import queue
+import threading
+import time
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL_SECONDS = 0.5
+MEMBERSHIP_CACHE_SECONDS = 3600
+
+_memberships = {}
+_memberships_lock = threading.Lock()
+
+
+def _is_missing_function(error):
+    return getattr(error, 'code', None) == 'PGRST202' or 'Could not find the function' in str(error)
+
+
+class AuthEventWriter:
+    """Queue of auth_logs rows and login stats, written in batches by a daemon thread"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.supabase = None
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._rpc_available = True
+
+    def log(self, supabase, row):
+        """Queue an auth_logs row"""
+        self._put(supabase, ('log', row))
+
+    def login(self, supabase, user_id, login_count, at):
+        """Queue a successful login's stats (`login_count` is the value read at login)"""
+        self._put(supabase, ('login', {'user_id': user_id, 'login_count': login_count or 0, 'at': at}))
+
+    def rehash(self, supabase, user_id, old_hash, new_hash):
+        """Queue replacing a password hash made with old settings (skipped if the password changed meanwhile)"""
+        self._put(supabase, ('rehash', {'user_id': user_id, 'old_hash': old_hash, 'new_hash': new_hash}))
+
+    def _put(self, supabase, event):
+        self.supabase = supabase
+        self._queue.put(event)
+        self._start_worker()
+
+    def flush(self):
+        """Block until every queued event has been written"""
+        self._queue.join()
+
+    def drain(self):
+        """Write whatever is queued from the calling thread (used at exit)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._process(batch)
+
+    def _start_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        """Worker loop: collect events for up to flush_interval, then write them together"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # Each kind of write fails on its own, so one error does not drop the others
+        logs = [row for kind, row in batch if kind == 'log']
+        logins = [row for kind, row in batch if kind == 'login']
+        rehashes = [row for kind, row in batch if kind == 'rehash']
+        try:
+            if logs:
+                # A bulk insert needs the same columns on every row
+                columns = sorted({column for row in logs for column in row})
+                logs = [{column: row.get(column) for column in columns} for row in logs]
+                self.supabase.table('auth_logs').insert(logs, returning='minimal').execute()
+        except Exception as e:
+            print(f"❌ Auth log batch failed ({len(logs)} logs): {str(e)}")
+
+        try:
+            if logins:
+                self._write_logins(logins)
+        except Exception as e:
+            print(f"❌ Login stats batch failed ({len(logins)} logins): {str(e)}")
+
+        for rehash in rehashes:
+            try:
+                self.supabase.table('users') \
+                    .update({'password_hash': rehash['new_hash']}) \
+                    .eq('id', rehash['user_id']) \
+                    .eq('password_hash', rehash['old_hash']) \
+                    .execute()
+            except Exception as e:
+                print(f"❌ Password rehash failed for user {rehash['user_id']}: {str(e)}")
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def _write_logins(self, logins):
+        # One entry per user: latest login time and how many logins to add
+        per_user = {}
+        for login in logins:
+            entry = per_user.setdefault(login['user_id'], {
+                'user_id': login['user_id'], 'last_login': login['at'], 'logins': 0, 'login_count': 0
+            })
+            entry['last_login'] = max(entry['last_login'], login['at'])
+            entry['logins'] += 1
+            entry['login_count'] = max(entry['login_count'], login['login_count'])
+
+        if self._rpc_available:
+            try:
+                self.supabase.rpc('record_logins', {
+                    'p_logins': [{key: entry[key] for key in ('user_id', 'last_login', 'logins')}
+                                 for entry in per_user.values()]
+                }).execute()
+                return
+            except Exception as e:
+                if not _is_missing_function(e):
+                    raise
+                self._rpc_available = False
+                print("⚠️ record_logins RPC not installed, updating login stats per user")
+
+        for entry in per_user.values():
+            self.supabase.table('users').update({
+                'last_login': entry['last_login'],
+                'login_count': entry['login_count'] + entry['logins']
+            }).eq('id', entry['user_id']).execute()
+
+
+_writer = AuthEventWriter()
+atexit.register(_writer.drain)
+
+
+def get_writer():
+    return _writer
+
+
+def resolve_business(supabase, user):
+    """Business of a user: the users row, else a cached business_users lookup"""
+    if user.get('business_id'):
+        return user['business_id']
+
+    now = time.monotonic()
+    with _memberships_lock:
+        cached = _memberships.get(user['id'])
+        if cached and cached[0] > now:
+            return cached[1]
+
+    business_id = None
+    try:
+        response = supabase.table('business_users') \
+            .select('business_id') \
+            .eq('user_id', user['id']) \
+            .limit(1) \
+            .execute()
+        if response.data:
+            business_id = response.data[0]['business_id']
+    except Exception as e:
+        print(f"⚠️ Could not resolve business membership: {str(e)}")
+
+    # Misses are remembered too, so users without a business do not query on every login
+    with _memberships_lock:
+        _memberships[user['id']] = (now + MEMBERSHIP_CACHE_SECONDS, business_id)
+    return business_id
+
+
+def forget_membership(user_id):
+    """Drop a user's cached business (call when their membership changes)"""
+    with _memberships_lock:
+        _memberships.pop(user_id, None)
@@ -0,0 +1,239 @@
+# mail_service.py
+import hashlib
+import smtplib
+import ssl
+import queue
+import threading
+import time
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from config import Config
+
+
+def build_message(to_email, subject, html_content, text_content=None, from_addr=None):
+    """
+    Build a multipart/alternative email message
+
+    Args:
+        to_email: Recipient email address
+        subject: Email subject
+        html_content: HTML email body
+        text_content: Plain text email body (optional)
+        from_addr: Sender address
+
+    Returns:
+        MIMEMultipart: Message ready to hand to a mailer
+    """
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = from_addr or ''
+    msg['To'] = to_email
+    msg['Date'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %z")
+
+    if text_content:
+        msg.attach(MIMEText(text_content, 'plain'))
+    msg.attach(MIMEText(html_content, 'html'))
+
+    return msg
+
+
+class PooledSMTPMailer:
+    """
+    SMTP sender that keeps one authenticated connection open and reuses it.
+
+    Messages can be sent synchronously with send()/send_many() or queued with
+    enqueue(); a background worker drains the queue in batches over the same
+    session. Dropped connections are re-established and the remaining messages
+    of the batch are retried.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True,
+                 batch_size=None, idle_timeout=None, max_retries=3, timeout=30):
+        self.host = host
+        self.port = int(port or 587)
+        self.username = username
+        # App passwords are often pasted with spaces
+        self.password = password.replace(' ', '') if password else password
+        self.use_tls = use_tls
+        self.batch_size = batch_size or Config.MAIL_POOL_BATCH_SIZE
+        self.idle_timeout = idle_timeout or Config.MAIL_POOL_IDLE_TIMEOUT
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self._conn = None
+        self._last_used = 0
+        self._conn_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    # Connection handling
+
+    def _connect(self):
+        """Open, secure and authenticate a new SMTP session"""
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        conn.ehlo()
+        if self.use_tls:
+            conn.starttls(context=ssl.create_default_context())
+            conn.ehlo()
+        if self.username and self.password:
+            conn.login(self.username, self.password)
+
+        print(f"📧 SMTP session opened to {self.host}:{self.port}")
+        return conn
+
+    def _close(self):
+        """Close the current session, ignoring errors from a dead socket"""
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except Exception:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            self._conn = None
+
+    def _ensure_connection(self):
+        """Return a live session, probing with NOOP if it has been idle"""
+        if self._conn is not None and time.monotonic() - self._last_used > 5:
+            try:
+                code, _ = self._conn.noop()
+                if code != 250:
+                    self._close()
+            except Exception:
+                self._close()
+
+        if self._conn is None:
+            self._conn = self._connect()
+
+        return self._conn
+
+    def _deliver(self, messages):
+        """
+        Deliver messages over the pooled session
+
+        Returns:
+            int: Number of messages accepted by the server
+        """
+        pending = list(messages)
+        sent = 0
+        attempts = 0
+
+        while pending and attempts <= self.max_retries:
+            with self._conn_lock:
+                try:
+                    conn = self._ensure_connection()
+                    while pending:
+                        msg = pending[0]
+                        try:
+                            conn.send_message(msg)
+                            sent += 1
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                                smtplib.SMTPDataError) as e:
+                            # Message-level rejection: drop it, keep the session
+                            print(f"❌ Email to {msg.get('To')} rejected: {str(e)}")
+                        pending.pop(0)
+                        self._last_used = time.monotonic()
+                except smtplib.SMTPAuthenticationError as e:
+                    print(f"❌ SMTP authentication failed: {str(e)}")
+                    self._close()
+                    break
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                        smtplib.SMTPHeloError, OSError) as e:
+                    attempts += 1
+                    print(f"⚠️ SMTP connection lost ({str(e)}), reconnecting (attempt {attempts})")
+                    self._close()
+            if pending:
+                # Back off without holding the session so other senders are not blocked
+                time.sleep(min(0.5 * attempts, 2))
+
+        if pending:
+            print(f"❌ {len(pending)} email(s) could not be delivered")
+
+        return sent
+
+    # Public API
+
+    def send(self, msg):
+        """Send a single message synchronously over the pooled session"""
+        return self._deliver([msg]) == 1
+
+    def send_many(self, messages):
+        """Send a batch of messages over one session"""
+        return self._deliver(messages)
+
+    def enqueue(self, msg):
+        """Queue a message for background delivery"""
+        self._queue.put(msg)
+        self._start_worker()
+
+    def flush(self):
+        """Block until every queued message has been processed"""
+        self._queue.join()
+
+    def close(self):
+        """Close the pooled session"""
+        with self._conn_lock:
+            self._close()
+
+    def set_password(self, password):
+        """Use a new password from the next session on (queued messages are kept)"""
+        with self._conn_lock:
+            self.password = password.replace(' ', '') if password else password
+            self._close()
+
+    def _start_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        """Worker loop: drain the queue in batches, close the session when idle"""
+        while True:
+            try:
+                first = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self.close()
+                continue
+
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                sent = self._deliver(batch)
+                print(f"✅ Email batch delivered: {sent}/{len(batch)}")
+            except Exception as e:
+                print(f"❌ Email batch failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_mailers = {}
+_mailers_lock = threading.Lock()
+
+
+def get_mailer(host, port, username=None, password=None, use_tls=True):
+    """
+    Get the shared mailer for an SMTP account, creating it on first use
+
+    A rotated password is picked up: the mailer reconnects with it.
+    """
+    key = (host, int(port or 587), username, bool(use_tls))
+    fingerprint = hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+    with _mailers_lock:
+        entry = _mailers.get(key)
+        if entry is None:
+            entry = _mailers[key] = [fingerprint, PooledSMTPMailer(host, port, username, password, use_tls)]
+        elif entry[0] != fingerprint:
+            entry[1].set_password(password)
+            entry[0] = fingerprint
+        return entry[1]
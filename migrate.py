@@ -0,0 +1,325 @@
+# migrate.py
+"""
+Versioned SQL migrations.
+
+db.sql creates the base schema; later changes live in migrations/ as
+``NNNN_description.sql`` files applied in version order. Applied versions are
+recorded in the ``schema_migrations`` table with a checksum, so edited files
+are reported instead of silently re-run.
+
+Files are run in one transaction unless their first line is
+``-- migrate:no-transaction`` (needed for CREATE INDEX CONCURRENTLY); those
+are split into statements on ``;`` at line ends and run one at a time, so
+they must not contain function bodies.
+
+Needs a direct Postgres connection (DATABASE_URL, e.g. the Supabase
+connection string) and psycopg2::
+
+    python migrate.py status
+    python migrate.py up [--target 3] [--dry-run]
+    python migrate.py check-indexes
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+from config import Config
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+NO_TRANSACTION = '-- migrate:no-transaction'
+
+_FILENAME_RE = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+_CONCURRENT_INDEX_RE = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?"?(\w+)"?', re.I)
+
+# Hot-path queries and the index each one must use (see migrations/0001)
+SAMPLE_ID = '00000000-0000-0000-0000-000000000000'
+BENCHMARK_QUERIES = [
+    ('sales history',
+     f"SELECT * FROM public.sales WHERE business_id = '{SAMPLE_ID}' ORDER BY created_at DESC LIMIT 50",
+     'sales_business_created_idx'),
+    ('sale items of a sale',
+     f"SELECT * FROM public.sale_items WHERE sale_id = '{SAMPLE_ID}'",
+     'sale_items_sale_id_idx'),
+    ('FIFO lots of a product',
+     f"SELECT id, quantity FROM public.product_lots WHERE product_id = '{SAMPLE_ID}' ORDER BY created_at",
+     'product_lots_product_created_idx'),
+    ('active catalogue',
+     f"SELECT id, name FROM public.products WHERE business_id = '{SAMPLE_ID}' AND is_active = true ORDER BY name",
+     'products_business_active_idx'),
+    ('barcode scan',
+     f"SELECT id FROM public.products WHERE business_id = '{SAMPLE_ID}' AND barcode = '6001234567890'",
+     'products_business_barcode_idx'),
+    ('expenses by date range',
+     f"SELECT * FROM public.expenses WHERE business_id = '{SAMPLE_ID}' "
+     "AND expense_date BETWEEN '2025-01-01' AND '2025-01-31' ORDER BY expense_date DESC",
+     'expenses_business_date_idx'),
+    ('product movement history',
+     f"SELECT * FROM public.inventory_movements WHERE product_id = '{SAMPLE_ID}' ORDER BY created_at DESC LIMIT 50",
+     'inventory_movements_product_created_idx'),
+    ('sales audit log',
+     f"SELECT * FROM public.audit_logs WHERE business_id = '{SAMPLE_ID}' ORDER BY created_at DESC LIMIT 50",
+     'audit_logs_business_created_idx'),
+    ('product audit log',
+     f"SELECT * FROM public.product_audit_logs WHERE business_id = '{SAMPLE_ID}' ORDER BY created_at DESC LIMIT 50",
+     'product_audit_logs_business_created_idx'),
+    ('recent logins',
+     "SELECT * FROM public.auth_logs ORDER BY created_at DESC LIMIT 20",
+     'auth_logs_created_idx'),
+    ('role audit log',
+     "SELECT * FROM public.role_audit_logs ORDER BY created_at DESC LIMIT 100",
+     'role_audit_logs_created_idx'),
+    ('product audit log for a month (partition pruned)',
+     f"SELECT * FROM public.product_audit_logs WHERE business_id = '{SAMPLE_ID}' "
+     "AND created_at >= '2025-01-01' AND created_at < '2025-02-01' ORDER BY created_at DESC",
+     'product_audit_logs_business_created_idx'),
+    ('pending payment sweep',
+     "SELECT * FROM public.payment_sessions WHERE status = 'pending' ORDER BY last_checked_at NULLS FIRST LIMIT 50",
+     'payment_sessions_pending_checked_idx'),
+]
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Individual statements (used for no-transaction migrations)"""
+        lines = [line for line in self.sql.splitlines() if not line.strip().startswith('--')]
+        return [stmt.strip() for stmt in re.split(r';\s*$', '\n'.join(lines), flags=re.M) if stmt.strip()]
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """Migration files in version order"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _FILENAME_RE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort(key=lambda m: m.version)
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError('Duplicate migration version numbers in migrations/')
+    return migrations
+
+
+def connect():
+    """Open a Postgres connection from DATABASE_URL"""
+    try:
+        import psycopg2
+    except ImportError:
+        raise RuntimeError('psycopg2 is required to run migrations (pip install psycopg2-binary)')
+
+    if not Config.DATABASE_URL:
+        raise RuntimeError('DATABASE_URL is not set')
+    return psycopg2.connect(Config.DATABASE_URL)
+
+
+def ensure_tracking_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS public.schema_migrations (
+              version integer NOT NULL,
+              name character varying NOT NULL,
+              checksum character varying NOT NULL,
+              applied_at timestamp with time zone DEFAULT now(),
+              CONSTRAINT schema_migrations_pkey PRIMARY KEY (version)
+            )
+        """)
+    conn.commit()
+
+
+def applied_migrations(conn):
+    """Map of applied version -> checksum"""
+    with conn.cursor() as cur:
+        cur.execute('SELECT version, checksum FROM public.schema_migrations ORDER BY version')
+        return dict(cur.fetchall())
+
+
+def apply_migration(conn, migration):
+    """Run one migration and record it"""
+    record = 'INSERT INTO public.schema_migrations (version, name, checksum) VALUES (%s, %s, %s)'
+    params = (migration.version, migration.name, migration.checksum)
+
+    if migration.transactional:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(migration.sql)
+                cur.execute(record, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return
+
+    # autocommit cannot be switched on inside the transaction earlier reads opened
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index that
+            # IF NOT EXISTS would skip, so drop those before (re)running
+            _drop_invalid_indexes(cur, migration.statements())
+            for statement in migration.statements():
+                cur.execute(statement)
+            cur.execute(record, params)
+    except Exception:
+        with conn.cursor() as cur:
+            invalid = _invalid_indexes(cur, migration.statements())
+        if invalid:
+            print(f"⚠️ Left INVALID indexes: {', '.join(invalid)} (dropped on the next run)")
+        raise
+    finally:
+        conn.autocommit = False
+
+
+def _invalid_indexes(cur, statements):
+    """Indexes built concurrently by these statements that Postgres marked INVALID"""
+    names = [match.group(1) for statement in statements for match in _CONCURRENT_INDEX_RE.finditer(statement)]
+    if not names:
+        return []
+    cur.execute("""
+        SELECT n.nspname || '.' || c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+    """, (names,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _drop_invalid_indexes(cur, statements):
+    for name in _invalid_indexes(cur, statements):
+        print(f"🔄 Dropping INVALID index {name} left by an earlier run")
+        schema, index = name.split('.', 1)
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{schema}"."{index}"')
+
+
+def migrate(conn, target=None, dry_run=False):
+    """
+    Apply pending migrations up to `target` (all if None)
+
+    Returns:
+        list: Versions applied (or that would be applied on a dry run)
+    """
+    ensure_tracking_table(conn)
+    applied = applied_migrations(conn)
+    done = []
+
+    for migration in discover_migrations():
+        if target is not None and migration.version > target:
+            break
+
+        if migration.version in applied:
+            if applied[migration.version] != migration.checksum:
+                print(f"⚠️ Migration {migration.version:04d}_{migration.name} changed after it was applied")
+            continue
+
+        if dry_run:
+            print(f"🔄 Would apply {migration.version:04d}_{migration.name}")
+        else:
+            print(f"🔄 Applying {migration.version:04d}_{migration.name}...")
+            apply_migration(conn, migration)
+            print(f"✅ Applied {migration.version:04d}_{migration.name}")
+        done.append(migration.version)
+
+    if not done:
+        print("✅ Database is up to date")
+    return done
+
+
+def print_status(conn):
+    ensure_tracking_table(conn)
+    applied = applied_migrations(conn)
+    for migration in discover_migrations():
+        if migration.version not in applied:
+            state = 'pending'
+        elif applied[migration.version] != migration.checksum:
+            state = 'applied (file changed)'
+        else:
+            state = 'applied'
+        print(f"{migration.version:04d}_{migration.name}: {state}")
+
+
+def _plan_indexes(plan):
+    """Index names used anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    names = set()
+    if plan.get('Index Name'):
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= _plan_indexes(child)
+    return names
+
+
+def _index_family(cur, index_name):
+    """An index plus the per-partition indexes attached to it (for partitioned tables)"""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('public.' || quote_ident(%s))
+    """, (index_name,))
+    return {index_name} | {row[0] for row in cur.fetchall()}
+
+
+def check_indexes(conn):
+    """
+    EXPLAIN each benchmark query and confirm it uses its index
+
+    Sequential scans are disabled for the check, because on small tables the
+    planner rightly prefers them; this verifies the index can serve the query.
+    On partitioned tables any partition's copy of the index counts.
+
+    Returns:
+        bool: True if every query uses its expected index
+    """
+    ok = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SET LOCAL enable_seqscan = off')
+            for description, sql, expected in BENCHMARK_QUERIES:
+                cur.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                used = _plan_indexes(plan[0]['Plan'])
+                if used & _index_family(cur, expected):
+                    print(f"✅ {description}: {expected}")
+                else:
+                    ok = False
+                    print(f"❌ {description}: expected {expected}, plan uses {', '.join(sorted(used)) or 'no index'}")
+    finally:
+        conn.rollback()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply versioned SQL migrations')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='List migrations and whether they are applied')
+    up_parser = subparsers.add_parser('up', help='Apply pending migrations')
+    up_parser.add_argument('--target', type=int, default=None, help='Stop after this version')
+    up_parser.add_argument('--dry-run', action='store_true', help='List what would be applied')
+    subparsers.add_parser('check-indexes', help='Verify hot-path queries use their indexes')
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        if args.command == 'status':
+            print_status(connection)
+        elif args.command == 'up':
+            migrate(connection, target=args.target, dry_run=args.dry_run)
+        elif args.command == 'check-indexes':
+            sys.exit(0 if check_indexes(connection) else 1)
+    finally:
+        connection.close()
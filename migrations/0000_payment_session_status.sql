@@ -0,0 +1,21 @@
+-- PesaPal reconciliation columns on payment_sessions (payment_reconciler.py),
+-- moved here from db.sql. Numbered 0000 because 0001 indexes them.
+--
+-- Existing sessions are given the status of their sale instead of 'pending',
+-- so the sweep does not re-check (and expire) sessions settled long ago.
+-- Refunded sales were paid, so their sessions count as completed.
+
+ALTER TABLE public.payment_sessions
+  ADD COLUMN IF NOT EXISTS status character varying NOT NULL DEFAULT 'pending'::character varying,
+  ADD COLUMN IF NOT EXISTS last_checked_at timestamp with time zone,
+  ADD COLUMN IF NOT EXISTS check_count integer NOT NULL DEFAULT 0;
+
+UPDATE public.payment_sessions ps
+SET status = CASE WHEN s.payment_status IN ('refunded', 'partially_refunded') THEN 'completed'
+                  ELSE s.payment_status END
+FROM public.sales s
+WHERE s.id = ps.sale_id
+  AND ps.status = 'pending'
+  AND s.payment_status IN ('completed', 'failed', 'refunded', 'partially_refunded');
+
+NOTIFY pgrst, 'reload schema';
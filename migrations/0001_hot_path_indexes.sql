@@ -0,0 +1,71 @@
+-- migrate:no-transaction
+-- Secondary indexes for the filters and sort orders the routes use on every request.
+-- Built CONCURRENTLY so applying them does not block writes on a live database.
+
+-- Sales history, dashboard and reports: WHERE business_id = ? ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_business_created_idx
+  ON public.sales (business_id, created_at DESC);
+
+-- Pending payments swept by the reconciler
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_business_pending_idx
+  ON public.sales (business_id, created_at)
+  WHERE payment_status = 'pending';
+
+-- Receipts, refunds and history: items of a sale
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sale_items_sale_id_idx
+  ON public.sale_items (sale_id);
+
+-- Per-product sales (top sellers, product detail)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sale_items_product_created_idx
+  ON public.sale_items (product_id, created_at DESC);
+
+-- Stock sums and FIFO lot consumption: WHERE product_id = ? ORDER BY created_at
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_lots_product_created_idx
+  ON public.product_lots (product_id, created_at)
+  INCLUDE (quantity);
+
+-- Catalogue, terminal and stock alerts only read active products
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_business_active_idx
+  ON public.products (business_id, name)
+  WHERE is_active = true;
+
+-- Barcode scans and SKU lookups
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_business_barcode_idx
+  ON public.products (business_id, barcode)
+  WHERE barcode IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_business_sku_idx
+  ON public.products (business_id, sku)
+  WHERE sku IS NOT NULL;
+
+-- Expense lists and reports: WHERE business_id = ? AND expense_date BETWEEN ...
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expenses_business_date_idx
+  ON public.expenses (business_id, expense_date DESC);
+
+-- Product movement history
+CREATE INDEX CONCURRENTLY IF NOT EXISTS inventory_movements_product_created_idx
+  ON public.inventory_movements (product_id, created_at DESC);
+
+-- Audit log viewers: newest first per business / product / user
+CREATE INDEX CONCURRENTLY IF NOT EXISTS audit_logs_business_created_idx
+  ON public.audit_logs (business_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_audit_logs_business_created_idx
+  ON public.product_audit_logs (business_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_audit_logs_product_created_idx
+  ON public.product_audit_logs (product_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_logs_created_idx
+  ON public.auth_logs (created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_logs_user_created_idx
+  ON public.auth_logs (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS role_audit_logs_created_idx
+  ON public.role_audit_logs (created_at DESC);
+
+-- Payment reconciliation: pending sessions, least recently checked first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS payment_sessions_pending_checked_idx
+  ON public.payment_sessions (last_checked_at NULLS FIRST)
+  WHERE status = 'pending';
@@ -0,0 +1,200 @@
+-- Monthly range partitioning on created_at for the append-only history tables:
+-- inventory_movements, audit_logs, product_audit_logs, role_audit_logs, auth_logs.
+--
+-- Each table is rebuilt as a partitioned table (primary key becomes (id, created_at)),
+-- its rows are copied into monthly partitions and its foreign keys and indexes are
+-- recreated. The copy holds an exclusive lock, so run this in a quiet period.
+--
+-- sales and sale_items are not partitioned: sale_items, payment_sessions and refunds
+-- reference sales(id), and a partitioned sales table could only be referenced through
+-- (id, created_at), which would drop those foreign keys and the PostgREST embeds built
+-- on them. Their growth is handled by the 0001 indexes and the Parquet archive.
+
+-- Partitions are named <table>_pYYYYMM; rows outside every month land in <table>_default.
+CREATE OR REPLACE FUNCTION public.ensure_monthly_partitions(
+  p_table text,
+  p_from date,
+  p_months integer DEFAULT 3
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_start date;
+  v_end date;
+  v_name text;
+  v_default text := p_table || '_default';
+  v_has_rows boolean;
+  v_created integer := 0;
+BEGIN
+  FOR i IN 0..p_months - 1 LOOP
+    v_start := (date_trunc('month', p_from) + make_interval(months => i))::date;
+    v_end := (v_start + interval '1 month')::date;
+    v_name := p_table || '_p' || to_char(v_start, 'YYYYMM');
+
+    IF to_regclass('public.' || quote_ident(v_name)) IS NOT NULL THEN
+      CONTINUE;
+    END IF;
+
+    v_has_rows := false;
+    IF to_regclass('public.' || quote_ident(v_default)) IS NOT NULL THEN
+      EXECUTE format('SELECT EXISTS (SELECT 1 FROM public.%I WHERE created_at >= %L AND created_at < %L)',
+                     v_default, v_start, v_end)
+        INTO v_has_rows;
+    END IF;
+
+    IF v_has_rows THEN
+      -- Rows already fell into the default partition: move them into a new table, then attach it
+      EXECUTE format('CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                     v_name, p_table);
+      EXECUTE format('WITH moved AS (DELETE FROM public.%I WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                     'INSERT INTO public.%I SELECT * FROM moved',
+                     v_default, v_start, v_end, v_name);
+      EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                     p_table, v_name, v_start, v_end);
+    ELSE
+      EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                     v_name, p_table, v_start, v_end);
+    END IF;
+    v_created := v_created + 1;
+  END LOOP;
+
+  RETURN v_created;
+END;
+$$;
+
+-- Rebuild an existing table as a monthly partitioned table, keeping rows, foreign keys and indexes
+CREATE OR REPLACE FUNCTION public.partition_by_month(p_table text, p_months_ahead integer DEFAULT 3)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_legacy text := p_table || '_unpartitioned';
+  v_first date;
+  v_months integer;
+  v_fkeys text[];
+  v_indexes text[];
+  v_def text;
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = ('public.' || quote_ident(p_table))::regclass) THEN
+    RETURN;
+  END IF;
+
+  SELECT array_agg(format('ALTER TABLE public.%I ADD CONSTRAINT %I %s', p_table, conname, pg_get_constraintdef(oid)))
+    INTO v_fkeys
+    FROM pg_constraint
+    WHERE conrelid = ('public.' || quote_ident(p_table))::regclass AND contype = 'f';
+
+  SELECT array_agg(indexdef)
+    INTO v_indexes
+    FROM pg_indexes
+    WHERE schemaname = 'public' AND tablename = p_table
+      AND indexname NOT IN (SELECT conname FROM pg_constraint
+                            WHERE conrelid = ('public.' || quote_ident(p_table))::regclass AND contype IN ('p', 'u'));
+
+  EXECUTE format('ALTER TABLE public.%I RENAME TO %I', p_table, v_legacy);
+  EXECUTE format('CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                 'PARTITION BY RANGE (created_at)', p_table, v_legacy);
+  EXECUTE format('UPDATE public.%I SET created_at = now() WHERE created_at IS NULL', v_legacy);
+  EXECUTE format('ALTER TABLE public.%I ALTER COLUMN created_at SET NOT NULL', p_table);
+  EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', p_table || '_default', p_table);
+
+  EXECUTE format('SELECT min(created_at)::date FROM public.%I', v_legacy) INTO v_first;
+  v_first := date_trunc('month', coalesce(v_first, now()))::date;
+  v_months := (extract(year FROM age(date_trunc('month', now()), v_first)) * 12
+               + extract(month FROM age(date_trunc('month', now()), v_first)))::integer + 1 + p_months_ahead;
+  PERFORM public.ensure_monthly_partitions(p_table, v_first, v_months);
+
+  EXECUTE format('INSERT INTO public.%I SELECT * FROM public.%I', p_table, v_legacy);
+  EXECUTE format('DROP TABLE public.%I', v_legacy);
+
+  EXECUTE format('ALTER TABLE public.%I ADD CONSTRAINT %I PRIMARY KEY (id, created_at)', p_table, p_table || '_pkey');
+  FOREACH v_def IN ARRAY coalesce(v_fkeys, '{}') LOOP
+    EXECUTE v_def;
+  END LOOP;
+  -- Index definitions were read before the rename, so they already target the new table
+  FOREACH v_def IN ARRAY coalesce(v_indexes, '{}') LOOP
+    EXECUTE v_def;
+  END LOOP;
+END;
+$$;
+
+-- Detach (and by default drop) whole months older than the retention window
+CREATE OR REPLACE FUNCTION public.apply_partition_retention(
+  p_table text,
+  p_keep_months integer,
+  p_drop boolean DEFAULT true
+)
+RETURNS SETOF text
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_cutoff date := (date_trunc('month', now()) - make_interval(months => p_keep_months))::date;
+  v_partition record;
+BEGIN
+  FOR v_partition IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = ('public.' || quote_ident(p_table))::regclass
+      AND c.relname ~ ('^' || p_table || '_p[0-9]{6}$')
+    ORDER BY c.relname
+  LOOP
+    IF to_date(right(v_partition.relname, 6), 'YYYYMM') >= v_cutoff THEN
+      EXIT;
+    END IF;
+    EXECUTE format('ALTER TABLE public.%I DETACH PARTITION public.%I', p_table, v_partition.relname);
+    IF p_drop THEN
+      EXECUTE format('DROP TABLE public.%I', v_partition.relname);
+    END IF;
+    RETURN NEXT v_partition.relname;
+  END LOOP;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.ensure_history_partitions(p_months_ahead integer DEFAULT 3)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  SELECT coalesce(sum(public.ensure_monthly_partitions(t, current_date, p_months_ahead + 1)), 0)::integer
+  FROM unnest(ARRAY['inventory_movements', 'audit_logs', 'product_audit_logs',
+                    'role_audit_logs', 'auth_logs']) AS t;
+$$;
+
+-- Maintenance functions must not be callable through the public API
+DO $$
+DECLARE
+  v_function text;
+  v_roles text := 'PUBLIC';
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+    v_roles := 'PUBLIC, anon, authenticated';
+  END IF;
+  FOREACH v_function IN ARRAY ARRAY[
+    'public.ensure_monthly_partitions(text, date, integer)',
+    'public.partition_by_month(text, integer)',
+    'public.apply_partition_retention(text, integer, boolean)',
+    'public.ensure_history_partitions(integer)'
+  ] LOOP
+    EXECUTE format('REVOKE EXECUTE ON FUNCTION %s FROM %s', v_function, v_roles);
+  END LOOP;
+END;
+$$;
+
+SELECT public.partition_by_month('inventory_movements');
+SELECT public.partition_by_month('audit_logs');
+SELECT public.partition_by_month('product_audit_logs');
+SELECT public.partition_by_month('role_audit_logs');
+SELECT public.partition_by_month('auth_logs');
+
+-- Create next months' partitions automatically where pg_cron is available
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+    PERFORM cron.schedule('ensure-history-partitions', '0 3 * * *',
+                          'SELECT public.ensure_history_partitions(3)');
+  END IF;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
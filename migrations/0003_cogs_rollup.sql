@@ -0,0 +1,95 @@
+-- Cost of goods sold recorded at checkout and rolled up per business, day and product.
+--
+-- Checkout consumes lots FIFO and stores the cost it consumed on each sale item
+-- (sale_items.cost_amount) and movement (inventory_movements.unit_cost). A trigger
+-- adds every sale item into sales_daily_rollup, so gross margin per day, product and
+-- category is read from the rollup instead of replaying lots.
+--
+-- Deleting sale items does not subtract from the rollup: the archive purges old
+-- months from the live tables, and their margins must stay reportable.
+
+ALTER TABLE public.sale_items ADD COLUMN IF NOT EXISTS cost_amount numeric NOT NULL DEFAULT 0;
+ALTER TABLE public.inventory_movements ADD COLUMN IF NOT EXISTS unit_cost numeric;
+
+CREATE TABLE IF NOT EXISTS public.sales_daily_rollup (
+  business_id uuid NOT NULL,
+  sale_date date NOT NULL,
+  product_id uuid NOT NULL,
+  category_id uuid,
+  quantity integer NOT NULL DEFAULT 0,
+  revenue numeric NOT NULL DEFAULT 0,
+  cogs numeric NOT NULL DEFAULT 0,
+  updated_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT sales_daily_rollup_pkey PRIMARY KEY (business_id, sale_date, product_id),
+  CONSTRAINT sales_daily_rollup_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id),
+  CONSTRAINT sales_daily_rollup_product_id_fkey FOREIGN KEY (product_id) REFERENCES public.products(id),
+  CONSTRAINT sales_daily_rollup_category_id_fkey FOREIGN KEY (category_id) REFERENCES public.categories(id)
+);
+
+-- No checkouts while existing items are costed and rolled up
+LOCK TABLE public.sale_items IN SHARE ROW EXCLUSIVE MODE;
+
+-- Items sold before lot costs were recorded are costed at the product's current cost price
+UPDATE public.sale_items si
+SET cost_amount = si.quantity * coalesce(p.cost_price, 0)
+FROM public.products p
+WHERE p.id = si.product_id AND si.cost_amount = 0;
+
+INSERT INTO public.sales_daily_rollup (business_id, sale_date, product_id, category_id, quantity, revenue, cogs)
+SELECT s.business_id, (s.created_at AT TIME ZONE 'UTC')::date, si.product_id, max(p.category_id::text)::uuid,
+       sum(si.quantity), sum(si.total_price), sum(si.cost_amount)
+FROM public.sale_items si
+JOIN public.sales s ON s.id = si.sale_id
+LEFT JOIN public.products p ON p.id = si.product_id
+GROUP BY 1, 2, 3
+ON CONFLICT (business_id, sale_date, product_id) DO NOTHING;
+
+-- Add each new (or changed) sale item to its sale day
+CREATE OR REPLACE FUNCTION public.rollup_sale_item()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_business_id uuid;
+  v_sale_date date;
+  v_category_id uuid;
+  v_quantity integer := NEW.quantity;
+  v_revenue numeric := NEW.total_price;
+  v_cogs numeric := NEW.cost_amount;
+BEGIN
+  SELECT business_id, (created_at AT TIME ZONE 'UTC')::date
+    INTO v_business_id, v_sale_date
+    FROM public.sales
+    WHERE id = NEW.sale_id;
+  IF v_business_id IS NULL THEN
+    RETURN NEW;
+  END IF;
+
+  SELECT category_id INTO v_category_id FROM public.products WHERE id = NEW.product_id;
+
+  IF TG_OP = 'UPDATE' THEN
+    v_quantity := NEW.quantity - OLD.quantity;
+    v_revenue := NEW.total_price - OLD.total_price;
+    v_cogs := NEW.cost_amount - OLD.cost_amount;
+  END IF;
+
+  INSERT INTO public.sales_daily_rollup AS r
+    (business_id, sale_date, product_id, category_id, quantity, revenue, cogs)
+  VALUES (v_business_id, v_sale_date, NEW.product_id, v_category_id, v_quantity, v_revenue, v_cogs)
+  ON CONFLICT (business_id, sale_date, product_id) DO UPDATE
+    SET quantity = r.quantity + EXCLUDED.quantity,
+        revenue = r.revenue + EXCLUDED.revenue,
+        cogs = r.cogs + EXCLUDED.cogs,
+        category_id = coalesce(EXCLUDED.category_id, r.category_id),
+        updated_at = now();
+
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS sale_items_rollup ON public.sale_items;
+CREATE TRIGGER sale_items_rollup
+  AFTER INSERT OR UPDATE OF quantity, total_price, cost_amount ON public.sale_items
+  FOR EACH ROW EXECUTE FUNCTION public.rollup_sale_item();
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,198 @@
+-- Per-business trend cube: count and amount per period (day, week, month) and
+-- dimension member, kept current by triggers so charts read a handful of rows
+-- instead of scanning sales and expenses.
+--
+-- Dimensions: sales by payment_method, status and cashier (sold_by), sales by
+-- category (from sale_items), and expenses by category, status, payment_method
+-- and cashier (created_by). The 'all' dimension holds the plain totals.
+--
+-- The cube mirrors the live tables, so deletes are subtracted (unlike
+-- sales_daily_rollup, which keeps margins for purged months).
+
+CREATE TABLE IF NOT EXISTS public.trend_cube (
+  business_id uuid NOT NULL,
+  fact text NOT NULL CHECK (fact = ANY (ARRAY['sales'::text, 'expenses'::text])),
+  grain text NOT NULL CHECK (grain = ANY (ARRAY['day'::text, 'week'::text, 'month'::text])),
+  period date NOT NULL,
+  dimension text NOT NULL,
+  member text NOT NULL DEFAULT '',
+  count bigint NOT NULL DEFAULT 0,
+  amount numeric NOT NULL DEFAULT 0,
+  updated_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT trend_cube_pkey PRIMARY KEY (business_id, fact, grain, dimension, period, member),
+  CONSTRAINT trend_cube_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id)
+);
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one fact at every grain for each dimension/member pair
+CREATE OR REPLACE FUNCTION public.trend_cube_add(
+  p_business_id uuid,
+  p_fact text,
+  p_day date,
+  p_dimensions text[],
+  p_members text[],
+  p_count integer,
+  p_amount numeric,
+  p_sign integer
+)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_grain text;
+BEGIN
+  IF p_business_id IS NULL OR p_day IS NULL THEN
+    RETURN;
+  END IF;
+
+  FOREACH v_grain IN ARRAY ARRAY['day', 'week', 'month'] LOOP
+    FOR i IN 1..array_length(p_dimensions, 1) LOOP
+      INSERT INTO public.trend_cube AS c (business_id, fact, grain, period, dimension, member, count, amount)
+      VALUES (p_business_id, p_fact, v_grain, date_trunc(v_grain, p_day::timestamp)::date, p_dimensions[i],
+              coalesce(p_members[i], ''), p_sign * p_count, p_sign * coalesce(p_amount, 0))
+      ON CONFLICT (business_id, fact, grain, dimension, period, member) DO UPDATE
+        SET count = c.count + EXCLUDED.count,
+            amount = c.amount + EXCLUDED.amount,
+            updated_at = now();
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_sales()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add(OLD.business_id, 'sales', (OLD.created_at AT TIME ZONE 'UTC')::date,
+                                  ARRAY['all', 'payment_method', 'status', 'cashier'],
+                                  ARRAY['all', OLD.payment_method, OLD.payment_status, OLD.sold_by::text],
+                                  1, OLD.total_amount, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add(NEW.business_id, 'sales', (NEW.created_at AT TIME ZONE 'UTC')::date,
+                                  ARRAY['all', 'payment_method', 'status', 'cashier'],
+                                  ARRAY['all', NEW.payment_method, NEW.payment_status, NEW.sold_by::text],
+                                  1, NEW.total_amount, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+-- Sales by category come from the items; count is units sold
+CREATE OR REPLACE FUNCTION public.trend_cube_add_item(
+  p_sale_id uuid,
+  p_product_id uuid,
+  p_quantity integer,
+  p_total_price numeric,
+  p_sign integer
+)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_business_id uuid;
+  v_day date;
+  v_category_id uuid;
+BEGIN
+  SELECT business_id, (created_at AT TIME ZONE 'UTC')::date
+    INTO v_business_id, v_day
+    FROM public.sales
+    WHERE id = p_sale_id;
+  SELECT category_id INTO v_category_id FROM public.products WHERE id = p_product_id;
+
+  PERFORM public.trend_cube_add(v_business_id, 'sales', v_day, ARRAY['category'],
+                                ARRAY[coalesce(v_category_id::text, '')],
+                                p_quantity, p_total_price, p_sign);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_sale_items()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add_item(OLD.sale_id, OLD.product_id, OLD.quantity, OLD.total_price, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add_item(NEW.sale_id, NEW.product_id, NEW.quantity, NEW.total_price, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_expenses()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add(OLD.business_id, 'expenses', OLD.expense_date,
+                                  ARRAY['all', 'category', 'status', 'payment_method', 'cashier'],
+                                  ARRAY['all', OLD.category, OLD.status, OLD.payment_method, OLD.created_by::text],
+                                  1, OLD.amount, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add(NEW.business_id, 'expenses', NEW.expense_date,
+                                  ARRAY['all', 'category', 'status', 'payment_method', 'cashier'],
+                                  ARRAY['all', NEW.category, NEW.status, NEW.payment_method, NEW.created_by::text],
+                                  1, NEW.amount, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+-- Build the cube from the existing rows with writers paused
+LOCK TABLE public.sales, public.sale_items, public.expenses IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM public.trend_cube;
+
+INSERT INTO public.trend_cube (business_id, fact, grain, period, dimension, member, count, amount)
+SELECT s.business_id, 'sales', g.grain, date_trunc(g.grain, s.created_at AT TIME ZONE 'UTC')::date,
+       d.dimension, coalesce(d.member, ''), count(*), coalesce(sum(s.total_amount), 0)
+FROM public.sales s
+CROSS JOIN unnest(ARRAY['day', 'week', 'month']) AS g(grain)
+CROSS JOIN LATERAL (VALUES ('all', 'all'), ('payment_method', s.payment_method),
+                           ('status', s.payment_status), ('cashier', s.sold_by::text)) AS d(dimension, member)
+WHERE s.created_at IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+INSERT INTO public.trend_cube (business_id, fact, grain, period, dimension, member, count, amount)
+SELECT s.business_id, 'sales', g.grain, date_trunc(g.grain, s.created_at AT TIME ZONE 'UTC')::date,
+       'category', coalesce(p.category_id::text, ''), sum(si.quantity), coalesce(sum(si.total_price), 0)
+FROM public.sale_items si
+JOIN public.sales s ON s.id = si.sale_id
+LEFT JOIN public.products p ON p.id = si.product_id
+CROSS JOIN unnest(ARRAY['day', 'week', 'month']) AS g(grain)
+WHERE s.created_at IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+INSERT INTO public.trend_cube (business_id, fact, grain, period, dimension, member, count, amount)
+SELECT e.business_id, 'expenses', g.grain, date_trunc(g.grain, e.expense_date::timestamp)::date,
+       d.dimension, coalesce(d.member, ''), count(*), coalesce(sum(e.amount), 0)
+FROM public.expenses e
+CROSS JOIN unnest(ARRAY['day', 'week', 'month']) AS g(grain)
+CROSS JOIN LATERAL (VALUES ('all', 'all'), ('category', e.category), ('status', e.status),
+                           ('payment_method', e.payment_method), ('cashier', e.created_by::text)) AS d(dimension, member)
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+DROP TRIGGER IF EXISTS sales_trend_cube ON public.sales;
+CREATE TRIGGER sales_trend_cube
+  AFTER INSERT OR DELETE OR UPDATE OF business_id, created_at, total_amount, payment_method, payment_status, sold_by
+  ON public.sales
+  FOR EACH ROW EXECUTE FUNCTION public.trend_cube_sales();
+
+DROP TRIGGER IF EXISTS sale_items_trend_cube ON public.sale_items;
+CREATE TRIGGER sale_items_trend_cube
+  AFTER INSERT OR DELETE OR UPDATE OF sale_id, product_id, quantity, total_price
+  ON public.sale_items
+  FOR EACH ROW EXECUTE FUNCTION public.trend_cube_sale_items();
+
+DROP TRIGGER IF EXISTS expenses_trend_cube ON public.expenses;
+CREATE TRIGGER expenses_trend_cube
+  AFTER INSERT OR DELETE OR UPDATE OF business_id, expense_date, amount, category, status, payment_method, created_by
+  ON public.expenses
+  FOR EACH ROW EXECUTE FUNCTION public.trend_cube_expenses();
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,128 @@
+-- Refunds applied in one transaction: refund record, restock, refund_items,
+-- IN movements, sale status and audit log.
+--
+-- Restock returns each unit to the lot the sale took it from (the sale's OUT
+-- movements, at the cost recorded at checkout). Units no live lot can take back
+-- go into one new REFUND-<id> lot per product, costed at the sale item's cost.
+
+CREATE OR REPLACE FUNCTION public.process_refund(
+  p_sale_id uuid,
+  p_business_id uuid,
+  p_refunded_by uuid,
+  p_amount numeric DEFAULT NULL,
+  p_reason text DEFAULT NULL,
+  p_notes text DEFAULT NULL,
+  p_restock boolean DEFAULT true
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_sale public.sales%ROWTYPE;
+  v_refund_id uuid := gen_random_uuid();
+  v_refundable numeric;
+  v_amount numeric;
+  v_status text;
+  v_product_ids uuid[] := '{}';
+BEGIN
+  SELECT * INTO v_sale
+    FROM public.sales
+    WHERE id = p_sale_id AND business_id = p_business_id
+    FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Sale not found';
+  END IF;
+  IF v_sale.payment_status = 'refunded' THEN
+    RAISE EXCEPTION 'Sale has already been refunded';
+  END IF;
+
+  v_refundable := v_sale.total_amount - coalesce(v_sale.refund_amount, 0);
+  v_amount := coalesce(p_amount, v_refundable);
+  IF v_amount <= 0 OR v_amount > v_refundable THEN
+    RAISE EXCEPTION 'Refund amount must be between 0 and %', v_refundable;
+  END IF;
+  v_status := CASE WHEN v_amount >= v_refundable THEN 'refunded' ELSE 'partially_refunded' END;
+
+  INSERT INTO public.refunds (id, business_id, sale_id, refund_amount, refund_reason, refunded_by,
+                              payment_method, status, notes)
+  VALUES (v_refund_id, p_business_id, p_sale_id, v_amount, p_reason, p_refunded_by,
+          v_sale.payment_method, 'completed', p_notes);
+
+  IF p_restock THEN
+    WITH items AS (
+      SELECT product_id, sum(quantity)::integer AS quantity, sum(cost_amount) AS cost_amount
+      FROM public.sale_items
+      WHERE sale_id = p_sale_id
+      GROUP BY product_id
+    ), consumed AS (
+      SELECT m.product_id, m.lot_id, sum(m.quantity)::integer AS quantity, max(m.unit_cost) AS unit_cost
+      FROM public.inventory_movements m
+      JOIN items i ON i.product_id = m.product_id
+      WHERE m.reference = 'Sale: ' || v_sale.invoice_number
+        AND m.movement_type = 'OUT'
+        AND m.lot_id IS NOT NULL
+        AND m.created_at >= v_sale.created_at
+      GROUP BY m.product_id, m.lot_id
+    ), restocked AS (
+      UPDATE public.product_lots l
+      SET quantity = l.quantity + c.quantity,
+          updated_at = now()
+      FROM consumed c
+      WHERE l.id = c.lot_id
+      RETURNING l.id AS lot_id, l.product_id, c.quantity, coalesce(c.unit_cost, l.cost_price) AS unit_cost
+    ), shortfall AS (
+      SELECT i.product_id,
+             i.quantity - coalesce((SELECT sum(r.quantity) FROM restocked r WHERE r.product_id = i.product_id), 0)
+               AS quantity,
+             CASE WHEN i.quantity > 0 THEN i.cost_amount / i.quantity END AS unit_cost
+      FROM items i
+    ), new_lots AS (
+      INSERT INTO public.product_lots (product_id, lot_number, quantity, cost_price, created_by)
+      SELECT product_id, 'REFUND-' || left(v_refund_id::text, 8), quantity, unit_cost, p_refunded_by
+      FROM shortfall
+      WHERE quantity > 0
+      RETURNING id AS lot_id, product_id, quantity, cost_price AS unit_cost
+    ), movements AS (
+      INSERT INTO public.inventory_movements (product_id, lot_id, movement_type, quantity, unit_cost,
+                                              reference, created_by)
+      SELECT product_id, lot_id, 'IN', quantity, unit_cost, 'Refund: ' || v_sale.invoice_number, p_refunded_by
+      FROM (SELECT * FROM restocked UNION ALL SELECT * FROM new_lots) returned
+      RETURNING product_id
+    )
+    SELECT coalesce(array_agg(DISTINCT product_id), '{}') INTO v_product_ids FROM movements;
+
+    INSERT INTO public.refund_items (refund_id, product_id, quantity, unit_price, total_price, reason)
+    SELECT v_refund_id, product_id, quantity, unit_price, total_price, p_reason
+    FROM public.sale_items
+    WHERE sale_id = p_sale_id;
+  END IF;
+
+  UPDATE public.sales
+  SET payment_status = v_status,
+      refund_id = v_refund_id,
+      refund_amount = coalesce(refund_amount, 0) + v_amount,
+      updated_at = now()
+  WHERE id = p_sale_id;
+
+  IF p_refunded_by IS NOT NULL THEN
+    INSERT INTO public.audit_logs (business_id, user_id, action, description, details)
+    VALUES (p_business_id, p_refunded_by,
+            CASE WHEN p_restock THEN 'refund' ELSE 'partial_refund' END,
+            CASE WHEN p_restock THEN 'Full refund processed for sale ' || v_sale.invoice_number
+                 ELSE 'Partial refund of UGX ' || to_char(v_amount, 'FM999999999990.00') || ' for sale ' || v_sale.invoice_number
+            END,
+            jsonb_build_object('sale_id', p_sale_id, 'refund_id', v_refund_id, 'original_amount', v_sale.total_amount,
+                               'refund_amount', v_amount, 'reason', p_reason, 'restocked_products', to_jsonb(v_product_ids)));
+  END IF;
+
+  RETURN jsonb_build_object(
+    'refund_id', v_refund_id,
+    'refund_amount', v_amount,
+    'payment_status', v_status,
+    'invoice_number', v_sale.invoice_number,
+    'restocked_products', to_jsonb(v_product_ids)
+  );
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
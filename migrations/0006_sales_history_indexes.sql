@@ -0,0 +1,23 @@
+-- migrate:no-transaction
+-- Indexes behind the keyset-paginated sales history (sales_history.py).
+-- Pages walk (business_id, created_at, id); each filter has an index that keeps
+-- the same order so a page stops after per_page + 1 rows.
+
+-- Cursor order with the id tiebreak
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_business_created_id_idx
+  ON public.sales (business_id, created_at DESC, id DESC);
+
+-- Status filter
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_business_status_created_idx
+  ON public.sales (business_id, payment_status, created_at DESC);
+
+-- Cashier filter
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_business_sold_by_created_idx
+  ON public.sales (business_id, sold_by, created_at DESC);
+
+-- Invoice search (ILIKE '%term%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sales_invoice_number_trgm_idx
+  ON public.sales USING gin (invoice_number gin_trgm_ops);
+
+NOTIFY pgrst, 'reload schema';
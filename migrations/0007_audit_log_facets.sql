@@ -0,0 +1,78 @@
+-- Audit log viewer: filter indexes and a facet table for the action and user
+-- dropdowns and the summary cards.
+--
+-- audit_logs is partitioned (0002), so the indexes are built with a plain
+-- CREATE INDEX (CONCURRENTLY is not supported on partitioned tables) and
+-- cascade to every partition.
+--
+-- audit_log_facets holds per-business counts by action and by user. It is a
+-- snapshot, rebuilt by refresh_audit_log_facets() when the app finds it stale
+-- and nightly by pg_cron where available, so writing an audit log costs nothing extra.
+
+CREATE INDEX IF NOT EXISTS audit_logs_business_action_created_idx
+  ON public.audit_logs (business_id, action, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS audit_logs_business_user_created_idx
+  ON public.audit_logs (business_id, user_id, created_at DESC);
+
+CREATE TABLE IF NOT EXISTS public.audit_log_facets (
+  business_id uuid NOT NULL,
+  facet text NOT NULL CHECK (facet = ANY (ARRAY['action'::text, 'user'::text])),
+  value text NOT NULL,
+  label text,
+  detail text,
+  count bigint NOT NULL DEFAULT 0,
+  last_seen timestamp with time zone,
+  refreshed_at timestamp with time zone NOT NULL DEFAULT now(),
+  CONSTRAINT audit_log_facets_pkey PRIMARY KEY (business_id, facet, value),
+  CONSTRAINT audit_log_facets_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id)
+);
+
+-- Rebuild the facets of one business (or of every business when NULL); returns the rows written
+CREATE OR REPLACE FUNCTION public.refresh_audit_log_facets(p_business_id uuid DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_rows integer;
+  v_users integer;
+BEGIN
+  DELETE FROM public.audit_log_facets
+  WHERE p_business_id IS NULL OR business_id = p_business_id;
+
+  INSERT INTO public.audit_log_facets (business_id, facet, value, label, count, last_seen)
+  SELECT business_id, 'action', action, initcap(replace(action, '_', ' ')), count(*), max(created_at)
+  FROM public.audit_logs
+  WHERE p_business_id IS NULL OR business_id = p_business_id
+  GROUP BY business_id, action;
+  GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+  INSERT INTO public.audit_log_facets (business_id, facet, value, label, detail, count, last_seen)
+  SELECT a.business_id, 'user', a.user_id::text,
+         nullif(trim(coalesce(u.first_name, '') || ' ' || coalesce(u.last_name, '')), ''),
+         u.role, a.count, a.last_seen
+  FROM (
+    SELECT business_id, user_id, count(*) AS count, max(created_at) AS last_seen
+    FROM public.audit_logs
+    WHERE p_business_id IS NULL OR business_id = p_business_id
+    GROUP BY business_id, user_id
+  ) a
+  LEFT JOIN public.users u ON u.id = a.user_id;
+  GET DIAGNOSTICS v_users = ROW_COUNT;
+
+  RETURN v_rows + v_users;
+END;
+$$;
+
+SELECT public.refresh_audit_log_facets();
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+    PERFORM cron.schedule('refresh-audit-log-facets', '30 3 * * *',
+                          'SELECT public.refresh_audit_log_facets()');
+  END IF;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
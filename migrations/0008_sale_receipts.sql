@@ -0,0 +1,37 @@
+-- Receipts rendered once at checkout (receipts.py): the JSON payload, the
+-- receipt page HTML and the ESC/POS bytes (base64), one row per sale.
+--
+-- A receipt shows the payment status, so the row is dropped whenever the sale's
+-- status or amounts change (PesaPal settlement, refunds) and the app renders it
+-- again on the next view.
+
+CREATE TABLE IF NOT EXISTS public.sale_receipts (
+  sale_id uuid NOT NULL,
+  business_id uuid NOT NULL,
+  payment_status character varying,
+  payload jsonb NOT NULL,
+  html text NOT NULL,
+  escpos text,
+  created_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT sale_receipts_pkey PRIMARY KEY (sale_id),
+  CONSTRAINT sale_receipts_sale_id_fkey FOREIGN KEY (sale_id) REFERENCES public.sales(id) ON DELETE CASCADE,
+  CONSTRAINT sale_receipts_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id)
+);
+
+CREATE OR REPLACE FUNCTION public.discard_sale_receipt()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  DELETE FROM public.sale_receipts WHERE sale_id = NEW.id;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS sales_discard_receipt ON public.sales;
+CREATE TRIGGER sales_discard_receipt
+  AFTER UPDATE OF payment_status, payment_method, total_amount, refund_amount, customer_name, customer_phone
+  ON public.sales
+  FOR EACH ROW EXECUTE FUNCTION public.discard_sale_receipt();
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,29 @@
+-- Receipt printers per business, optionally pinned to a terminal (printer_registry.py).
+-- Printers without a terminal_id serve every terminal that has none of its own.
+
+CREATE TABLE IF NOT EXISTS public.printers (
+  id uuid NOT NULL DEFAULT gen_random_uuid(),
+  business_id uuid NOT NULL,
+  name character varying NOT NULL,
+  terminal_id character varying,
+  printer_type character varying NOT NULL DEFAULT 'network'::character varying
+    CHECK (printer_type::text = ANY (ARRAY['network'::character varying, 'usb'::character varying]::text[])),
+  address character varying,
+  port integer DEFAULT 9100,
+  vendor_id character varying,
+  product_id character varying,
+  priority integer NOT NULL DEFAULT 0,
+  is_active boolean NOT NULL DEFAULT true,
+  created_by uuid,
+  created_at timestamp with time zone DEFAULT now(),
+  updated_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT printers_pkey PRIMARY KEY (id),
+  CONSTRAINT printers_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id),
+  CONSTRAINT printers_created_by_fkey FOREIGN KEY (created_by) REFERENCES public.users(id)
+);
+
+CREATE INDEX IF NOT EXISTS printers_business_active_idx
+  ON public.printers (business_id, priority)
+  WHERE is_active;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,21 @@
+-- Login stats written in batches by the login pipeline (login_pipeline.py):
+-- one call records any number of logins, incrementing login_count in place.
+--
+-- p_logins: [{"user_id": uuid, "last_login": timestamptz, "logins": int}, ...]
+
+CREATE OR REPLACE FUNCTION public.record_logins(p_logins jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE public.users u
+    SET last_login = greatest(coalesce(u.last_login, l.last_login), l.last_login),
+        login_count = coalesce(u.login_count, 0) + l.logins
+    FROM jsonb_to_recordset(p_logins) AS l(user_id uuid, last_login timestamptz, logins integer)
+    WHERE u.id = l.user_id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$;
+
+NOTIFY pgrst, 'reload schema';
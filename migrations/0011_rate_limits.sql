@@ -0,0 +1,85 @@
+-- Shared sliding-window rate limit counters (RATE_LIMIT_BACKEND=supabase, see rate_limiter.py).
+-- One row per key with the hit count of the current and previous window; the
+-- table is unlogged since losing counters on a crash only resets the limits.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS public.rate_limit_counters (
+  key text PRIMARY KEY,
+  window_start timestamptz NOT NULL,
+  window_seconds integer NOT NULL,
+  current_hits integer NOT NULL DEFAULT 0,
+  previous_hits integer NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS rate_limit_counters_window_start_idx
+  ON public.rate_limit_counters (window_start);
+
+-- Count p_cost hits against p_key unless that exceeds p_limit per p_window_seconds
+-- (p_cost = 0 only checks). Same arithmetic as SlidingWindowCounter.hit.
+CREATE OR REPLACE FUNCTION public.rate_limit_hit(p_key text, p_limit integer, p_window_seconds integer,
+                                                 p_cost integer DEFAULT 1)
+RETURNS TABLE (allowed boolean, retry_after integer)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_now double precision := extract(epoch FROM clock_timestamp());
+  v_start double precision := v_now - (v_now::numeric % p_window_seconds)::double precision;
+  v_row public.rate_limit_counters;
+  v_elapsed double precision;
+  v_estimate double precision;
+BEGIN
+  INSERT INTO public.rate_limit_counters (key, window_start, window_seconds)
+  VALUES (p_key, to_timestamp(v_start), p_window_seconds)
+  ON CONFLICT (key) DO NOTHING;
+
+  SELECT * INTO v_row FROM public.rate_limit_counters WHERE key = p_key FOR UPDATE;
+
+  v_elapsed := v_now - extract(epoch FROM v_row.window_start);
+  IF v_elapsed >= p_window_seconds THEN
+    v_row.previous_hits := CASE WHEN v_elapsed < 2 * p_window_seconds THEN v_row.current_hits ELSE 0 END;
+    v_row.current_hits := 0;
+    v_row.window_start := to_timestamp(v_start);
+    v_elapsed := v_now - v_start;
+  END IF;
+
+  v_estimate := v_row.previous_hits * (1 - v_elapsed / p_window_seconds) + v_row.current_hits;
+  IF v_estimate + p_cost > p_limit OR (p_cost = 0 AND v_estimate >= p_limit) THEN
+    allowed := false;
+    IF v_row.current_hits >= p_limit OR v_row.previous_hits = 0 THEN
+      retry_after := greatest(1, ceil(p_window_seconds - v_elapsed
+        + CASE WHEN v_row.current_hits >= p_limit
+               THEN p_window_seconds * (1 - (p_limit - 1)::double precision / v_row.current_hits)
+               ELSE 0 END));
+    ELSE
+      retry_after := greatest(1, ceil(least(
+        (v_estimate - (p_limit - 1)) / v_row.previous_hits * p_window_seconds,
+        p_window_seconds - v_elapsed)));
+    END IF;
+  ELSE
+    allowed := true;
+    retry_after := 0;
+    v_row.current_hits := v_row.current_hits + p_cost;
+  END IF;
+
+  UPDATE public.rate_limit_counters
+  SET window_start = v_row.window_start,
+      window_seconds = p_window_seconds,
+      current_hits = v_row.current_hits,
+      previous_hits = v_row.previous_hits
+  WHERE key = p_key;
+
+  RETURN NEXT;
+END;
+$$;
+
+-- Counters idle for two windows no longer affect any limit
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+    PERFORM cron.schedule('purge-rate-limit-counters', '*/15 * * * *',
+                          $cmd$DELETE FROM public.rate_limit_counters
+                               WHERE window_start < now() - make_interval(secs => 2 * window_seconds)$cmd$);
+  END IF;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
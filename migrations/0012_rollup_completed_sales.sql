@@ -0,0 +1,142 @@
+-- Only paid sales count in sales_daily_rollup, net of refunds.
+--
+-- 0003 added every sale item whatever its sale's payment_status, so pending and
+-- failed sales sat in revenue and COGS, and refunds never came back out.
+-- A sale now contributes its items in proportion to its payment state:
+--
+--   completed           quantity, cost and revenue in full
+--   partially_refunded  quantity and cost in full (nothing restocked), revenue
+--                       less the refunded share of the sale total
+--   anything else       nothing (pending, failed, and refunded: restocked in full)
+--
+-- Sale items add their share when inserted or changed; a change of payment_status
+-- or refund_amount on the sale (checkout, reconciler, process_refund) moves the
+-- whole sale by the difference. Rollup rows of months already purged by the
+-- archive have no live sales and are kept as they are.
+
+CREATE OR REPLACE FUNCTION public.sale_rollup_share(p_status text, p_total numeric, p_refunded numeric,
+                                                    OUT quantity_share integer, OUT revenue_share numeric)
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE WHEN p_status IN ('completed', 'partially_refunded') THEN 1 ELSE 0 END,
+         CASE WHEN p_status NOT IN ('completed', 'partially_refunded') THEN 0
+              WHEN coalesce(p_total, 0) <= 0 THEN 1
+              ELSE greatest(0, 1 - coalesce(p_refunded, 0) / p_total)
+         END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.rollup_sale_item()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_sale record;
+  v_share record;
+  v_category_id uuid;
+  v_quantity integer := NEW.quantity;
+  v_revenue numeric := NEW.total_price;
+  v_cogs numeric := NEW.cost_amount;
+BEGIN
+  SELECT business_id, (created_at AT TIME ZONE 'UTC')::date AS sale_date, payment_status, total_amount, refund_amount
+    INTO v_sale
+    FROM public.sales
+    WHERE id = NEW.sale_id;
+  IF v_sale.business_id IS NULL THEN
+    RETURN NEW;
+  END IF;
+
+  SELECT * INTO v_share FROM public.sale_rollup_share(v_sale.payment_status, v_sale.total_amount, v_sale.refund_amount);
+  IF v_share.quantity_share = 0 THEN
+    -- Added when the sale is paid (rollup_sale_status)
+    RETURN NEW;
+  END IF;
+
+  SELECT category_id INTO v_category_id FROM public.products WHERE id = NEW.product_id;
+
+  IF TG_OP = 'UPDATE' THEN
+    v_quantity := NEW.quantity - OLD.quantity;
+    v_revenue := NEW.total_price - OLD.total_price;
+    v_cogs := NEW.cost_amount - OLD.cost_amount;
+  END IF;
+
+  INSERT INTO public.sales_daily_rollup AS r
+    (business_id, sale_date, product_id, category_id, quantity, revenue, cogs)
+  VALUES (v_sale.business_id, v_sale.sale_date, NEW.product_id, v_category_id,
+          v_quantity * v_share.quantity_share, v_revenue * v_share.revenue_share, v_cogs * v_share.quantity_share)
+  ON CONFLICT (business_id, sale_date, product_id) DO UPDATE
+    SET quantity = r.quantity + EXCLUDED.quantity,
+        revenue = r.revenue + EXCLUDED.revenue,
+        cogs = r.cogs + EXCLUDED.cogs,
+        category_id = coalesce(EXCLUDED.category_id, r.category_id),
+        updated_at = now();
+
+  RETURN NEW;
+END;
+$$;
+
+-- Move a whole sale in or out of the rollup when its payment state changes
+CREATE OR REPLACE FUNCTION public.rollup_sale_status()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_old record;
+  v_new record;
+BEGIN
+  SELECT * INTO v_old FROM public.sale_rollup_share(OLD.payment_status, OLD.total_amount, OLD.refund_amount);
+  SELECT * INTO v_new FROM public.sale_rollup_share(NEW.payment_status, NEW.total_amount, NEW.refund_amount);
+  IF v_old.quantity_share = v_new.quantity_share AND v_old.revenue_share = v_new.revenue_share THEN
+    RETURN NEW;
+  END IF;
+
+  INSERT INTO public.sales_daily_rollup AS r
+    (business_id, sale_date, product_id, category_id, quantity, revenue, cogs)
+  SELECT NEW.business_id, (NEW.created_at AT TIME ZONE 'UTC')::date, si.product_id, max(p.category_id::text)::uuid,
+         sum(si.quantity) * (v_new.quantity_share - v_old.quantity_share),
+         sum(si.total_price) * (v_new.revenue_share - v_old.revenue_share),
+         sum(si.cost_amount) * (v_new.quantity_share - v_old.quantity_share)
+  FROM public.sale_items si
+  LEFT JOIN public.products p ON p.id = si.product_id
+  WHERE si.sale_id = NEW.id
+  GROUP BY si.product_id
+  ON CONFLICT (business_id, sale_date, product_id) DO UPDATE
+    SET quantity = r.quantity + EXCLUDED.quantity,
+        revenue = r.revenue + EXCLUDED.revenue,
+        cogs = r.cogs + EXCLUDED.cogs,
+        category_id = coalesce(EXCLUDED.category_id, r.category_id),
+        updated_at = now();
+
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS sales_rollup_status ON public.sales;
+CREATE TRIGGER sales_rollup_status
+  AFTER UPDATE OF payment_status, refund_amount ON public.sales
+  FOR EACH ROW EXECUTE FUNCTION public.rollup_sale_status();
+
+-- Rebuild the days that still have live sales under the new rules
+LOCK TABLE public.sales, public.sale_items IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM public.sales_daily_rollup r
+WHERE EXISTS (
+  SELECT 1 FROM public.sales s
+  WHERE s.business_id = r.business_id
+    AND s.created_at >= r.sale_date::timestamp AT TIME ZONE 'UTC'
+    AND s.created_at < (r.sale_date + 1)::timestamp AT TIME ZONE 'UTC'
+);
+
+INSERT INTO public.sales_daily_rollup (business_id, sale_date, product_id, category_id, quantity, revenue, cogs)
+SELECT s.business_id, (s.created_at AT TIME ZONE 'UTC')::date, si.product_id, max(p.category_id::text)::uuid,
+       sum(si.quantity * share.quantity_share), sum(si.total_price * share.revenue_share),
+       sum(si.cost_amount * share.quantity_share)
+FROM public.sale_items si
+JOIN public.sales s ON s.id = si.sale_id
+CROSS JOIN LATERAL public.sale_rollup_share(s.payment_status, s.total_amount, s.refund_amount) share
+LEFT JOIN public.products p ON p.id = si.product_id
+WHERE share.quantity_share > 0
+GROUP BY 1, 2, 3
+ON CONFLICT (business_id, sale_date, product_id) DO NOTHING;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,18 @@
+-- Which live expenses are already in the Parquet archive (history_archive.py).
+--
+-- Expenses are placed in archive months by the user-entered expense_date, so
+-- one entered or backdated into an archived month after it was archived sits
+-- in the live table below the watermark. Reports read live rows below the
+-- watermark that have no archived_at; the next archive run picks them up and
+-- stamps them. Purges only delete stamped rows.
+--
+-- Run `python history_archive.py archive` once after applying this, so rows
+-- archived before the column existed are stamped.
+
+ALTER TABLE public.expenses ADD COLUMN IF NOT EXISTS archived_at timestamp with time zone;
+
+CREATE INDEX IF NOT EXISTS expenses_business_unarchived_date_idx
+  ON public.expenses (business_id, expense_date)
+  WHERE archived_at IS NULL;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,84 @@
+-- Reorder-alert digests (reorder_alerts.py): alert state, run log and the bulk
+-- stock status function, moved here from db.sql.
+--
+-- get_stock_status is paged by product id (p_after / p_limit) so PostgREST's
+-- max-rows cap cannot cut a scan short.
+
+CREATE TABLE IF NOT EXISTS public.reorder_alert_state (
+  product_id uuid NOT NULL,
+  business_id uuid NOT NULL,
+  current_stock integer NOT NULL DEFAULT 0,
+  alerted_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT reorder_alert_state_pkey PRIMARY KEY (product_id),
+  CONSTRAINT reorder_alert_state_product_id_fkey FOREIGN KEY (product_id) REFERENCES public.products(id) ON DELETE CASCADE,
+  CONSTRAINT reorder_alert_state_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id)
+);
+
+CREATE TABLE IF NOT EXISTS public.reorder_alert_runs (
+  id uuid NOT NULL DEFAULT uuid_generate_v4(),
+  started_at timestamp with time zone NOT NULL DEFAULT now(),
+  finished_at timestamp with time zone,
+  full_scan boolean DEFAULT false,
+  products_checked integer DEFAULT 0,
+  products_alerted integer DEFAULT 0,
+  products_recovered integer DEFAULT 0,
+  emails_sent integer DEFAULT 0,
+  CONSTRAINT reorder_alert_runs_pkey PRIMARY KEY (id)
+);
+
+-- The unpaged version from db.sql
+DROP FUNCTION IF EXISTS public.get_stock_status(uuid, timestamp with time zone);
+
+-- Stock status in one pass, ordered by product id. With p_since NULL returns every
+-- low-stock product; otherwise every product whose stock or reorder level changed
+-- since p_since. Pass the last product id of a page as p_after for the next one.
+CREATE OR REPLACE FUNCTION public.get_stock_status(
+  p_business_id uuid DEFAULT NULL,
+  p_since timestamp with time zone DEFAULT NULL,
+  p_after uuid DEFAULT NULL,
+  p_limit integer DEFAULT 1000
+)
+RETURNS TABLE (
+  product_id uuid,
+  business_id uuid,
+  name character varying,
+  sku character varying,
+  selling_price numeric,
+  image_url text,
+  reorder_level integer,
+  current_stock bigint,
+  is_low boolean
+)
+LANGUAGE sql STABLE
+AS $$
+  WITH touched AS (
+    SELECT p.id FROM public.products p
+    WHERE p_since IS NOT NULL AND p.updated_at >= p_since
+    UNION
+    SELECT m.product_id FROM public.inventory_movements m
+    WHERE p_since IS NOT NULL AND m.created_at >= p_since
+    UNION
+    SELECT l.product_id FROM public.product_lots l
+    WHERE p_since IS NOT NULL AND (l.created_at >= p_since OR l.updated_at >= p_since)
+  ),
+  stock AS (
+    SELECT p.id, p.business_id, p.name, p.sku, p.selling_price, p.image_url,
+           COALESCE(p.reorder_level, 0) AS reorder_level,
+           COALESCE(SUM(l.quantity), 0) AS current_stock
+    FROM public.products p
+    LEFT JOIN public.product_lots l ON l.product_id = p.id
+    WHERE p.is_active = true
+      AND (p_business_id IS NULL OR p.business_id = p_business_id)
+      AND (p_since IS NULL OR p.id IN (SELECT id FROM touched))
+      AND (p_after IS NULL OR p.id > p_after)
+    GROUP BY p.id
+  )
+  SELECT s.id, s.business_id, s.name, s.sku, s.selling_price, s.image_url,
+         s.reorder_level, s.current_stock, s.current_stock <= s.reorder_level
+  FROM stock s
+  WHERE p_since IS NOT NULL OR s.current_stock <= s.reorder_level
+  ORDER BY s.id
+  LIMIT p_limit;
+$$;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,109 @@
+-- Keep archived history in the trend cube.
+--
+-- 0004 subtracts every deleted sale, sale item and expense, so purging an
+-- archived month (history_archive.py --purge) wiped it from the charts although
+-- the rows still exist in the Parquet archive. Purges now go through
+-- archive_purge(), which sets thriveos.archive_purge for its transaction; the
+-- cube triggers skip the subtraction while it is set, as sales_daily_rollup
+-- keeps purged months. Deletes made anywhere else are still subtracted.
+
+CREATE OR REPLACE FUNCTION public.is_archive_purge()
+RETURNS boolean
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT coalesce(current_setting('thriveos.archive_purge', true), '') = 'on';
+$$;
+
+-- Delete already archived rows without touching the trend cube. For sales the
+-- payment sessions and items of the given sales go too; expenses must be stamped.
+CREATE OR REPLACE FUNCTION public.archive_purge(p_table text, p_ids uuid[])
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM set_config('thriveos.archive_purge', 'on', true);
+
+  IF p_table = 'sales' THEN
+    DELETE FROM public.payment_sessions WHERE sale_id = ANY(p_ids);
+    DELETE FROM public.sale_items WHERE sale_id = ANY(p_ids);
+    DELETE FROM public.sales WHERE id = ANY(p_ids);
+  ELSIF p_table = 'expenses' THEN
+    DELETE FROM public.expenses WHERE id = ANY(p_ids) AND archived_at IS NOT NULL;
+  ELSIF p_table = 'inventory_movements' THEN
+    DELETE FROM public.inventory_movements WHERE id = ANY(p_ids);
+  ELSE
+    RAISE EXCEPTION 'archive_purge: unknown table %', p_table;
+  END IF;
+
+  PERFORM set_config('thriveos.archive_purge', '', true);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_sales()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'DELETE' AND public.is_archive_purge() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add(OLD.business_id, 'sales', (OLD.created_at AT TIME ZONE 'UTC')::date,
+                                  ARRAY['all', 'payment_method', 'status', 'cashier'],
+                                  ARRAY['all', OLD.payment_method, OLD.payment_status, OLD.sold_by::text],
+                                  1, OLD.total_amount, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add(NEW.business_id, 'sales', (NEW.created_at AT TIME ZONE 'UTC')::date,
+                                  ARRAY['all', 'payment_method', 'status', 'cashier'],
+                                  ARRAY['all', NEW.payment_method, NEW.payment_status, NEW.sold_by::text],
+                                  1, NEW.total_amount, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_sale_items()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'DELETE' AND public.is_archive_purge() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add_item(OLD.sale_id, OLD.product_id, OLD.quantity, OLD.total_price, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add_item(NEW.sale_id, NEW.product_id, NEW.quantity, NEW.total_price, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trend_cube_expenses()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'DELETE' AND public.is_archive_purge() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.trend_cube_add(OLD.business_id, 'expenses', OLD.expense_date,
+                                  ARRAY['all', 'category', 'status', 'payment_method', 'cashier'],
+                                  ARRAY['all', OLD.category, OLD.status, OLD.payment_method, OLD.created_by::text],
+                                  1, OLD.amount, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.trend_cube_add(NEW.business_id, 'expenses', NEW.expense_date,
+                                  ARRAY['all', 'category', 'status', 'payment_method', 'cashier'],
+                                  ARRAY['all', NEW.category, NEW.status, NEW.payment_method, NEW.created_by::text],
+                                  1, NEW.amount, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
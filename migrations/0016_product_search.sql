@@ -0,0 +1,76 @@
+-- Ranked product search (product_search.py), moved here from db.sql: a generated
+-- search_vector with trigram and full-text indexes, and the search_products RPC.
+--
+-- The query text is escaped before it is used in LIKE patterns, so % and _
+-- typed by the user match literally.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE public.products
+  ADD COLUMN IF NOT EXISTS search_vector tsvector
+  GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(sku, '') || ' ' || coalesce(barcode, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS products_search_vector_idx ON public.products USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON public.products USING gin (lower(name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS products_business_id_idx ON public.products (business_id);
+
+CREATE OR REPLACE FUNCTION public.search_products(
+  p_business_id uuid,
+  p_query text,
+  p_limit integer DEFAULT 20,
+  p_offset integer DEFAULT 0,
+  p_active_only boolean DEFAULT false
+)
+RETURNS TABLE (
+  id uuid,
+  name character varying,
+  sku character varying,
+  barcode character varying,
+  selling_price numeric,
+  tax_rate numeric,
+  unit character varying,
+  image_url text,
+  category_id uuid,
+  is_active boolean,
+  rank real,
+  total_count bigint
+)
+LANGUAGE sql STABLE
+AS $$
+  WITH q AS (
+    SELECT lower(trim(p_query)) AS term,
+           replace(replace(replace(lower(trim(p_query)), '\', '\\'), '%', '\%'), '_', '\_') AS pattern,
+           (SELECT to_tsquery('simple', string_agg(quote_literal(w) || ':*', ' & '))
+            FROM regexp_split_to_table(lower(trim(p_query)), '[^[:alnum:]]+') AS w
+            WHERE w <> '') AS ts
+  ),
+  matches AS (
+    SELECT p.id, p.name, p.sku, p.barcode, p.selling_price, p.tax_rate, p.unit,
+           p.image_url, p.category_id, p.is_active,
+           (CASE
+              WHEN lower(p.sku) = q.term OR lower(p.barcode) = q.term THEN 4
+              WHEN lower(p.sku) LIKE q.pattern || '%' OR lower(p.barcode) LIKE q.pattern || '%' THEN 3
+              ELSE 0
+            END
+            + coalesce(ts_rank(p.search_vector, q.ts), 0)
+            + similarity(lower(p.name), q.term))::real AS rank
+    FROM public.products p, q
+    WHERE p.business_id = p_business_id
+      AND (NOT p_active_only OR p.is_active)
+      AND (p.search_vector @@ q.ts
+           OR lower(p.name) LIKE '%' || q.pattern || '%'
+           OR lower(p.name) % q.term)
+  )
+  SELECT m.id, m.name, m.sku, m.barcode, m.selling_price, m.tax_rate, m.unit,
+         m.image_url, m.category_id, m.is_active, m.rank,
+         count(*) OVER () AS total_count
+  FROM matches m
+  ORDER BY m.rank DESC, m.name
+  LIMIT p_limit OFFSET p_offset;
+$$;
+
+NOTIFY pgrst, 'reload schema';
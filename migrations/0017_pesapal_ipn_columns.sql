@@ -0,0 +1,9 @@
+-- PesaPal IPN registration kept per business (pesapal.py), moved here from db.sql.
+-- The IPN URL is registered once and the id reused until the URL or the
+-- credentials change.
+
+ALTER TABLE public.business_settings
+  ADD COLUMN IF NOT EXISTS pesapal_ipn_id character varying,
+  ADD COLUMN IF NOT EXISTS pesapal_ipn_registered_url text;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,13 @@
+-- Server-side sales terminal carts (cart_store.py, CART_STORE_BACKEND=supabase),
+-- moved here from db.sql. One row per cart with its lines as jsonb.
+
+CREATE TABLE IF NOT EXISTS public.terminal_carts (
+  id character varying NOT NULL,
+  business_id uuid,
+  lines jsonb NOT NULL DEFAULT '{}'::jsonb,
+  updated_at timestamp with time zone DEFAULT now(),
+  CONSTRAINT terminal_carts_pkey PRIMARY KEY (id),
+  CONSTRAINT terminal_carts_business_id_fkey FOREIGN KEY (business_id) REFERENCES public.businesses(id)
+);
+
+NOTIFY pgrst, 'reload schema';
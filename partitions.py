@@ -0,0 +1,109 @@
+# partitions.py
+"""
+Maintenance for the monthly partitioned history tables (migrations/0002).
+
+- ``ensure`` creates the coming months' partitions (pg_cron does this daily
+  where it is installed; run it from cron otherwise).
+- ``retention`` detaches and drops whole months past the configured
+  retention instead of deleting rows one by one.
+
+    python partitions.py ensure [--months-ahead 3]
+    python partitions.py retention [--detach-only]
+    python partitions.py list
+"""
+import argparse
+
+from config import Config
+from migrate import connect
+
+PARTITIONED_TABLES = ['inventory_movements', 'audit_logs', 'product_audit_logs', 'role_audit_logs', 'auth_logs']
+
+
+def retention_months():
+    """Months of history to keep per table (0 keeps everything)"""
+    return {
+        'inventory_movements': Config.INVENTORY_MOVEMENT_RETENTION_MONTHS,
+        'audit_logs': Config.AUDIT_LOG_RETENTION_MONTHS,
+        'product_audit_logs': Config.AUDIT_LOG_RETENTION_MONTHS,
+        'role_audit_logs': Config.AUDIT_LOG_RETENTION_MONTHS,
+        'auth_logs': Config.AUTH_LOG_RETENTION_MONTHS,
+    }
+
+
+def ensure_partitions(conn, months_ahead=3):
+    """Create partitions for this month and the next `months_ahead` months"""
+    with conn.cursor() as cur:
+        cur.execute('SELECT public.ensure_history_partitions(%s)', (months_ahead,))
+        created = cur.fetchone()[0]
+    conn.commit()
+    print(f"✅ {created} partitions created")
+    return created
+
+
+def apply_retention(conn, drop=True):
+    """
+    Detach (and drop unless `drop` is False) months older than each table's retention
+
+    Returns:
+        dict: Table -> list of detached partition names
+    """
+    removed = {}
+    for table, keep_months in retention_months().items():
+        if keep_months <= 0:
+            continue
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT * FROM public.apply_partition_retention(%s, %s, %s)', (table, keep_months, drop))
+                removed[table] = [row[0] for row in cur.fetchall()]
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Retention failed for {table}: {str(e)}")
+            continue
+
+        if removed[table]:
+            action = 'Dropped' if drop else 'Detached'
+            print(f"✅ {action} {', '.join(removed[table])}")
+    return removed
+
+
+def list_partitions(conn):
+    """Partition names and approximate row counts per table"""
+    partitions = {}
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            cur.execute("""
+                SELECT c.relname, c.reltuples::bigint
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass('public.' || quote_ident(%s))
+                ORDER BY c.relname
+            """, (table,))
+            partitions[table] = cur.fetchall()
+    conn.rollback()
+    return partitions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain monthly history partitions')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ensure_parser = subparsers.add_parser('ensure', help='Create upcoming monthly partitions')
+    ensure_parser.add_argument('--months-ahead', type=int, default=3, help='Months to create beyond the current one')
+    retention_parser = subparsers.add_parser('retention', help='Remove months past the retention window')
+    retention_parser.add_argument('--detach-only', action='store_true', help='Detach old months but keep their tables')
+    subparsers.add_parser('list', help='List partitions and approximate row counts')
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        if args.command == 'ensure':
+            ensure_partitions(connection, args.months_ahead)
+        elif args.command == 'retention':
+            apply_retention(connection, drop=not args.detach_only)
+        elif args.command == 'list':
+            for table_name, rows in list_partitions(connection).items():
+                print(table_name)
+                for partition, row_count in rows:
+                    print(f"  {partition}: ~{max(row_count, 0)} rows")
+    finally:
+        connection.close()
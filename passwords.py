@@ -0,0 +1,129 @@
+# passwords.py
+"""
+Password hashing with a configurable algorithm and cost.
+
+Hashes are Werkzeug hashes whose prefix records how they were made
+(``scrypt:32768:8:1$salt$hash``, ``pbkdf2:sha256:1000000$salt$hash``), so
+old hashes keep verifying after the settings change. PASSWORD_HASH_METHOD
+and PASSWORD_HASH_COST (scrypt N or PBKDF2 iterations) set the parameters of
+new hashes; a successful login whose hash was made differently is rehashed
+with the current settings, so a cost change rolls out as users sign in and
+nobody has to reset a password.
+
+Costs below MIN_SCRYPT_N / MIN_PBKDF2_ITERATIONS are raised to them.
+
+Pick a cost for this hardware with::
+
+    python passwords.py --target-ms 100 [--method scrypt|pbkdf2]
+"""
+import argparse
+import statistics
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import Config
+
+DEFAULT_SCRYPT_N = 32768
+MIN_SCRYPT_N = 16384
+SCRYPT_R, SCRYPT_P = 8, 1
+DEFAULT_PBKDF2_ITERATIONS = 1000000
+MIN_PBKDF2_ITERATIONS = 600000
+
+
+def method_string(method=None, cost=None):
+    """Werkzeug method string for the configured (or given) algorithm and cost"""
+    method = method or Config.PASSWORD_HASH_METHOD
+    cost = Config.PASSWORD_HASH_COST if cost is None else cost
+
+    if method == 'scrypt':
+        n = max(cost or DEFAULT_SCRYPT_N, MIN_SCRYPT_N)
+        # scrypt needs a power of two
+        n = 1 << (n - 1).bit_length()
+        return f'scrypt:{n}:{SCRYPT_R}:{SCRYPT_P}'
+    if method in ('pbkdf2', 'pbkdf2:sha256'):
+        return f'pbkdf2:sha256:{max(cost or DEFAULT_PBKDF2_ITERATIONS, MIN_PBKDF2_ITERATIONS)}'
+    raise ValueError(f"Unknown password hash method: {method}")
+
+
+def hash_password(password):
+    """Hash a password with the current settings"""
+    return generate_password_hash(password, method=method_string())
+
+
+def needs_rehash(password_hash):
+    """Whether a stored hash was made with other settings than the current ones"""
+    return not password_hash or password_hash.split('$', 1)[0] != method_string()
+
+
+def verify_password(password_hash, password):
+    """
+    Check a password against a stored hash
+
+    Returns:
+        tuple: (valid, new_hash) where new_hash is a hash with the current
+               settings to store in place of the old one, or None
+    """
+    if not password_hash or not check_password_hash(password_hash, password):
+        return False, None
+    if needs_rehash(password_hash):
+        return True, hash_password(password)
+    return True, None
+
+
+def _candidates(method):
+    if method == 'scrypt':
+        n = MIN_SCRYPT_N
+        while n <= 1 << 20:
+            yield n
+            n <<= 1
+    else:
+        iterations = MIN_PBKDF2_ITERATIONS
+        while iterations <= 10000000:
+            yield iterations
+            iterations = int(iterations * 1.25 // 50000 * 50000)
+
+
+def benchmark(method, target_ms, samples=5):
+    """
+    Time verification at increasing costs
+
+    Returns:
+        tuple: (results [(cost, median ms)], highest cost within target_ms or None)
+    """
+    results = []
+    chosen = None
+    for cost in _candidates(method):
+        password_hash = generate_password_hash('benchmark-password', method=method_string(method, cost))
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            check_password_hash(password_hash, 'benchmark-password')
+            timings.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(timings)
+        results.append((cost, median))
+        if median > target_ms:
+            break
+        chosen = cost
+    return results, chosen
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pick a password hash cost for a target verification time')
+    parser.add_argument('--method', choices=['scrypt', 'pbkdf2'], default=Config.PASSWORD_HASH_METHOD)
+    parser.add_argument('--target-ms', type=float, default=100, help='Longest acceptable verification time')
+    parser.add_argument('--samples', type=int, default=5, help='Verifications timed per cost')
+    args = parser.parse_args()
+
+    print(f"Current settings: {method_string()}")
+    results, chosen = benchmark(args.method, args.target_ms, args.samples)
+    for cost, median in results:
+        marker = '✅' if median <= args.target_ms else '❌'
+        print(f"{marker} {method_string(args.method, cost):<24} {median:8.1f} ms  ~{1000 / median:6.1f} logins/s per core")
+
+    if chosen is None:
+        floor = MIN_SCRYPT_N if args.method == 'scrypt' else MIN_PBKDF2_ITERATIONS
+        print(f"⚠️ Even the minimum cost takes longer than {args.target_ms:.0f} ms; keep {floor} and add workers")
+    else:
+        print(f"\nPASSWORD_HASH_METHOD={args.method}")
+        print(f"PASSWORD_HASH_COST={chosen}")
@@ -0,0 +1,376 @@
+# payment_reconciler.py
+"""
+PesaPal payment reconciliation.
+
+IPN notifications are queued by the webhook route and processed here so the
+webhook can acknowledge PesaPal immediately. The same worker periodically
+sweeps pending payment_sessions in batches and polls their status, so sales
+whose customers never return to the callback URL still settle. All outbound
+status checks go through one token-bucket rate limiter.
+
+Run from the command line with ``python payment_reconciler.py [--loop]`` or
+start the in-process worker with ``start_reconciler()``. For local testing,
+``python payment_reconciler.py --serve PORT`` runs a stand-in PesaPal API;
+point PESAPAL_API_URL at ``http://127.0.0.1:PORT/``.
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+from pesapal import PesaPal, get_client
+import receipts
+
+_ipn_queue = queue.Queue()
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Token bucket: allows `rate` calls per second with bursts up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiter = RateLimiter(Config.PESAPAL_STATUS_RATE_LIMIT)
+
+
+def normalize_payment_status(status_data):
+    """Map a PesaPal status response to completed / pending / failed"""
+    description = (status_data.get('payment_status_description') or '').upper()
+    if 'COMPLETED' in description:
+        return 'completed'
+    if 'FAILED' in description or 'REVERSED' in description:
+        return 'failed'
+    # INVALID / empty means the customer has not paid yet
+    return 'pending'
+
+
+def apply_payment_status(payment_session, status_data, supabase=None):
+    """
+    Record a PesaPal status check on the payment session and its sale
+
+    Only a sale that is still pending is changed: a paid, failed or refunded
+    sale keeps its status whatever PesaPal answers for the session.
+
+    Args:
+        payment_session: payment_sessions row (id, sale_id, status)
+        status_data: Standardised response from PesaPal.verify_transaction_status
+        supabase: Supabase client (defaults to the shared client)
+
+    Returns:
+        str: Normalised payment status
+    """
+    supabase = supabase or get_client()
+    normalized_status = normalize_payment_status(status_data)
+    now = datetime.now(timezone.utc).isoformat()
+
+    supabase.table('payment_sessions').update({
+        'status': normalized_status,
+        'last_checked_at': now,
+        'check_count': (payment_session.get('check_count') or 0) + 1
+    }).eq('id', payment_session['id']).execute()
+
+    if normalized_status != 'pending' and normalized_status != payment_session.get('status'):
+        response = supabase.table('sales').update({
+            'payment_status': normalized_status,
+            'updated_at': now
+        }).eq('id', payment_session['sale_id']).eq('payment_status', 'pending').execute()
+        if response.data:
+            print(f"✅ Sale {payment_session['sale_id']} payment {normalized_status}")
+            # The stored receipt shows the old status (the database trigger drops its row)
+            receipts.discard(payment_session['sale_id'])
+
+    return normalized_status
+
+
+def enqueue_ipn(order_tracking_id, merchant_reference=None, notification_type=None):
+    """Queue an IPN notification for background verification"""
+    # With the in-app reconciler off nothing drains the queue; a separate `--loop`
+    # process picks the session up on its sweep instead
+    if not Config.PESAPAL_RECONCILE_ENABLED:
+        return
+    _ipn_queue.put({
+        'order_tracking_id': order_tracking_id,
+        'merchant_reference': merchant_reference,
+        'notification_type': notification_type,
+    })
+    start_reconciler()
+
+
+def _load_sessions(order_tracking_ids):
+    """Load payment sessions with their sale's business in one query"""
+    if not order_tracking_ids:
+        return []
+    response = get_client().table('payment_sessions') \
+        .select('id, sale_id, order_tracking_id, status, check_count, created_at, sales(business_id)') \
+        .in_('order_tracking_id', list(order_tracking_ids)) \
+        .execute()
+    return response.data or []
+
+
+def _load_pending_sessions(limit):
+    """Load the pending sessions that were checked least recently"""
+    response = get_client().table('payment_sessions') \
+        .select('id, sale_id, order_tracking_id, status, check_count, created_at, sales(business_id)') \
+        .eq('status', 'pending') \
+        .order('last_checked_at', desc=False, nullsfirst=True) \
+        .limit(limit) \
+        .execute()
+    return response.data or []
+
+
+def _mark_checked(payment_session):
+    """Stamp a check that got no status back, so the sweep moves on to other sessions"""
+    get_client().table('payment_sessions').update({
+        'last_checked_at': datetime.now(timezone.utc).isoformat(),
+        'check_count': (payment_session.get('check_count') or 0) + 1
+    }).eq('id', payment_session['id']).execute()
+
+
+def _is_expired(payment_session, expiry):
+    created_at = payment_session.get('created_at')
+    if not created_at:
+        return False
+    created = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created < expiry
+
+
+def _expire_session(payment_session):
+    """Give up on a session that stayed pending past the expiry window"""
+    apply_payment_status(payment_session, {'payment_status_description': 'FAILED'})
+    print(f"⚠️ Payment session {payment_session['order_tracking_id']} expired")
+
+
+def reconcile_sessions(payment_sessions):
+    """
+    Poll PesaPal for a batch of payment sessions, rate limited
+
+    Returns:
+        dict: Count of sessions per resulting status
+    """
+    results = {'completed': 0, 'pending': 0, 'failed': 0, 'errors': 0}
+    clients = {}
+    expiry = datetime.now(timezone.utc) - timedelta(hours=Config.PESAPAL_PENDING_EXPIRY_HOURS)
+
+    for payment_session in payment_sessions:
+        try:
+            business_id = (payment_session.get('sales') or {}).get('business_id')
+            if business_id not in clients:
+                clients[business_id] = PesaPal(business_id)
+
+            _limiter.acquire()
+            status_data = clients[business_id].verify_transaction_status(payment_session['order_tracking_id'])
+
+            if status_data:
+                status = apply_payment_status(payment_session, status_data)
+            else:
+                # Missing credentials or an API error: still counts as a check
+                results['errors'] += 1
+                _mark_checked(payment_session)
+                status = None
+
+            # Sessions expire whether or not PesaPal answered
+            if status in ('pending', None) and _is_expired(payment_session, expiry):
+                if status:
+                    payment_session['status'] = status
+                _expire_session(payment_session)
+                status = 'failed'
+
+            if status:
+                results[status] += 1
+
+        except Exception as e:
+            print(f"❌ Error reconciling {payment_session.get('order_tracking_id')}: {str(e)}")
+            results['errors'] += 1
+            try:
+                _mark_checked(payment_session)
+            except Exception:
+                pass
+
+    return results
+
+
+def process_ipn_queue(first_item=None, max_items=None):
+    """Verify queued IPN notifications, deduplicating repeats of the same order"""
+    tracking_ids = {first_item['order_tracking_id']} if first_item else set()
+    max_items = max_items or Config.PESAPAL_RECONCILE_BATCH_SIZE
+    while len(tracking_ids) < max_items:
+        try:
+            item = _ipn_queue.get_nowait()
+        except queue.Empty:
+            break
+        tracking_ids.add(item['order_tracking_id'])
+        _ipn_queue.task_done()
+
+    if not tracking_ids:
+        return None
+
+    results = reconcile_sessions(_load_sessions(tracking_ids))
+    print(f"🔄 IPN batch reconciled: {results}")
+    return results
+
+
+def reconcile_pending(batch_size=None):
+    """Sweep one batch of pending payment sessions"""
+    batch_size = batch_size or Config.PESAPAL_RECONCILE_BATCH_SIZE
+    try:
+        sessions = _load_pending_sessions(batch_size)
+        if not sessions:
+            return {'completed': 0, 'pending': 0, 'failed': 0, 'errors': 0}
+        results = reconcile_sessions(sessions)
+        print(f"🔄 Pending payments reconciled: {results}")
+        return results
+    except Exception as e:
+        print(f"❌ Pending payment sweep failed: {str(e)}")
+        return None
+
+
+def _worker_loop(interval_seconds):
+    next_sweep = time.monotonic()
+    while True:
+        # IPNs are handled as soon as they arrive
+        try:
+            item = _ipn_queue.get(timeout=max(0.1, next_sweep - time.monotonic()))
+            _ipn_queue.task_done()
+            process_ipn_queue(item)
+        except queue.Empty:
+            pass
+        except Exception as e:
+            print(f"❌ IPN processing failed: {str(e)}")
+
+        if time.monotonic() >= next_sweep:
+            reconcile_pending()
+            next_sweep = time.monotonic() + interval_seconds
+
+
+def start_reconciler(interval_seconds=None):
+    """Start the reconciliation worker in a daemon thread (once per process)"""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return _worker_thread
+
+        interval = interval_seconds or Config.PESAPAL_RECONCILE_INTERVAL_SECONDS
+        _worker_thread = threading.Thread(target=_worker_loop, args=(interval,), daemon=True)
+        _worker_thread.start()
+        print(f"🔄 Payment reconciler started (sweep every {interval}s)")
+        return _worker_thread
+
+
+# Stand-in PesaPal API: the status answered depends on the order tracking id
+MOCK_STATUSES = (('fail', 'FAILED', 2), ('revers', 'REVERSED', 3), ('pending', 'INVALID', 0))
+
+
+class MockPesaPalHandler(BaseHTTPRequestHandler):
+    """
+    Token, RegisterIPN, SubmitOrderRequest and GetTransactionStatus endpoints
+
+    Every order is COMPLETED unless its tracking id contains 'fail', 'revers'
+    or 'pending'; a tracking id containing 'error' gets a 500.
+    """
+
+    def _reply(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if path.endswith('Auth/RequestToken'):
+            expiry = datetime.now(timezone.utc) + timedelta(minutes=5)
+            self._reply({'token': f'mock-{uuid.uuid4().hex}', 'expiryDate': expiry.isoformat(), 'status': '200'})
+        elif path.endswith('URLSetup/RegisterIPN'):
+            self._reply({'ipn_id': str(uuid.uuid4()), 'url': payload.get('url'), 'status': '200'})
+        elif path.endswith('Transactions/SubmitOrderRequest'):
+            tracking_id = str(uuid.uuid4())
+            self._reply({'order_tracking_id': tracking_id, 'merchant_reference': payload.get('id'),
+                         'redirect_url': f'http://{self.headers.get("Host")}/pay/{tracking_id}', 'status': '200'})
+        else:
+            self._reply({'error': {'message': f'Unknown endpoint {path}'}}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('Transactions/GetTransactionStatus'):
+            self._reply({'error': {'message': f'Unknown endpoint {url.path}'}}, 404)
+            return
+
+        tracking_id = (parse_qs(url.query).get('orderTrackingId') or [''])[0]
+        if 'error' in tracking_id.lower():
+            self._reply({'error': {'message': 'Mock server error'}}, 500)
+            return
+        description, code = 'COMPLETED', 1
+        for marker, mock_description, mock_code in MOCK_STATUSES:
+            if marker in tracking_id.lower():
+                description, code = mock_description, mock_code
+                break
+        self._reply({
+            'order_tracking_id': tracking_id,
+            'payment_status_description': description,
+            'status_code': code,
+            'payment_method': 'MpesaKE',
+            'amount': 1000,
+            'currency': 'UGX',
+            'payment_date': datetime.now(timezone.utc).isoformat(),
+            'status': '200',
+        })
+
+    def log_message(self, format, *args):
+        print(f"🔄 Mock PesaPal: {format % args}")
+
+
+def serve(port, host='127.0.0.1'):
+    """Run the stand-in PesaPal API until interrupted"""
+    server = ThreadingHTTPServer((host, port), MockPesaPalHandler)
+    print(f"💳 Mock PesaPal listening on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconcile pending PesaPal payments')
+    parser.add_argument('--loop', action='store_true', help='Keep sweeping on the configured interval')
+    parser.add_argument('--batch-size', type=int, default=None, help='Sessions to check per sweep')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Run a stand-in PesaPal API on PORT')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+    elif args.loop:
+        _worker_loop(Config.PESAPAL_RECONCILE_INTERVAL_SECONDS)
+    else:
+        reconcile_pending(args.batch_size)
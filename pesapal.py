@@ -2,63 +2,134 @@
 import os
 import json
 import uuid
+import threading
 import requests
 import urllib3
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 # Load environment variables early
 load_dotenv()
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # In your pesapal.py or wherever your PesaPal class is defined
-from flask import session
+from flask import session, has_request_context
 from supabase import create_client
 from config import Config
 
+# Shared state across PesaPal instances so a checkout does not re-authenticate,
+# re-register the IPN URL or reload credentials on every request.
+_supabase = None
+_credentials_cache = {}   # business_id -> credentials dict
+_token_cache = {}         # business_id -> (token, expires_at)
+_cache_lock = threading.RLock()
+
+# Refresh tokens a little before PesaPal expires them
+TOKEN_EXPIRY_MARGIN = timedelta(seconds=30)
+DEFAULT_TOKEN_LIFETIME = timedelta(minutes=5)
+
+
+def get_client():
+    """Get the shared Supabase client used for PesaPal settings"""
+    global _supabase
+    if _supabase is None:
+        _supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+    return _supabase
+
+
+def invalidate_pesapal_credentials(business_id):
+    """Drop cached credentials and token for a business (call after settings change)"""
+    with _cache_lock:
+        _credentials_cache.pop(business_id, None)
+        _token_cache.pop(business_id, None)
+    print(f"🔄 PesaPal cache cleared for business {business_id}")
+
+
+def _parse_expiry(value):
+    """Parse PesaPal's expiryDate, falling back to the default token lifetime"""
+    now = datetime.now(timezone.utc)
+    if not value:
+        return now + DEFAULT_TOKEN_LIFETIME
+    try:
+        expires_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at
+    except ValueError:
+        return now + DEFAULT_TOKEN_LIFETIME
+
+
 class PesaPal:
     def __init__(self, business_id=None):
-        self.auth_url = "https://pay.pesapal.com/v3/api/Auth/RequestToken"
-        self.api_url = "https://pay.pesapal.com/v3/api/"
+        self.api_url = Config.PESAPAL_API_URL.rstrip('/') + '/'
+        self.auth_url = self.api_url + "Auth/RequestToken"
         self.token = None
-        
+
         # Get Supabase client
-        self.supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
-        
+        self.supabase = get_client()
+
         # Get business_id from parameter or session
-        self.business_id = business_id or session.get('business_id')
-        
-        # Get credentials from database
-        self.consumer_key, self.consumer_secret, self.ipn_url = self._get_pesapal_credentials()
-        
-        # Register IPN only after authentication
-        self.ipn_id = None
+        if business_id is None and has_request_context():
+            business_id = session.get('business_id')
+        self.business_id = business_id
+
+        # Get credentials (cached per business)
+        credentials = self._get_pesapal_credentials()
+        self.consumer_key = credentials.get('consumer_key')
+        self.consumer_secret = credentials.get('consumer_secret')
+        self.ipn_url = credentials.get('ipn_url')
+
+        # Only reuse an IPN id registered for the current IPN URL
+        if credentials.get('ipn_id') and credentials.get('ipn_registered_url') == self.ipn_url:
+            self.ipn_id = credentials.get('ipn_id')
+        else:
+            self.ipn_id = None
 
     def _get_pesapal_credentials(self):
-        """Get PesaPal credentials from database for the current business"""
+        """Get PesaPal credentials for the current business, cached until invalidated"""
+        with _cache_lock:
+            cached = _credentials_cache.get(self.business_id)
+        if cached is not None:
+            return cached
+
+        credentials = {
+            'consumer_key': None,
+            'consumer_secret': None,
+            'ipn_url': Config.PESAPAL_IPN_URL,
+            'ipn_id': None,
+            'ipn_registered_url': None,
+        }
+
         try:
             response = self.supabase.table('business_settings').select(
-                'pesapal_consumer_key, pesapal_consumer_secret, pesapal_ipn_url'
+                'pesapal_consumer_key, pesapal_consumer_secret, pesapal_ipn_url, '
+                'pesapal_ipn_id, pesapal_ipn_registered_url'
             ).eq('business_id', self.business_id).limit(1).execute()
-            
+
             if response.data:
                 settings = response.data[0]
-                consumer_key = settings.get('pesapal_consumer_key')
-                consumer_secret = settings.get('pesapal_consumer_secret')
-                ipn_url = settings.get('pesapal_ipn_url') or Config.PESAPAL_IPN_URL
-                
-                # Debug logging
+                credentials.update({
+                    'consumer_key': settings.get('pesapal_consumer_key'),
+                    'consumer_secret': settings.get('pesapal_consumer_secret'),
+                    'ipn_url': settings.get('pesapal_ipn_url') or Config.PESAPAL_IPN_URL,
+                    'ipn_id': settings.get('pesapal_ipn_id'),
+                    'ipn_registered_url': settings.get('pesapal_ipn_registered_url'),
+                })
+
+                consumer_key = credentials['consumer_key']
                 print(f"🔍 PesaPal Credentials Loaded:")
                 print(f"   Consumer Key: {consumer_key[:10]}..." if consumer_key else "   Consumer Key: NOT SET")
-                print(f"   Consumer Secret: {'***SET***' if consumer_secret else 'NOT SET'}")
-                print(f"   IPN URL: {ipn_url}")
-                
-                return consumer_key, consumer_secret, ipn_url
-            
-            print("❌ No PesaPal settings found in database")
-            return None, None, Config.PESAPAL_IPN_URL
-            
+                print(f"   Consumer Secret: {'***SET***' if credentials['consumer_secret'] else 'NOT SET'}")
+                print(f"   IPN URL: {credentials['ipn_url']}")
+
+                with _cache_lock:
+                    _credentials_cache[self.business_id] = credentials
+            else:
+                print("❌ No PesaPal settings found in database")
+
         except Exception as e:
             print(f"❌ Error loading PesaPal credentials: {e}")
-            return None, None, Config.PESAPAL_IPN_URL
+
+        return credentials
 
     def _validate_credentials(self):
         """Validate that required credentials are set"""
@@ -69,146 +140,143 @@ class PesaPal:
             return False
         return True
 
-    def authenticate(self):
-        """Authenticate with PesaPal API"""
-        print(f"🔄 Authenticating with PesaPal...")
-        print(f"   Using Consumer Key: {self.consumer_key[:10]}..." if self.consumer_key else "   Consumer Key: NOT SET")
-        
-        # Validate credentials first
+    def _headers(self):
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'User-Agent': 'ThriveOS/1.0'
+        }
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        return headers
+
+    def authenticate(self, force=False):
+        """Get an access token, reusing the cached one for this business until it expires"""
+        if not force:
+            with _cache_lock:
+                cached = _token_cache.get(self.business_id)
+            if cached and cached[1] - TOKEN_EXPIRY_MARGIN > datetime.now(timezone.utc):
+                self.token = cached[0]
+                return self.token
+
         if not self._validate_credentials():
             return None
-            
-        try:
-            headers = {
-                "Accept": "application/json",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "consumer_key": self.consumer_key,
-                "consumer_secret": self.consumer_secret
-            }
-            
-            response = requests.post(self.auth_url, json=data, headers=headers)
-            response.raise_for_status()
-            
-            auth_data = response.json()
-            self.token = auth_data.get("token")
-            
-            print(f"✅ Authentication successful")
-            print(f"   Token: {self.token[:20]}..." if self.token else "   Token: NOT RECEIVED")
-            
-            return self.token
-            
-        except requests.exceptions.RequestException as e:
-            print(f"❌ PesaPal authentication failed: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_data = e.response.json()
-                    print(f"   Error response: {json.dumps(error_data, indent=2)}")
-                except:
-                    print(f"   Response text: {e.response.text}")
-            return None
-        except Exception as e:
-            print(f"❌ Unexpected error during authentication: {str(e)}")
-            return None
-
 
-    def authenticate(self):
-        """Authenticate with PesaPal and get access token"""
         try:
             payload = json.dumps({
                 "consumer_key": self.consumer_key,
                 "consumer_secret": self.consumer_secret
             })
-            headers = {
-                'Content-Type': 'application/json', 
-                'Accept': 'application/json',
-                'User-Agent': 'CapitalCollege/1.0'
-            }
 
             print("🔄 Authenticating with PesaPal...")
+            self.token = None
             response = requests.post(
-                self.auth_url, 
-                headers=headers, 
-                data=payload, 
+                self.auth_url,
+                headers=self._headers(),
+                data=payload,
                 verify=False,
                 timeout=30
             )
             response.raise_for_status()
-            
+
             data = response.json()
-            if 'token' in data:
+            if data.get('token'):
                 self.token = data['token']
+                with _cache_lock:
+                    _token_cache[self.business_id] = (self.token, _parse_expiry(data.get('expiryDate')))
                 print("✅ PesaPal authentication successful")
-                
-                # Register IPN after getting token
-                self.ipn_id = self.register_ipn_url()
                 return self.token
             else:
                 print(f"❌ Authentication failed. Response: {data}")
                 return None
-            
+
         except requests.exceptions.RequestException as e:
             print(f"❌ PesaPal authentication failed: {e}")
-            if hasattr(e, 'response') and e.response:
+            if hasattr(e, 'response') and e.response is not None:
                 print(f"Response: {e.response.text}")
             return None
         except Exception as e:
             print(f"❌ Unexpected error during authentication: {e}")
             return None
 
-    def register_ipn_url(self):
-        """Register IPN URL with PesaPal"""
-        try:
-            endpoint = "URLSetup/RegisterIPN"
-            payload = json.dumps({
-                "url": self.ipn_url, 
-                "ipn_notification_type": "GET"
-            })
-            headers = {
-                'Content-Type': 'application/json', 
-                'Accept': 'application/json', 
-                'Authorization': f"Bearer {self.token}",
-                'User-Agent': 'CapitalCollege/1.0'
-            }
-            
-            print("🔄 Registering IPN URL...")
-            response = requests.post(
-                self.api_url + endpoint, 
-                headers=headers, 
-                data=payload, 
+    def _request(self, method, endpoint, payload=None):
+        """Call the PesaPal API, re-authenticating once if the cached token was rejected"""
+        for attempt in range(2):
+            response = requests.request(
+                method,
+                self.api_url + endpoint,
+                headers=self._headers(),
+                data=json.dumps(payload) if payload is not None else None,
                 verify=False,
                 timeout=30
             )
+            if response.status_code == 401 and attempt == 0:
+                print("⚠️ PesaPal token rejected, re-authenticating")
+                if not self.authenticate(force=True):
+                    break
+                continue
             response.raise_for_status()
-            
-            data = response.json()
+            return response.json()
+
+        response.raise_for_status()
+        return response.json()
+
+    def register_ipn_url(self):
+        """Register IPN URL with PesaPal and persist the IPN id for the business"""
+        try:
+            print("🔄 Registering IPN URL...")
+            data = self._request('POST', "URLSetup/RegisterIPN", {
+                "url": self.ipn_url,
+                "ipn_notification_type": "GET"
+            })
+
             if 'ipn_id' in data:
                 print(f"✅ IPN registered successfully: {data['ipn_id']}")
+                self._save_ipn_id(data['ipn_id'])
                 return data['ipn_id']
             else:
                 print(f"❌ IPN registration failed. Response: {data}")
                 return None
-            
+
         except requests.exceptions.RequestException as e:
             print(f"❌ IPN Registration failed: {e}")
-            if hasattr(e, 'response') and e.response:
+            if hasattr(e, 'response') and e.response is not None:
                 print(f"Response: {e.response.text}")
             return None
         except Exception as e:
             print(f"❌ Unexpected error in IPN registration: {e}")
             return None
 
+    def _save_ipn_id(self, ipn_id):
+        """Persist the registered IPN id so it is only registered once per URL"""
+        with _cache_lock:
+            cached = _credentials_cache.get(self.business_id)
+            if cached is not None:
+                cached['ipn_id'] = ipn_id
+                cached['ipn_registered_url'] = self.ipn_url
+
+        try:
+            self.supabase.table('business_settings').update({
+                'pesapal_ipn_id': ipn_id,
+                'pesapal_ipn_registered_url': self.ipn_url
+            }).eq('business_id', self.business_id).execute()
+        except Exception as e:
+            print(f"⚠️ Could not save PesaPal IPN id: {e}")
+
+    def ensure_ipn_id(self):
+        """Get the IPN id, registering the IPN URL only if it has not been registered yet"""
+        if not self.ipn_id:
+            self.ipn_id = self.register_ipn_url()
+        return self.ipn_id
+
     def submit_order(self, amount, reference_id, callback_url, email, first_name, last_name):
         """Submit order to PesaPal for payment processing"""
-        if not self.token:
-            if not self.authenticate():
-                return None
+        if not self.authenticate():
+            return None
+        self.ensure_ipn_id()
 
         try:
-            endpoint = "Transactions/SubmitOrderRequest"
-            payload = json.dumps({
+            payload = {
                 "id": reference_id,
                 "currency": "UGX",
                 "amount": str(amount),
@@ -229,28 +297,12 @@ class PesaPal:
                     "postal_code": "",
                     "zip_code": ""
                 }
-            })
-            
-            headers = {
-                'Content-Type': 'application/json', 
-                'Accept': 'application/json', 
-                'Authorization': f"Bearer {self.token}",
-                'User-Agent': 'LUNSERK-SACCO/1.0'
             }
 
             print(f"🔄 Submitting order to PesaPal: UGX {amount}, Ref: {reference_id}")
-            response = requests.post(
-                self.api_url + endpoint, 
-                headers=headers, 
-                data=payload, 
-                verify=False,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._request('POST', "Transactions/SubmitOrderRequest", payload)
             print(f"✅ PesaPal API Response: {data}")
-            
+
             # Check for different possible response keys
             if 'order_tracking_id' in data:
                 order_id = data['order_tracking_id']
@@ -261,9 +313,9 @@ class PesaPal:
             else:
                 print(f"❌ No order tracking ID found in response: {data}")
                 return None
-            
+
             print(f"✅ Order submitted successfully. Order ID: {order_id}")
-            
+
             # Return standardized response
             return {
                 'order_tracking_id': order_id,
@@ -271,10 +323,10 @@ class PesaPal:
                 'reference_id': reference_id,
                 'raw_response': data  # Keep original response for debugging
             }
-            
+
         except requests.exceptions.RequestException as e:
             print(f"❌ Order submission failed: {e}")
-            if hasattr(e, 'response') and e.response:
+            if hasattr(e, 'response') and e.response is not None:
                 print(f"Response: {e.response.text}")
             return None
         except Exception as e:
@@ -285,31 +337,14 @@ class PesaPal:
 
     def verify_transaction_status(self, order_tracking_id):
         """Verify transaction status with PesaPal"""
-        if not self.token:
-            if not self.authenticate():
-                return None
+        if not self.authenticate():
+            return None
 
         try:
-            endpoint = f"Transactions/GetTransactionStatus?orderTrackingId={order_tracking_id}"
-            headers = {
-                'Content-Type': 'application/json', 
-                'Accept': 'application/json', 
-                'Authorization': f"Bearer {self.token}",
-                'User-Agent': 'LUNSERK-SACCO/1.0'
-            }
-
             print(f"🔄 Verifying transaction status: {order_tracking_id}")
-            response = requests.get(
-                self.api_url + endpoint, 
-                headers=headers, 
-                verify=False,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._request('GET', f"Transactions/GetTransactionStatus?orderTrackingId={order_tracking_id}")
             print(f"✅ Transaction status response: {data}")
-            
+
             # Standardize response keys
             standardized_data = {
                 'order_tracking_id': data.get('order_tracking_id') or data.get('orderTrackingId') or order_tracking_id,
@@ -321,16 +356,16 @@ class PesaPal:
                 'payment_date': data.get('payment_date') or data.get('paymentDate', ''),
                 'raw_response': data  # Keep original for debugging
             }
-            
+
             return standardized_data
-            
+
         except requests.exceptions.RequestException as e:
             print(f"❌ Transaction verification failed: {e}")
-            if hasattr(e, 'response') and e.response:
+            if hasattr(e, 'response') and e.response is not None:
                 print(f"Response: {e.response.text}")
             return None
         except Exception as e:
             print(f"❌ Unexpected error in transaction verification: {e}")
             import traceback
             traceback.print_exc()
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,246 @@
+# printer_registry.py
+"""
+Receipt printers per business and terminal.
+
+Printers are registered in the printers table (migrations/0009). A receipt
+goes to the printers assigned to the terminal it was sold on (the terminal
+name is kept in the session, see the sales terminal's ``?terminal=`` param),
+or to the business-wide printers when the terminal has none. Among those the
+healthy printer with the shortest queue is chosen, lowest priority first.
+
+Each printer has one spooler (reciept_printer.PrinterSpooler) for the
+process. A health check probes idle printers every
+PRINTER_HEALTH_CHECK_SECONDS and takes unreachable ones out of rotation
+(printers with queued jobs are tried by their spooler instead); a job whose
+printer fails is moved to a healthy printer of the same group.
+
+Businesses without registered printers use the printer in config.py when
+PRINTER_ENABLED is set.
+"""
+import threading
+import time
+from datetime import date, timedelta
+
+from config import Config
+from reciept_printer import ReceiptPrinter, PrinterSpooler
+import receipts
+
+REGISTRY_CACHE_SECONDS = 300
+REPRINT_BATCH_SIZE = 50
+PAGE_SIZE = 1000
+PRINTER_COLUMNS = 'id, business_id, name, terminal_id, printer_type, address, port, vendor_id, product_id, priority'
+
+_printers = {}
+_spoolers = {}
+_lock = threading.Lock()
+_health_thread = None
+
+
+def _default_printer(business_id):
+    return {
+        'id': 'default',
+        'business_id': business_id,
+        'name': 'Default printer',
+        'terminal_id': None,
+        'printer_type': Config.PRINTER_TYPE,
+        'address': Config.PRINTER_IP,
+        'port': Config.PRINTER_PORT,
+        'vendor_id': f'{Config.PRINTER_VENDOR_ID:04x}',
+        'product_id': f'{Config.PRINTER_PRODUCT_ID:04x}',
+        'priority': 0
+    }
+
+
+def invalidate(business_id):
+    """Reload a business's printers on next use (call after changing them)"""
+    with _lock:
+        _printers.pop(business_id, None)
+
+
+def load_printers(supabase, business_id):
+    """Active printers of a business, cached for REGISTRY_CACHE_SECONDS"""
+    now = time.monotonic()
+    with _lock:
+        cached = _printers.get(business_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    try:
+        rows = supabase.table('printers') \
+            .select(PRINTER_COLUMNS) \
+            .eq('business_id', business_id) \
+            .eq('is_active', True) \
+            .order('priority') \
+            .execute().data or []
+    except Exception as e:
+        print(f"⚠️ Printer registry unavailable: {str(e)}")
+        rows = []
+
+    if not rows and Config.PRINTER_ENABLED:
+        rows = [_default_printer(business_id)]
+
+    with _lock:
+        _printers[business_id] = (now + REGISTRY_CACHE_SECONDS, rows)
+    return rows
+
+
+def _settings(row):
+    return (row.get('printer_type'), row.get('address'), row.get('port'), row.get('vendor_id'), row.get('product_id'))
+
+
+def _spooler(row):
+    """The spooler of a printer row, recreated when its connection settings change"""
+    key = (row['business_id'], row['id'])
+    with _lock:
+        entry = _spoolers.get(key)
+        if entry and entry[0] == _settings(row):
+            entry[1].row = row
+            return entry[1]
+
+        printer = ReceiptPrinter(
+            printer_type=row.get('printer_type') or 'network',
+            ip=row.get('address'),
+            port=row.get('port') or 9100,
+            vendor_id=int(row.get('vendor_id') or '0', 16),
+            product_id=int(row.get('product_id') or '0', 16)
+        )
+        spooler = PrinterSpooler(printer, on_failed=_hand_off)
+        spooler.row = row
+        _spoolers[key] = (_settings(row), spooler)
+
+    _start_health_checks()
+    return spooler
+
+
+def _group(rows, terminal_id):
+    """The terminal's own printers, or the business-wide ones"""
+    own = [row for row in rows if terminal_id and row.get('terminal_id') == terminal_id]
+    return own or [row for row in rows if not row.get('terminal_id')]
+
+
+def _pick(rows, exclude=()):
+    spoolers = [_spooler(row) for row in rows if row['id'] not in exclude]
+    if not spoolers:
+        return None
+    # With every printer down, queue anyway: the spooler retries and the health check may bring it back
+    pool = [spooler for spooler in spoolers if spooler.healthy] or spoolers
+    return min(pool, key=lambda spooler: (spooler.pending(), spooler.row.get('priority') or 0))
+
+
+def route(supabase, business_id, terminal_id=None):
+    """The spooler a job from this terminal should go to, or None when the business has no printer"""
+    return _pick(_group(load_printers(supabase, business_id), terminal_id))
+
+
+def _hand_off(spooler, job):
+    """Move a job from a failing printer to a healthy one of its group; True when moved"""
+    business_id = spooler.row['business_id']
+    tried = job.setdefault('tried', set())
+    tried.add(spooler.row['id'])
+
+    with _lock:
+        cached = _printers.get(business_id)
+    rows = cached[1] if cached else []
+    target = _pick(_group(rows, job.get('terminal_id')), exclude=tried)
+    if target is None or not target.healthy:
+        # Keep retrying on this printer
+        return False
+    print(f"🔄 {job['label']} moved from {spooler.printer!r} to {target.printer!r}")
+    target.submit_job(job)
+    return True
+
+
+def print_receipt(supabase, business_id, escpos, terminal_id=None, label=None):
+    """Queue a receipt on the terminal's printer; False when there is none"""
+    spooler = route(supabase, business_id, terminal_id)
+    if spooler is None:
+        return False
+    spooler.submit_job({'chunks': [bytes(escpos)], 'label': label or 'receipt', 'terminal_id': terminal_id})
+    return True
+
+
+def reprint_day(supabase, business_id, day, terminal_id=None):
+    """
+    Queue every receipt of a day as one streamed job
+
+    Sale ids are read up front; the receipts themselves are fetched
+    REPRINT_BATCH_SIZE at a time while the job prints.
+
+    Returns:
+        int: Receipts queued (None when the business has no printer)
+    """
+    spooler = route(supabase, business_id, terminal_id)
+    if spooler is None:
+        return None
+
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    sale_ids = []
+    offset = 0
+    while True:
+        sales = supabase.table('sales') \
+            .select('id') \
+            .eq('business_id', business_id) \
+            .gte('created_at', day.isoformat()) \
+            .lt('created_at', (day + timedelta(days=1)).isoformat()) \
+            .order('created_at') \
+            .order('id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute().data or []
+        sale_ids.extend(sale['id'] for sale in sales)
+        if len(sales) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    if not sale_ids:
+        return 0
+
+    def chunks():
+        for i in range(0, len(sale_ids), REPRINT_BATCH_SIZE):
+            batch = sale_ids[i:i + REPRINT_BATCH_SIZE]
+            blobs = receipts.escpos_for_sales(supabase, business_id, batch)
+            for sale_id in batch:
+                if sale_id in blobs:
+                    yield blobs[sale_id]
+
+    spooler.submit_job({'chunks': chunks, 'label': f'reprint of {day.isoformat()}', 'terminal_id': terminal_id})
+    return len(sale_ids)
+
+
+def status(supabase, business_id):
+    """Printers of a business with their spooler status"""
+    return [dict(row, status=_spooler(row).status()) for row in load_printers(supabase, business_id)]
+
+
+def check_health():
+    """Probe idle printers; unreachable ones leave the rotation until they answer"""
+    with _lock:
+        spoolers = [entry[1] for entry in _spoolers.values()]
+    for spooler in spoolers:
+        # A printer with queued jobs is being tried by its spooler, which sets healthy itself
+        if spooler.pending():
+            continue
+        healthy = spooler.probe()
+        if healthy is None:
+            continue
+        if healthy != spooler.healthy:
+            print(f"{'✅' if healthy else '⚠️'} Printer {spooler.printer!r} {'back online' if healthy else 'unreachable'}")
+        spooler.healthy = healthy
+
+
+def _health_loop(interval_seconds):
+    while True:
+        time.sleep(interval_seconds)
+        try:
+            check_health()
+        except Exception as e:
+            print(f"❌ Printer health check failed: {str(e)}")
+
+
+def _start_health_checks():
+    global _health_thread
+    with _lock:
+        if _health_thread is not None and _health_thread.is_alive():
+            return
+        _health_thread = threading.Thread(target=_health_loop, args=(Config.PRINTER_HEALTH_CHECK_SECONDS,),
+                                          daemon=True)
+        _health_thread.start()
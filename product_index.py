@@ -0,0 +1,227 @@
+# product_index.py
+"""
+In-memory product lookup index for the sales terminal.
+
+One index per business is built from the catalogue snapshot and updated from
+its change listener, so product and stock writes that mark the snapshot dirty
+reach the index on the next lookup without any extra queries:
+
+- barcode and SKU: exact-match hash map plus a sorted key list for prefixes
+- names: sorted word list for word-prefix matches and a trigram index for
+  substring matches (search-as-you-type)
+"""
+import bisect
+import heapq
+import re
+import threading
+
+import catalog_snapshot
+from catalog_snapshot import ID, NAME, SKU, BARCODE, PRICE, TAX_RATE, STOCK, CATEGORY_ID, UNIT, IMAGE_URL
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    return (text or '').strip().lower()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _sorted_remove(keys, key):
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+def _prefix_ids(keys, prefix):
+    """Product ids of (key, product_id) entries whose key starts with prefix"""
+    ids = set()
+    i = bisect.bisect_left(keys, (prefix,))
+    while i < len(keys) and keys[i][0].startswith(prefix):
+        ids.add(keys[i][1])
+        i += 1
+    return ids
+
+
+class ProductIndex:
+    """Barcode/SKU hash maps and name prefix/trigram indexes for one business"""
+
+    def __init__(self, business_id):
+        self.business_id = business_id
+        self.lock = threading.RLock()
+        self.rows = {}
+        self.names = {}
+        self.by_code = {}
+        self.code_keys = []
+        self.name_keys = []
+        self.grams = {}
+
+    def _codes(self, row):
+        return {code for code in (normalize(row[SKU]), normalize(row[BARCODE])) if code}
+
+    def _add(self, row, sort=True):
+        product_id = row[ID]
+        name = normalize(row[NAME])
+        self.rows[product_id] = row
+        self.names[product_id] = name
+
+        insert = bisect.insort if sort else list.append
+        for code in self._codes(row):
+            self.by_code[code] = product_id
+            insert(self.code_keys, (code, product_id))
+        for token in set(_TOKEN_RE.findall(name)):
+            insert(self.name_keys, (token, product_id))
+        for gram in _trigrams(name):
+            self.grams.setdefault(gram, set()).add(product_id)
+
+    def _remove(self, product_id):
+        row = self.rows.pop(product_id, None)
+        if row is None:
+            return
+        name = self.names.pop(product_id)
+
+        for code in self._codes(row):
+            if self.by_code.get(code) == product_id:
+                del self.by_code[code]
+            _sorted_remove(self.code_keys, (code, product_id))
+        for token in set(_TOKEN_RE.findall(name)):
+            _sorted_remove(self.name_keys, (token, product_id))
+        for gram in _trigrams(name):
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self.grams[gram]
+
+    def rebuild(self, rows):
+        """Replace the index contents with the given snapshot rows"""
+        with self.lock:
+            self.rows, self.names, self.by_code, self.grams = {}, {}, {}, {}
+            self.code_keys, self.name_keys = [], []
+            for row in rows.values():
+                self._add(row, sort=False)
+            self.code_keys.sort()
+            self.name_keys.sort()
+
+    def apply(self, changed_rows, removed_ids):
+        """Apply a snapshot delta"""
+        with self.lock:
+            for product_id in removed_ids:
+                self._remove(product_id)
+            for product_id, row in changed_rows.items():
+                self._remove(product_id)
+                self._add(row)
+
+    def get(self, product_id):
+        return self.rows.get(product_id)
+
+    def lookup_code(self, code):
+        """Exact barcode or SKU match (case-insensitive)"""
+        product_id = self.by_code.get(normalize(code))
+        return self.rows.get(product_id) if product_id else None
+
+    def search(self, query, limit=10, category_id=None):
+        """Best `limit` matches for a query (see search_page)"""
+        return self.search_page(query, limit, 0, category_id)[0]
+
+    def search_page(self, query, limit=20, offset=0, category_id=None):
+        """
+        Search by barcode, SKU and name
+
+        Exact code matches rank first, then code prefixes, then names whose
+        words start with every query word, then names containing the query.
+
+        Returns:
+            tuple: (snapshot rows for the page, total matches)
+        """
+        query = normalize(query)
+        if not query:
+            return [], 0
+
+        with self.lock:
+            ranks = {}
+
+            def rank(product_ids, value):
+                ranks.update(dict.fromkeys(product_ids - ranks.keys(), value))
+
+            exact = self.by_code.get(query)
+            if exact:
+                rank({exact}, 0)
+            rank(_prefix_ids(self.code_keys, query), 1)
+
+            tokens = _TOKEN_RE.findall(query)
+            if tokens:
+                matches = None
+                for token in tokens:
+                    ids = _prefix_ids(self.name_keys, token)
+                    matches = ids if matches is None else matches & ids
+                    if not matches:
+                        break
+                rank(matches or set(), 2)
+
+            if len(query) >= 3:
+                candidates = None
+                for gram in _trigrams(query):
+                    ids = self.grams.get(gram, set())
+                    candidates = set(ids) if candidates is None else candidates & ids
+                    if not candidates:
+                        break
+                candidates = (candidates or set()) - ranks.keys()
+                rank({pid for pid in candidates if query in self.names[pid]}, 3)
+
+            if category_id:
+                ranks = {pid: value for pid, value in ranks.items() if self.rows[pid][CATEGORY_ID] == category_id}
+            names = self.names
+            page = heapq.nsmallest(offset + limit, ranks, key=lambda pid: (ranks[pid], names[pid]))
+            return [self.rows[pid] for pid in page[offset:]], len(ranks)
+
+
+def product_dict(row):
+    """Expand a snapshot row into the product fields the APIs return"""
+    return {
+        'id': row[ID],
+        'name': row[NAME],
+        'sku': row[SKU],
+        'barcode': row[BARCODE],
+        'selling_price': row[PRICE],
+        'tax_rate': row[TAX_RATE],
+        'stock': row[STOCK],
+        'category_id': row[CATEGORY_ID],
+        'unit': row[UNIT],
+        'image_url': row[IMAGE_URL],
+    }
+
+
+def _on_catalog_change(business_id, changed_rows, removed_ids, full):
+    with _indexes_lock:
+        index = _indexes.get(business_id)
+        if index is None:
+            if not full:
+                return
+            index = _indexes[business_id] = ProductIndex(business_id)
+    if full:
+        index.rebuild(changed_rows)
+    else:
+        index.apply(changed_rows, removed_ids)
+
+
+catalog_snapshot.add_listener(_on_catalog_change)
+
+
+def get_index(supabase, business_id):
+    """Get the up-to-date product index for a business"""
+    snapshot = catalog_snapshot.get_snapshot(supabase, business_id)
+    with _indexes_lock:
+        index = _indexes.get(business_id)
+        if index is not None:
+            return index
+        index = _indexes[business_id] = ProductIndex(business_id)
+    # Snapshot was built before this module registered its listener
+    with snapshot.lock:
+        index.rebuild(snapshot.rows)
+    return index
@@ -0,0 +1,128 @@
+# product_search.py
+"""
+Ranked, paginated product search.
+
+Searches through the search_products RPC, which is backed by the pg_trgm and
+tsvector indexes from migrations/0016. When the RPC is not installed (e.g. a
+local stand-in database) the in-memory product index answers active-only
+searches instead, and a plain ilike query is the last resort.
+"""
+import time
+
+import product_index
+
+RPC_RETRY_SECONDS = 300
+MAX_PER_PAGE = 100
+
+_rpc_unavailable_until = 0
+
+
+def _page_result(products, total, page, per_page, source):
+    return {
+        'products': products,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page if total else 0,
+        'source': source,
+    }
+
+
+def _search_rpc(supabase, business_id, query, page, per_page, active_only):
+    response = supabase.rpc('search_products', {
+        'p_business_id': business_id,
+        'p_query': query,
+        'p_limit': per_page,
+        'p_offset': (page - 1) * per_page,
+        'p_active_only': active_only,
+    }).execute()
+
+    rows = response.data or []
+    total = rows[0].pop('total_count', 0) if rows else 0
+    for row in rows[1:]:
+        row.pop('total_count', None)
+
+    if not rows and page > 1:
+        # Past the last page: the window count comes back with the first row
+        first = supabase.rpc('search_products', {
+            'p_business_id': business_id,
+            'p_query': query,
+            'p_limit': 1,
+            'p_offset': 0,
+            'p_active_only': active_only,
+        }).execute()
+        total = first.data[0]['total_count'] if first.data else 0
+    return _page_result(rows, total, page, per_page, 'database')
+
+
+def _search_index(supabase, business_id, query, page, per_page):
+    # The index only holds active products
+    index = product_index.get_index(supabase, business_id)
+    rows, total = index.search_page(query, per_page, (page - 1) * per_page)
+    products = [dict(product_index.product_dict(row), is_active=True) for row in rows]
+    return _page_result(products, total, page, per_page, 'memory')
+
+
+def _ilike_pattern(query):
+    """Quoted PostgREST value matching `query` anywhere, with %, _ and backslashes taken literally"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f'%{escaped}%'
+    return '"' + pattern.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _search_ilike(supabase, business_id, query, page, per_page, active_only):
+    offset = (page - 1) * per_page
+    pattern = _ilike_pattern(query)
+    db_query = supabase.table('products') \
+        .select('id, name, sku, barcode, selling_price, tax_rate, unit, image_url, category_id, is_active', count='exact') \
+        .or_(f'name.ilike.{pattern},sku.ilike.{pattern},barcode.ilike.{pattern}') \
+        .eq('business_id', business_id)
+    if active_only:
+        db_query = db_query.eq('is_active', True)
+    response = db_query \
+        .order('name') \
+        .range(offset, offset + per_page - 1) \
+        .execute()
+    return _page_result(response.data or [], response.count or 0, page, per_page, 'ilike')
+
+
+def search_products(supabase, business_id, query, page=1, per_page=20, active_only=False):
+    """
+    Search a business's products by name, SKU and barcode
+
+    Args:
+        supabase: Supabase client
+        business_id: Business to search
+        query: Search text
+        page: 1-based page number
+        per_page: Results per page (capped at MAX_PER_PAGE)
+        active_only: Exclude inactive products
+
+    Returns:
+        dict: products (best match first), total, page, per_page, pages, source
+    """
+    global _rpc_unavailable_until
+
+    query = (query or '').strip()
+    page = max(1, int(page or 1))
+    per_page = min(max(1, int(per_page or 20)), MAX_PER_PAGE)
+
+    if not query:
+        return _page_result([], 0, page, per_page, 'none')
+
+    if time.monotonic() >= _rpc_unavailable_until:
+        try:
+            return _search_rpc(supabase, business_id, query, page, per_page, active_only)
+        except Exception as e:
+            # Don't pay for a failing round trip on every keystroke
+            _rpc_unavailable_until = time.monotonic() + RPC_RETRY_SECONDS
+            print(f"⚠️ search_products RPC unavailable, using in-memory index: {str(e)}")
+
+    if active_only:
+        # The index cannot answer searches that include inactive products
+        try:
+            return _search_index(supabase, business_id, query, page, per_page)
+        except Exception as e:
+            print(f"⚠️ Product index unavailable, using ilike search: {str(e)}")
+
+    return _search_ilike(supabase, business_id, query, page, per_page, active_only)
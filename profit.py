@@ -0,0 +1,110 @@
+# profit.py
+"""
+Cost of goods sold and gross margin.
+
+Checkout consumes product lots FIFO and records the cost it used on each
+sale item (``cost_amount``) and inventory movement (``unit_cost``). Triggers
+keep ``sales_daily_rollup`` (migrations/0003, 0012) at the paid sales of each
+day: completed sales in full, partial refunds less the refunded revenue,
+pending, failed and fully refunded sales not at all. Margins per day,
+product and category are read from one row per business, day and product
+rather than by replaying lots.
+
+Rollup revenue is pre-tax item revenue; compute margins against it, not
+against sales.total_amount.
+"""
+from datetime import date
+
+import analytics
+
+
+def unit_cost(lot, product_cost=0):
+    """Cost per unit of a lot, falling back to the product's cost price"""
+    cost = lot.get('cost_price') if lot else None
+    if cost is None:
+        cost = product_cost
+    return float(cost or 0)
+
+
+def get_product_costs(supabase, product_ids):
+    """Current cost price per product id"""
+    if not product_ids:
+        return {}
+    response = supabase.table('products') \
+        .select('id, cost_price') \
+        .in_('id', list(product_ids)) \
+        .execute()
+    return {row['id']: float(row.get('cost_price') or 0) for row in response.data or []}
+
+
+def _margin(revenue, cogs):
+    gross_profit = revenue - cogs
+    return {
+        'revenue': revenue,
+        'cogs': cogs,
+        'gross_profit': gross_profit,
+        'gross_margin': (gross_profit / revenue * 100) if revenue > 0 else 0
+    }
+
+
+def get_cogs_summary(supabase, business_id, start_date, end_date):
+    """
+    Revenue, COGS and gross margin for a period, from the daily rollup
+
+    Args:
+        start_date, end_date: Dates or ISO strings (inclusive)
+
+    Returns:
+        dict: Totals plus 'daily' (sorted list), 'by_product' and 'by_category'
+    """
+    start_date = str(start_date)[:10]
+    end_date = str(end_date)[:10]
+
+    try:
+        response = supabase.table('sales_daily_rollup') \
+            .select('sale_date, product_id, category_id, quantity, revenue, cogs, products(name), categories(name)') \
+            .eq('business_id', business_id) \
+            .gte('sale_date', start_date) \
+            .lte('sale_date', end_date) \
+            .execute()
+        rows = response.data or []
+    except Exception as e:
+        print(f"❌ Error loading COGS rollup: {str(e)}")
+        rows = []
+
+    frame = analytics.Frame.from_rows(
+        rows,
+        day=('sale_date', 'day'),
+        product_id=('product_id', 'string'),
+        category_id=('category_id', 'string', 'uncategorized'),
+        quantity=('quantity', 'int'),
+        revenue=('revenue', 'float'),
+        cogs=('cogs', 'float')
+    )
+
+    summary = _margin(frame.sum('revenue'), frame.sum('cogs'))
+    summary['quantity'] = frame.sum('quantity')
+
+    daily_revenue = frame.daily('day', 'revenue', date.fromisoformat(start_date), date.fromisoformat(end_date))
+    daily_cogs = frame.daily('day', 'cogs', date.fromisoformat(start_date), date.fromisoformat(end_date))
+    summary['daily'] = [
+        dict(_margin(revenue['amount'], cogs['amount']), date=revenue['date'])
+        for revenue, cogs in zip(daily_revenue, daily_cogs)
+    ]
+
+    names = {}
+    for row in rows:
+        names[row['product_id']] = (row.get('products') or {}).get('name', '')
+        names[row.get('category_id') or 'uncategorized'] = (row.get('categories') or {}).get('name', 'Uncategorized')
+
+    for key, group in (('by_product', 'product_id'), ('by_category', 'category_id')):
+        revenue = frame.group_sums(group, 'revenue')
+        cogs = frame.group_sums(group, 'cogs')
+        quantity = frame.group_sums(group, 'quantity')
+        summary[key] = {
+            group_id: dict(_margin(revenue[group_id], cogs.get(group_id, 0)),
+                           name=names.get(group_id, ''), quantity=quantity.get(group_id, 0))
+            for group_id in revenue
+        }
+
+    return summary
@@ -0,0 +1,224 @@
+# rate_limiter.py
+"""
+Request rate limits and the failed-login throttle.
+
+Limits are sliding-window counters: each key keeps the hit count of the
+current and previous fixed window, and the previous one is weighted by how
+much of it still overlaps the sliding window. That is O(1) time and memory
+per key and close enough to an exact log for throttling.
+
+init_app() installs a before_request hook that checks the endpoints in
+RULES and answers 429 (with Retry-After) before the view runs, so rejected
+requests never reach Supabase. Logins have no rule there: the login view
+counts only failed attempts per email and per IP (login_blocked /
+login_failed / login_succeeded), so a shift logging in from one address is
+never throttled.
+
+Counters live in process memory. With several workers set
+RATE_LIMIT_BACKEND=supabase to share them through the rate_limit_hit()
+function (migrations/0011); if it is unavailable the in-memory counters are
+used instead.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+
+from config import Config
+
+SWEEP_INTERVAL_SECONDS = 60
+
+# scope: 'ip', 'user' (logged-in user, else IP) or 'pending' (user awaiting email verification, else IP)
+# template: page re-rendered with a 429 for form posts; None answers with JSON
+Rule = namedtuple('Rule', 'name scope limit window methods template')
+
+RULES = {
+    'auth.resend_otp': [Rule('otp', 'ip', 10, 600, ('POST',), None),
+                        Rule('otp-user', 'pending', 3, 600, ('POST',), None)],
+    'auth.forgot_password': [Rule('reset', 'ip', 5, 900, ('POST',), 'auth/forgot_password.html')],
+    'user_roles.search_users': [Rule('search-users', 'user', 60, 60, ('GET',), None)],
+}
+
+
+def _is_missing_function(error):
+    return getattr(error, 'code', None) == 'PGRST202' or 'Could not find the function' in str(error)
+
+
+class SlidingWindowCounter:
+    """In-process sliding-window counters keyed by string"""
+
+    def __init__(self):
+        self._counters = {}  # key -> [window_start, current, previous, window]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key, limit, window, cost=1):
+        """
+        Count `cost` hits against `key` unless that would exceed `limit` per
+        `window` seconds (cost=0 only checks)
+
+        Returns:
+            tuple: (allowed, retry_after seconds)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = [now - now % window, 0, 0, window]
+            elapsed = now - counter[0]
+            if elapsed >= window:
+                # Roll over; after two windows the previous one no longer overlaps
+                counter[2] = counter[1] if elapsed < 2 * window else 0
+                counter[1] = 0
+                counter[0] = now - now % window
+                elapsed = now - counter[0]
+
+            weight = 1 - elapsed / window
+            estimate = counter[2] * weight + counter[1]
+            if estimate + cost > limit or (cost == 0 and estimate >= limit):
+                return False, _retry_after(counter[1], counter[2], weight, limit, window, elapsed)
+            counter[1] += cost
+            return True, 0
+
+    def reset(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def _sweep(self, now):
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        stale = [key for key, counter in self._counters.items() if now - counter[0] >= 2 * counter[3]]
+        for key in stale:
+            del self._counters[key]
+
+
+def _retry_after(current, previous, weight, limit, window, elapsed):
+    """Seconds until the estimate drops below the limit again"""
+    if current >= limit or not previous:
+        # Only the next window frees room; by then this window's hits are the weighted ones
+        wait = window - elapsed
+        if current >= limit:
+            wait += window * (1 - (limit - 1) / current)
+        return max(1, math.ceil(wait))
+    # This window's hits alone are under the limit, so the rollover frees room at the latest
+    excess = previous * weight + current - (limit - 1)
+    return max(1, math.ceil(min(excess / previous * window, window - elapsed)))
+
+
+class SupabaseCounter:
+    """Counters shared between workers through the rate_limit_hit() function"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._supabase = None
+        self._available = True
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            from supabase import create_client
+            self._supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+        return self._supabase
+
+    def hit(self, key, limit, window, cost=1):
+        if self._available:
+            try:
+                response = self.supabase.rpc('rate_limit_hit', {
+                    'p_key': key, 'p_limit': limit, 'p_window_seconds': window, 'p_cost': cost
+                }).execute()
+                row = response.data[0] if isinstance(response.data, list) else response.data
+                return bool(row['allowed']), int(row['retry_after'] or 0)
+            except Exception as e:
+                if _is_missing_function(e):
+                    self._available = False
+                    print("⚠️ rate_limit_hit() not installed, rate limiting in memory")
+                else:
+                    print(f"⚠️ Shared rate limit unavailable: {str(e)}")
+        return self.fallback.hit(key, limit, window, cost)
+
+    def reset(self, key):
+        self.fallback.reset(key)
+        if self._available:
+            try:
+                self.supabase.table('rate_limit_counters').delete().eq('key', key).execute()
+            except Exception as e:
+                print(f"⚠️ Could not reset rate limit {key}: {str(e)}")
+
+
+def _create_backend():
+    memory = SlidingWindowCounter()
+    if Config.RATE_LIMIT_BACKEND == 'supabase':
+        return SupabaseCounter(memory)
+    return memory
+
+
+counters = _create_backend()
+
+
+def login_blocked(ip, email):
+    """Seconds to wait before this IP or email may try to log in again; 0 when allowed"""
+    if not Config.RATE_LIMIT_ENABLED:
+        return 0
+    limit, window = Config.LOGIN_FAILURE_LIMIT, Config.LOGIN_FAILURE_WINDOW_SECONDS
+    waits = [counters.hit(f'login-fail:email:{email}', limit, window, cost=0)[1],
+             counters.hit(f'login-fail:ip:{ip}', limit * 4, window, cost=0)[1]]
+    return max(waits)
+
+
+def login_failed(ip, email):
+    """Count a failed login against the email and the IP"""
+    if not Config.RATE_LIMIT_ENABLED:
+        return
+    limit, window = Config.LOGIN_FAILURE_LIMIT, Config.LOGIN_FAILURE_WINDOW_SECONDS
+    counters.hit(f'login-fail:email:{email}', limit, window)
+    counters.hit(f'login-fail:ip:{ip}', limit * 4, window)
+
+
+def login_succeeded(email):
+    """Clear an email's failed attempts (the IP's count stays)"""
+    if Config.RATE_LIMIT_ENABLED:
+        counters.reset(f'login-fail:email:{email}')
+
+
+def describe_wait(seconds):
+    if seconds < 60:
+        return f'{seconds} seconds'
+    minutes = math.ceil(seconds / 60)
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+
+def init_app(app):
+    """Check RULES before every request to a limited endpoint"""
+    from flask import request, session, jsonify, flash, render_template
+
+    def identity(scope):
+        if scope == 'user' and session.get('user_id'):
+            return f"user:{session['user_id']}"
+        if scope == 'pending' and session.get('user_id_temp'):
+            return f"user:{session['user_id_temp']}"
+        return f'ip:{request.remote_addr}'
+
+    @app.before_request
+    def enforce_rate_limits():
+        if not Config.RATE_LIMIT_ENABLED:
+            return None
+        for rule in RULES.get(request.endpoint, ()):
+            if request.method not in rule.methods:
+                continue
+            allowed, retry_after = counters.hit(f'{rule.name}:{identity(rule.scope)}', rule.limit, rule.window)
+            if allowed:
+                continue
+
+            print(f"⚠️ Rate limit {rule.name} hit by {identity(rule.scope)} on {request.path}")
+            message = f'Too many requests. Please try again in {describe_wait(retry_after)}.'
+            if rule.template:
+                flash(message, 'error')
+                response = app.make_response((render_template(rule.template), 429))
+            else:
+                response = jsonify({'success': False, 'message': message})
+                response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        return None
@@ -0,0 +1,294 @@
+# receipts.py
+"""
+Pre-rendered sale receipts.
+
+A receipt is rendered once, at checkout, into a stored payload: the compact
+JSON the receipt is built from, the receipt page HTML and the ESC/POS bytes
+for a thermal printer. Payloads are kept in sale_receipts (migrations/0008)
+and in a bounded in-process LRU cache, so viewing or reprinting a receipt is
+one key lookup.
+
+A receipt shows the payment status, so it is discarded whenever the sale's
+status changes: the database trigger removes the stored row, and the routes
+that change a sale (refunds, PesaPal status updates) call discard() for the
+cached copy. A receipt that is missing is rebuilt from the sale on the next
+view and stored again.
+"""
+import base64
+import threading
+import time
+from collections import OrderedDict
+
+from flask import render_template
+
+from config import Config
+
+SALE_FIELDS = ('id', 'invoice_number', 'created_at', 'customer_name', 'customer_phone', 'subtotal',
+               'tax_amount', 'discount_amount', 'total_amount', 'payment_method', 'payment_status')
+ITEM_FIELDS = ('product_name', 'quantity', 'unit_price', 'total_price')
+BUSINESS_FIELDS = ('business_name', 'address', 'city', 'country', 'business_phone', 'logo_url')
+BUSINESS_CACHE_SECONDS = 600
+# Printed payment status; other statuses print as they are, in upper case
+RECEIPT_STATUSES = {'completed': 'PAID', 'pending': 'PENDING', 'failed': 'FAILED',
+                    'refunded': 'REFUNDED', 'partially_refunded': 'PARTIALLY REFUNDED'}
+
+# ESC/POS commands
+ESC_INIT = b'\x1b@'
+ESC_ALIGN = {'left': b'\x1ba\x00', 'center': b'\x1ba\x01', 'right': b'\x1ba\x02'}
+ESC_BOLD_ON, ESC_BOLD_OFF = b'\x1bE\x01', b'\x1bE\x00'
+GS_SIZE_DOUBLE, GS_SIZE_NORMAL = b'\x1d!\x11', b'\x1d!\x00'
+GS_FEED_CUT = b'\x1dVB\x03'
+
+_receipts = OrderedDict()
+_businesses = {}
+_cache_lock = threading.Lock()
+
+
+def _pick(row, fields):
+    return {field: row.get(field) for field in fields}
+
+
+def build_payload(sale, items, business, cashier_name=None):
+    """Compact receipt data from the sale row, its items and the business"""
+    users = sale.get('users') or {}
+    return {
+        'sale': dict(_pick(sale, SALE_FIELDS), users={'first_name': cashier_name or users.get('first_name')}),
+        'items': [_pick(item, ITEM_FIELDS) for item in items],
+        'business': _pick(business, BUSINESS_FIELDS)
+    }
+
+
+def _money(value):
+    return f"{float(value or 0):,.0f}"
+
+
+def _line(left, right, width):
+    right = str(right)
+    return f"{str(left)[:max(1, width - len(right) - 1)]:<{width - len(right)}}{right}"
+
+
+def render_escpos(payload, width=None):
+    """ESC/POS bytes for a thermal printer, `width` characters per line"""
+    width = width or Config.RECEIPT_LINE_WIDTH
+    sale, business = payload['sale'], payload['business']
+    out = [ESC_INIT, ESC_ALIGN['center'], GS_SIZE_DOUBLE]
+
+    def text(value=''):
+        out.append(str(value).encode('ascii', 'replace') + b'\n')
+
+    text((business.get('business_name') or 'BUSINESS NAME')[:width // 2])
+    out.append(GS_SIZE_NORMAL)
+    if business.get('address'):
+        text(business['address'][:width])
+    location = ', '.join(part for part in (business.get('city'), business.get('country')) if part)
+    if location:
+        text(location[:width])
+    if business.get('business_phone'):
+        text(f"Tel: {business['business_phone']}")
+
+    out.append(ESC_ALIGN['left'])
+    text('-' * width)
+    text(_line('Receipt:', sale.get('invoice_number') or '', width))
+    text(_line('Date:', (sale.get('created_at') or '')[:19].replace('T', ' '), width))
+    text(_line('Cashier:', (sale.get('users') or {}).get('first_name') or 'Staff', width))
+    text(_line('Customer:', sale.get('customer_name') or '', width))
+    if sale.get('customer_phone'):
+        text(_line('Phone:', sale['customer_phone'], width))
+    text('-' * width)
+
+    for item in payload['items']:
+        text((item.get('product_name') or '')[:width])
+        text(_line(f"  {item.get('quantity')} x {_money(item.get('unit_price'))}", _money(item.get('total_price')), width))
+    text('-' * width)
+
+    text(_line('Subtotal:', f"UGX {_money(sale.get('subtotal'))}", width))
+    if float(sale.get('tax_amount') or 0) > 0:
+        text(_line('Tax:', f"UGX {_money(sale['tax_amount'])}", width))
+    if float(sale.get('discount_amount') or 0) > 0:
+        text(_line('Discount:', f"-UGX {_money(sale['discount_amount'])}", width))
+    out.append(ESC_BOLD_ON)
+    text(_line('TOTAL:', f"UGX {_money(sale.get('total_amount'))}", width))
+    out.append(ESC_BOLD_OFF)
+    text(_line('Payment:', (sale.get('payment_method') or '').upper(), width))
+    payment_status = sale.get('payment_status') or ''
+    status = RECEIPT_STATUSES.get(payment_status, payment_status.replace('_', ' ').upper())
+    text(_line('Status:', status, width))
+
+    out.append(ESC_ALIGN['center'])
+    text('-' * width)
+    text('Thank you for your business!')
+    text(f"ID: {(sale.get('id') or '')[:8].upper()}")
+    out.append(GS_FEED_CUT)
+    return b''.join(out)
+
+
+def render(payload):
+    """Receipt page HTML and ESC/POS bytes for a payload (needs an app context)"""
+    return {
+        'payload': payload,
+        'html': render_template('sales/receipt.html', **payload),
+        'escpos': render_escpos(payload)
+    }
+
+
+def _remember(business_id, sale_id, receipt):
+    with _cache_lock:
+        _receipts[sale_id] = (business_id, receipt)
+        _receipts.move_to_end(sale_id)
+        while len(_receipts) > Config.RECEIPT_CACHE_SIZE:
+            _receipts.popitem(last=False)
+
+
+def discard(sale_id):
+    """Forget the cached receipt of a sale (call when its status changes)"""
+    with _cache_lock:
+        _receipts.pop(sale_id, None)
+
+
+def store(supabase, business_id, receipt):
+    """Cache a rendered receipt and persist it; failures only cost a rebuild later"""
+    sale = receipt['payload']['sale']
+    _remember(business_id, sale['id'], receipt)
+    try:
+        supabase.table('sale_receipts').upsert({
+            'sale_id': sale['id'],
+            'business_id': business_id,
+            'payment_status': sale.get('payment_status'),
+            'payload': receipt['payload'],
+            'html': receipt['html'],
+            'escpos': base64.b64encode(receipt['escpos']).decode()
+        }, on_conflict='sale_id', returning='minimal').execute()
+    except Exception as e:
+        print(f"⚠️ Could not store receipt {sale['id']}: {str(e)}")
+
+
+def get_business(supabase, business_id):
+    """Receipt header fields of a business, cached for BUSINESS_CACHE_SECONDS"""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _businesses.get(business_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    response = supabase.table('businesses') \
+        .select(', '.join(BUSINESS_FIELDS)) \
+        .eq('id', business_id) \
+        .limit(1) \
+        .execute()
+    business = response.data[0] if response.data else {}
+
+    with _cache_lock:
+        _businesses[business_id] = (now + BUSINESS_CACHE_SECONDS, business)
+    return business
+
+
+def record_sale(supabase, business_id, sale, items, cashier_name=None):
+    """Render and store the receipt of a sale just written at checkout; returns it, or None"""
+    try:
+        payload = build_payload(sale, items, get_business(supabase, business_id), cashier_name)
+        receipt = render(payload)
+        store(supabase, business_id, receipt)
+        return receipt
+    except Exception as e:
+        print(f"⚠️ Could not pre-render receipt {sale.get('id')}: {str(e)}")
+        return None
+
+
+def _rebuild(supabase, business_id, sale_id):
+    sale_response = supabase.table('sales') \
+        .select(', '.join(SALE_FIELDS) + ', users(first_name)') \
+        .eq('id', sale_id) \
+        .eq('business_id', business_id) \
+        .limit(1) \
+        .execute()
+    if not sale_response.data:
+        return None
+
+    items = supabase.table('sale_items') \
+        .select(', '.join(ITEM_FIELDS)) \
+        .eq('sale_id', sale_id) \
+        .order('created_at') \
+        .execute().data or []
+
+    receipt = render(build_payload(sale_response.data[0], items, get_business(supabase, business_id)))
+    store(supabase, business_id, receipt)
+    return receipt
+
+
+def escpos_for_sales(supabase, business_id, sale_ids):
+    """
+    ESC/POS bytes for many sales in a few bulk queries (no app context needed)
+
+    Stored receipts are used where they exist; the rest are built from their
+    sales without rendering or storing HTML.
+
+    Returns:
+        dict: {sale_id: bytes} for the sales that exist
+    """
+    blobs = {}
+    try:
+        response = supabase.table('sale_receipts') \
+            .select('sale_id, payload, escpos') \
+            .eq('business_id', business_id) \
+            .in_('sale_id', list(sale_ids)) \
+            .execute()
+        for row in response.data or []:
+            blobs[row['sale_id']] = base64.b64decode(row['escpos']) if row.get('escpos') \
+                else render_escpos(row['payload'])
+    except Exception as e:
+        print(f"⚠️ Stored receipts unavailable: {str(e)}")
+
+    missing = [sale_id for sale_id in sale_ids if sale_id not in blobs]
+    if missing:
+        sales = supabase.table('sales') \
+            .select(', '.join(SALE_FIELDS) + ', users(first_name)') \
+            .eq('business_id', business_id) \
+            .in_('id', missing) \
+            .execute().data or []
+        items = supabase.table('sale_items') \
+            .select('sale_id, ' + ', '.join(ITEM_FIELDS)) \
+            .in_('sale_id', missing) \
+            .order('created_at') \
+            .execute().data or []
+        items_by_sale = {}
+        for item in items:
+            items_by_sale.setdefault(item['sale_id'], []).append(item)
+        business = get_business(supabase, business_id)
+        for sale in sales:
+            blobs[sale['id']] = render_escpos(build_payload(sale, items_by_sale.get(sale['id'], []), business))
+    return blobs
+
+
+def get_receipt(supabase, business_id, sale_id):
+    """
+    Receipt of a sale: the cache, then sale_receipts, then a rebuild from the sale
+
+    Returns:
+        dict: payload, html, escpos (bytes), or None when the sale does not exist
+    """
+    with _cache_lock:
+        cached = _receipts.get(sale_id)
+        if cached and cached[0] == business_id:
+            _receipts.move_to_end(sale_id)
+            return cached[1]
+
+    try:
+        response = supabase.table('sale_receipts') \
+            .select('payload, html, escpos') \
+            .eq('sale_id', sale_id) \
+            .eq('business_id', business_id) \
+            .limit(1) \
+            .execute()
+        if response.data:
+            row = response.data[0]
+            receipt = {
+                'payload': row['payload'],
+                'html': row['html'],
+                'escpos': base64.b64decode(row['escpos']) if row.get('escpos') else render_escpos(row['payload'])
+            }
+            _remember(business_id, sale_id, receipt)
+            return receipt
+    except Exception as e:
+        print(f"⚠️ Stored receipts unavailable: {str(e)}")
+
+    return _rebuild(supabase, business_id, sale_id)
@@ -1,98 +1,274 @@
-# utils/receipt_printer.py
-from escpos.printer import Network, Usb
-from escpos.constants import PAPER_FULL_CUT, PAPER_PART_CUT
-import os
+# reciept_printer.py
+"""
+Receipt printer spooler.
+
+Receipts arrive as one pre-rendered ESC/POS blob (see receipts.py) and are
+queued here, so checkout never waits for the printer. A worker thread keeps
+one open connection to the printer, writes each blob in a single send and
+retries failed jobs with backoff, reconnecting between attempts.
+
+Network printers (raw TCP, port 9100) need nothing extra; USB printers use
+python-escpos when it is installed. Which printer a receipt goes to is
+decided by printer_registry.
+
+Try it against a local stand-in printer::
+
+    python reciept_printer.py --serve 9100        # prints what it receives
+    PRINTER_IP=127.0.0.1 python reciept_printer.py --test
+"""
+import argparse
+import queue
+import socket
+import threading
+import time
+
 from config import Config
 
+RETRY_BACKOFF_SECONDS = (1, 2, 5, 10, 30)
+
+
 class ReceiptPrinter:
-    def __init__(self):
-        self.printer_type = Config.PRINTER_TYPE  # 'network' or 'usb'
-        self.printer_ip = Config.PRINTER_IP
-        self.printer_port = Config.PRINTER_PORT
-        self.printer_vendor_id = Config.PRINTER_VENDOR_ID
-        self.printer_product_id = Config.PRINTER_PRODUCT_ID
-        self.printer = None
-        
+    """One persistent connection to a network or USB receipt printer"""
+
+    def __init__(self, printer_type=None, ip=None, port=None, vendor_id=None, product_id=None, timeout=None):
+        self.printer_type = printer_type or Config.PRINTER_TYPE  # 'network' or 'usb'
+        self.printer_ip = ip or Config.PRINTER_IP
+        self.printer_port = port or Config.PRINTER_PORT
+        self.printer_vendor_id = vendor_id or Config.PRINTER_VENDOR_ID
+        self.printer_product_id = product_id or Config.PRINTER_PRODUCT_ID
+        self.timeout = timeout or Config.PRINTER_TIMEOUT_SECONDS
+        self.connection = None
+
+    def __repr__(self):
+        if self.printer_type == 'usb':
+            return f'usb:{self.printer_vendor_id:04x}:{self.printer_product_id:04x}'
+        return f'{self.printer_ip}:{self.printer_port}'
+
     def connect(self):
-        """Connect to printer"""
+        """Open the connection if it is not open already"""
+        if self.connection is not None:
+            return
+        if self.printer_type == 'network':
+            self.connection = socket.create_connection((self.printer_ip, self.printer_port), timeout=self.timeout)
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        elif self.printer_type == 'usb':
+            from escpos.printer import Usb
+            self.connection = Usb(self.printer_vendor_id, self.printer_product_id)
+        else:
+            raise ValueError(f"Unknown printer type: {self.printer_type}")
+
+    def write(self, data):
+        """Send one ESC/POS blob, connecting first if needed"""
+        self.connect()
+        if self.printer_type == 'network':
+            self.connection.sendall(data)
+        else:
+            self.connection._raw(data)
+
+    def probe(self):
+        """Whether the printer accepts a connection; an open connection counts and a new one is not kept"""
+        if self.connection is not None:
+            return True
         try:
             if self.printer_type == 'network':
-                self.printer = Network(self.printer_ip, port=self.printer_port)
-            elif self.printer_type == 'usb':
-                self.printer = Usb(self.printer_vendor_id, self.printer_product_id)
+                socket.create_connection((self.printer_ip, self.printer_port), timeout=self.timeout).close()
             else:
-                raise ValueError(f"Unknown printer type: {self.printer_type}")
-            
+                self.connect()
+                self.close()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        finally:
+            self.connection = None
+
+
+class PrinterSpooler:
+    """
+    Queue of print jobs for one printer, drained by a daemon thread
+
+    A job is a list of ESC/POS chunks, or a callable returning an iterator of
+    chunks for streamed jobs (written one by one over the same connection). A
+    retried job resumes after the last chunk that was sent. After each failed
+    attempt the job is offered to `on_failed(spooler, job)`, which returns True
+    when it handed the job to another printer.
+    """
+
+    def __init__(self, printer=None, max_attempts=None, idle_close_seconds=300, on_failed=None):
+        self.printer = printer or ReceiptPrinter()
+        self.max_attempts = max_attempts or Config.PRINTER_MAX_ATTEMPTS
+        self.idle_close_seconds = idle_close_seconds
+        self.on_failed = on_failed
+        self.healthy = True
+        self.last_error = None
+        self.printed = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Held while the worker uses the connection, so a probe never shares it
+        self._io_lock = threading.Lock()
+
+    def submit(self, data, label=None):
+        """Queue an ESC/POS blob; returns immediately"""
+        data = bytes(data)
+        self.submit_job({'chunks': [data], 'label': label or f'{len(data)} bytes'})
+
+    def submit_stream(self, chunks, label=None):
+        """Queue a streamed job; `chunks()` returns an iterator of ESC/POS blobs"""
+        self.submit_job({'chunks': chunks, 'label': label or 'stream'})
+
+    def submit_job(self, job):
+        job.update(attempts=0, sent=job.get('sent', 0))
+        self._queue.put(job)
+        self.start()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def probe(self):
+        """Probe the printer unless the worker is using it; None when busy"""
+        if not self._io_lock.acquire(blocking=False):
+            return None
+        try:
+            return self.printer.probe()
+        finally:
+            self._io_lock.release()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def status(self):
+        return {
+            'printer': repr(self.printer),
+            'connected': self.printer.connection is not None,
+            'healthy': self.healthy,
+            'queued': self._queue.qsize(),
+            'printed': self.printed,
+            'failed': self.failed,
+            'last_error': self.last_error
+        }
+
+    def _print(self, job):
+        with self._io_lock:
+            return self._print_locked(job)
+
+    def _print_locked(self, job):
+        job['attempts'] += 1
+        try:
+            chunks = job['chunks']() if callable(job['chunks']) else iter(job['chunks'])
+            for index, chunk in enumerate(chunks):
+                if index < job['sent']:
+                    continue
+                self.printer.write(chunk)
+                job['sent'] = index + 1
+            self.printed += 1
+            self.healthy = True
+            self.last_error = None
             return True
         except Exception as e:
-            print(f"Printer connection error: {e}")
+            # A dead connection is reopened on the next attempt
+            self.printer.close()
+            self.healthy = False
+            self.last_error = str(e)
+            print(f"⚠️ Printer {self.printer!r}: {job['label']} attempt {job['attempts']} failed: {str(e)}")
             return False
-    
-    def print_receipt(self, receipt_data):
-        """Print receipt"""
-        if not self.connect():
+
+    def _run(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=self.idle_close_seconds)
+            except queue.Empty:
+                # Let an idle printer go; the next job reconnects
+                with self._io_lock:
+                    self.printer.close()
+                continue
+
+            # Retry in order so receipts come out in the sequence they were sold
+            while not self._print(job):
+                if self._hand_off(job):
+                    break
+                if job['attempts'] >= self.max_attempts:
+                    self.failed += 1
+                    print(f"❌ Printer {self.printer!r}: gave up on {job['label']}")
+                    break
+                time.sleep(RETRY_BACKOFF_SECONDS[min(job['attempts'], len(RETRY_BACKOFF_SECONDS)) - 1])
+            self._queue.task_done()
+
+    def _hand_off(self, job):
+        """Offer a failing job to `on_failed`; True when another printer took it"""
+        if not self.on_failed:
             return False
-        
         try:
-            printer = self.printer
-            
-            # Header
-            printer.set(align='center', width=2, height=2)
-            printer.textln("=" * 32)
-            printer.textln(receipt_data['business']['business_name'])
-            printer.textln("=" * 32)
-            
-            printer.set(align='left', width=1, height=1)
-            printer.textln(f"Date: {receipt_data['sale']['date']}")
-            printer.textln(f"Receipt: {receipt_data['sale']['reference']}")
-            printer.textln(f"Cashier: {receipt_data['cashier']}")
-            printer.textln(f"Customer: {receipt_data['sale']['customer_name']}")
-            if receipt_data['sale']['customer_phone']:
-                printer.textln(f"Phone: {receipt_data['sale']['customer_phone']}")
-            
-            printer.textln("-" * 32)
-            
-            # Items
-            for item in receipt_data['items']:
-                product_name = item['products']['name']
-                if len(product_name) > 20:
-                    product_name = product_name[:20]
-                
-                qty = item['quantity']
-                price = item['unit_price']
-                total = item['total_price']
-                
-                printer.textln(f"{product_name:<20} {qty:>3} {total:>7.2f}")
-                printer.textln(f"{' ':<20} @{price:.2f}")
-            
-            printer.textln("-" * 32)
-            
-            # Totals
-            printer.textln(f"{'Subtotal:':<25} {receipt_data['sale']['subtotal']:>7.2f}")
-            if receipt_data['sale']['discount'] > 0:
-                printer.textln(f"{'Discount:':<25} -{receipt_data['sale']['discount']:>7.2f}")
-            if receipt_data['sale']['tax'] > 0:
-                printer.textln(f"{'Tax:':<25} {receipt_data['sale']['tax']:>7.2f}")
-            printer.textln(f"{'TOTAL:':<25} {receipt_data['sale']['total']:>7.2f}")
-            
-            printer.textln("-" * 32)
-            printer.textln(f"Payment: {receipt_data['sale']['payment_method'].upper()}")
-            printer.textln(f"Status: {receipt_data['sale']['payment_status'].upper()}")
-            
-            # Footer
-            printer.set(align='center')
-            printer.textln("=" * 32)
-            printer.textln("THANK YOU FOR YOUR BUSINESS!")
-            printer.textln("=" * 32)
-            
-            # Cut paper
-            printer.cut()
-            
-            return True
-            
+            return bool(self.on_failed(self, job))
         except Exception as e:
-            print(f"Print error: {e}")
+            print(f"❌ Could not hand off {job['label']}: {str(e)}")
             return False
-        finally:
-            if self.printer:
-                self.printer.close()
\ No newline at end of file
+
+    def join(self):
+        """Block until every queued job is printed or given up"""
+        self._queue.join()
+
+
+_spooler = None
+_spooler_lock = threading.Lock()
+
+
+def get_spooler():
+    """A spooler for the printer in config.py (see printer_registry for per-business printers)"""
+    global _spooler
+    with _spooler_lock:
+        if _spooler is None:
+            _spooler = PrinterSpooler()
+        return _spooler
+
+
+def serve(port, host='127.0.0.1'):
+    """Stand-in network printer: accept raw connections and echo what they send"""
+    with socket.create_server((host, port)) as server:
+        print(f"🖨️ Fake printer listening on {host}:{port}")
+        while True:
+            connection, address = server.accept()
+            with connection:
+                print(f"🔄 Connection from {address[0]}:{address[1]}")
+                while True:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    print(data.decode('ascii', 'replace'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receipt printer spooler')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Run a stand-in network printer on PORT')
+    parser.add_argument('--test', action='store_true', help='Print a test receipt on the configured printer')
+    parser.add_argument('--copies', type=int, default=1, help='Test receipts to print')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+    elif args.test:
+        from receipts import render_escpos
+        sample = {
+            'sale': {'id': 'test', 'invoice_number': 'TEST-0001', 'customer_name': 'Walk-in Customer',
+                     'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'subtotal': 1000, 'total_amount': 1000,
+                     'payment_method': 'cash', 'payment_status': 'completed', 'users': {'first_name': 'Test'}},
+            'items': [{'product_name': 'Test item', 'quantity': 1, 'unit_price': 1000, 'total_price': 1000}],
+            'business': {'business_name': 'ThriveOS'}
+        }
+        spooler = get_spooler()
+        for copy in range(args.copies):
+            spooler.submit(render_escpos(sample), label=f'test receipt {copy + 1}')
+        spooler.join()
+        print(f"✅ {spooler.status()}")
@@ -0,0 +1,314 @@
+# refund_engine.py
+"""
+Refunds with batched restock.
+
+A refund is applied by the ``process_refund`` RPC (migrations/0005) in one
+transaction and one round-trip. It creates the refund record, returns each
+unit to the lot the sale took it from, and writes the refund_items, the IN
+movements, the sale status and the audit log. Until the migration is
+applied, the same effects are planned in memory and written in bulk, a
+fixed number of requests whatever the basket size (plus one guarded update
+per restocked lot, so a concurrent checkout's decrement is not overwritten).
+
+Sales in months already moved to the Parquet archive cannot be refunded:
+the archive keeps the status they had when archived.
+"""
+import uuid
+from datetime import date, datetime, timezone
+
+import history_archive
+
+LOT_UPDATE_ATTEMPTS = 5
+
+
+class RefundError(Exception):
+    """A refund the sale does not allow (already refunded, bad amount, unknown sale)"""
+
+
+def _is_missing_function(error):
+    return getattr(error, 'code', None) == 'PGRST202' or 'Could not find the function' in str(error)
+
+
+def _refuse_archived(supabase, sale_id, business_id):
+    watermark = history_archive.archived_through(business_id, 'sales')
+    if watermark is None:
+        return
+    response = supabase.table('sales') \
+        .select('created_at') \
+        .eq('id', sale_id) \
+        .eq('business_id', business_id) \
+        .limit(1) \
+        .execute()
+    if response.data and date.fromisoformat(response.data[0]['created_at'][:10]) < watermark:
+        raise RefundError(f'Sales before {watermark:%B %Y} are archived and can no longer be refunded')
+
+
+def plan_restock(refund_id, invoice_number, items, consumed, lots, user_id):
+    """
+    Restock effects of refunding every item of a sale
+
+    Args:
+        items: Sale items (product_id, quantity, cost_amount)
+        consumed: The sale's OUT movements (product_id, lot_id, quantity, unit_cost)
+        lots: Current lots by id (the ones in `consumed`)
+
+    Returns:
+        dict: 'lot_updates', 'new_lots' and 'movements' rows ready to write
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    reference = f'Refund: {invoice_number}'
+
+    sold = {}
+    for item in items:
+        entry = sold.setdefault(item['product_id'], {'quantity': 0, 'cost_amount': 0})
+        entry['quantity'] += int(item.get('quantity') or 0)
+        entry['cost_amount'] += float(item.get('cost_amount') or 0)
+
+    returned_to_lot = {}
+    costs = {}
+    for movement in consumed:
+        lot_id = movement.get('lot_id')
+        if movement['product_id'] in sold and lot_id in lots:
+            returned_to_lot[lot_id] = returned_to_lot.get(lot_id, 0) + int(movement['quantity'])
+            if movement.get('unit_cost') is not None:
+                costs[lot_id] = float(movement['unit_cost'])
+
+    lot_updates = []
+    movements = []
+    restocked = {}
+    for lot_id, quantity in returned_to_lot.items():
+        lot = lots[lot_id]
+        lot_updates.append({
+            'id': lot_id,
+            'product_id': lot['product_id'],
+            'quantity': int(lot['quantity']) + quantity,
+            'updated_at': now
+        })
+        movements.append({
+            'id': str(uuid.uuid4()),
+            'product_id': lot['product_id'],
+            'lot_id': lot_id,
+            'movement_type': 'IN',
+            'quantity': quantity,
+            'unit_cost': costs.get(lot_id, lot.get('cost_price')),
+            'reference': reference,
+            'created_by': user_id,
+            'created_at': now
+        })
+        restocked[lot['product_id']] = restocked.get(lot['product_id'], 0) + quantity
+
+    # Units no existing lot takes back go into a new lot per product
+    new_lots = []
+    for product_id, entry in sold.items():
+        shortfall = entry['quantity'] - restocked.get(product_id, 0)
+        if shortfall <= 0:
+            continue
+        lot_id = str(uuid.uuid4())
+        unit_cost = entry['cost_amount'] / entry['quantity'] if entry['quantity'] else None
+        new_lots.append({
+            'id': lot_id,
+            'product_id': product_id,
+            'lot_number': f'REFUND-{refund_id[:8]}',
+            'quantity': shortfall,
+            'cost_price': unit_cost,
+            'created_by': user_id,
+            'created_at': now,
+            'updated_at': now
+        })
+        movements.append({
+            'id': str(uuid.uuid4()),
+            'product_id': product_id,
+            'lot_id': lot_id,
+            'movement_type': 'IN',
+            'quantity': shortfall,
+            'unit_cost': unit_cost,
+            'reference': reference,
+            'created_by': user_id,
+            'created_at': now
+        })
+
+    return {'lot_updates': lot_updates, 'new_lots': new_lots, 'movements': movements}
+
+
+def _restock_lots(supabase, lot_updates, lots):
+    """
+    Add the planned units back to each lot
+
+    Each update only applies while the lot still holds the quantity it was
+    planned from; when a checkout changed it in between, the lot is re-read
+    and the units added to the new quantity.
+    """
+    for update in lot_updates:
+        expected = int(lots[update['id']]['quantity'])
+        returned = update['quantity'] - expected
+        for _ in range(LOT_UPDATE_ATTEMPTS):
+            response = supabase.table('product_lots') \
+                .update({'quantity': expected + returned, 'updated_at': update['updated_at']}) \
+                .eq('id', update['id']) \
+                .eq('quantity', expected) \
+                .execute()
+            if response.data:
+                break
+            current = supabase.table('product_lots') \
+                .select('quantity') \
+                .eq('id', update['id']) \
+                .limit(1) \
+                .execute()
+            if not current.data:
+                raise RefundError(f"Lot {update['id']} no longer exists")
+            expected = int(current.data[0]['quantity'])
+        else:
+            raise RefundError(f"Lot {update['id']} kept changing; could not restock it")
+
+
+def _refund_batched(supabase, sale_id, business_id, user_id, amount, reason, notes, restock):
+    """Same effects as the RPC, written as bulk requests (not atomic)"""
+    sale_response = supabase.table('sales') \
+        .select('*') \
+        .eq('id', sale_id) \
+        .eq('business_id', business_id) \
+        .limit(1) \
+        .execute()
+    if not sale_response.data:
+        raise RefundError('Sale not found')
+    sale = sale_response.data[0]
+    if sale.get('payment_status') == 'refunded':
+        raise RefundError('Sale has already been refunded')
+
+    refundable = float(sale['total_amount']) - float(sale.get('refund_amount') or 0)
+    amount = refundable if amount is None else float(amount)
+    if amount <= 0 or amount > refundable:
+        raise RefundError(f'Refund amount must be between 0 and {refundable:.2f}')
+    payment_status = 'refunded' if amount >= refundable else 'partially_refunded'
+
+    refund_id = str(uuid.uuid4())
+    supabase.table('refunds').insert({
+        'id': refund_id,
+        'business_id': business_id,
+        'sale_id': sale_id,
+        'refund_amount': amount,
+        'refund_reason': reason,
+        'refunded_by': user_id,
+        'payment_method': sale['payment_method'],
+        'status': 'completed',
+        'notes': notes
+    }).execute()
+
+    restocked_products = []
+    if restock:
+        items = supabase.table('sale_items') \
+            .select('product_id, quantity, unit_price, total_price, cost_amount') \
+            .eq('sale_id', sale_id) \
+            .execute().data or []
+        product_ids = list({item['product_id'] for item in items})
+
+        consumed, lots = [], {}
+        if product_ids:
+            consumed = supabase.table('inventory_movements') \
+                .select('product_id, lot_id, quantity, unit_cost') \
+                .eq('reference', f"Sale: {sale['invoice_number']}") \
+                .eq('movement_type', 'OUT') \
+                .gte('created_at', sale['created_at']) \
+                .in_('product_id', product_ids) \
+                .execute().data or []
+            lot_ids = list({movement['lot_id'] for movement in consumed if movement.get('lot_id')})
+            if lot_ids:
+                lots_response = supabase.table('product_lots') \
+                    .select('id, product_id, quantity, cost_price') \
+                    .in_('id', lot_ids) \
+                    .execute()
+                lots = {lot['id']: lot for lot in lots_response.data or []}
+
+        plan = plan_restock(refund_id, sale['invoice_number'], items, consumed, lots, user_id)
+        _restock_lots(supabase, plan['lot_updates'], lots)
+        if plan['new_lots']:
+            supabase.table('product_lots').insert(plan['new_lots'], returning='minimal').execute()
+        if plan['movements']:
+            supabase.table('inventory_movements').insert(plan['movements'], returning='minimal').execute()
+        if items:
+            supabase.table('refund_items').insert([
+                {
+                    'id': str(uuid.uuid4()),
+                    'refund_id': refund_id,
+                    'product_id': item['product_id'],
+                    'quantity': item['quantity'],
+                    'unit_price': item['unit_price'],
+                    'total_price': item['total_price'],
+                    'reason': reason
+                }
+                for item in items
+            ], returning='minimal').execute()
+        restocked_products = sorted({movement['product_id'] for movement in plan['movements']})
+
+    supabase.table('sales') \
+        .update({
+            'payment_status': payment_status,
+            'refund_id': refund_id,
+            'refund_amount': float(sale.get('refund_amount') or 0) + amount,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }) \
+        .eq('id', sale_id) \
+        .execute()
+
+    if user_id:
+        if restock:
+            description = f"Full refund processed for sale {sale['invoice_number']}"
+        else:
+            description = f"Partial refund of UGX {amount:.2f} for sale {sale['invoice_number']}"
+        supabase.table('audit_logs').insert({
+            'business_id': business_id,
+            'user_id': user_id,
+            'action': 'refund' if restock else 'partial_refund',
+            'description': description,
+            'details': {
+                'sale_id': sale_id,
+                'refund_id': refund_id,
+                'original_amount': sale['total_amount'],
+                'refund_amount': amount,
+                'reason': reason,
+                'restocked_products': restocked_products
+            }
+        }, returning='minimal').execute()
+
+    return {
+        'refund_id': refund_id,
+        'refund_amount': amount,
+        'payment_status': payment_status,
+        'invoice_number': sale['invoice_number'],
+        'restocked_products': restocked_products
+    }
+
+
+def process_refund(supabase, sale_id, business_id, user_id, amount=None, reason=None, notes=None, restock=True):
+    """
+    Refund a sale
+
+    Args:
+        amount: Amount to refund (None refunds whatever has not been refunded yet)
+        restock: Return every item of the sale to stock (full refunds)
+
+    Returns:
+        dict: refund_id, refund_amount, payment_status, invoice_number, restocked_products
+
+    Raises:
+        RefundError: The sale cannot be refunded as asked
+    """
+    _refuse_archived(supabase, sale_id, business_id)
+    try:
+        response = supabase.rpc('process_refund', {
+            'p_sale_id': sale_id,
+            'p_business_id': business_id,
+            'p_refunded_by': user_id,
+            'p_amount': amount,
+            'p_reason': reason,
+            'p_notes': notes,
+            'p_restock': restock
+        }).execute()
+        return response.data
+    except Exception as e:
+        if not _is_missing_function(e):
+            message = getattr(e, 'message', None) or str(e)
+            raise RefundError(message) from e
+        print("⚠️ process_refund RPC not installed, refunding with batched requests")
+
+    return _refund_batched(supabase, sale_id, business_id, user_id, amount, reason, notes, restock)
@@ -0,0 +1,386 @@
+# reorder_alerts.py
+"""
+Scheduled reorder-alert digests.
+
+Each run asks the database for the stock status of products whose stock or
+reorder level changed since the previous run (or every low-stock product on a
+full run), diffs that against the products already alerted on, and emails a
+single digest per business containing only the newly low items. Products that
+recover are dropped from the alert state so they alert again if they run low.
+When a digest cannot be sent, the run is left unfinished: the next run starts
+from the previous run's watermark and picks the same products up again.
+
+Run from the command line with ``python reorder_alerts.py [--full] [--loop]``
+or start the in-process scheduler with ``start_scheduler()``.
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timezone
+
+from supabase import create_client
+from config import Config
+from email_utils import generate_reorder_alert_email, send_bulk_email
+
+_supabase = None
+_scheduler_thread = None
+_run_lock = threading.Lock()
+
+CHUNK_SIZE = 200
+PAGE_SIZE = 1000
+
+
+def get_client():
+    """Get a shared Supabase client for background jobs"""
+    global _supabase
+    if _supabase is None:
+        _supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+    return _supabase
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _format_row(row):
+    """Normalise a stock status row into the shape the email template expects"""
+    return {
+        'id': row['product_id'],
+        'business_id': row['business_id'],
+        'name': row.get('name'),
+        'sku': row.get('sku') or 'N/A',
+        'current_stock': int(row.get('current_stock') or 0),
+        'reorder_level': int(row.get('reorder_level') or 0),
+        'selling_price': float(row.get('selling_price') or 0),
+        'image_url': row.get('image_url'),
+        'is_low': bool(row.get('is_low', True)),
+    }
+
+
+def fetch_stock_status(business_id=None, since=None):
+    """
+    Fetch stock status in bulk
+
+    Args:
+        business_id: Restrict to one business (None for all businesses)
+        since: Only products touched after this timestamp (None for every low-stock product)
+
+    Returns:
+        list: Rows with product details, current_stock, reorder_level and is_low.
+        The fallback cannot tell which products were touched, so it returns every
+        active product (low or not) whatever `since` is.
+    """
+    supabase = get_client()
+
+    try:
+        rows = []
+        after = None
+        while True:
+            params = {
+                'p_business_id': business_id,
+                'p_since': since.isoformat() if since else None,
+                'p_after': after,
+                'p_limit': PAGE_SIZE,
+            }
+            data = supabase.rpc('get_stock_status', params).execute().data or []
+            rows.extend(_format_row(row) for row in data)
+            if len(data) < PAGE_SIZE:
+                return rows
+            after = data[-1]['product_id']
+    except Exception as e:
+        print(f"⚠️ get_stock_status RPC unavailable, using bulk fallback: {str(e)}")
+
+    # Fallback: embedded query for products and their lots, paged by id
+    rows = []
+    offset = 0
+    while True:
+        query = supabase.table('products') \
+            .select('id, business_id, name, sku, selling_price, image_url, reorder_level, product_lots(quantity)') \
+            .eq('is_active', True)
+        if business_id:
+            query = query.eq('business_id', business_id)
+        data = query.order('id').range(offset, offset + PAGE_SIZE - 1).execute().data or []
+
+        for product in data:
+            current_stock = sum(lot['quantity'] for lot in product.get('product_lots') or [])
+            reorder_level = product.get('reorder_level') or 0
+            rows.append(_format_row({
+                'product_id': product['id'],
+                'business_id': product['business_id'],
+                'name': product.get('name'),
+                'sku': product.get('sku'),
+                'current_stock': current_stock,
+                'reorder_level': reorder_level,
+                'selling_price': product.get('selling_price'),
+                'image_url': product.get('image_url'),
+                'is_low': current_stock <= reorder_level,
+            }))
+
+        if len(data) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+def get_low_stock_products(business_id, limit=None):
+    """Get low stock products for a business, lowest stock first"""
+    try:
+        rows = [row for row in fetch_stock_status(business_id) if row['is_low']]
+        rows.sort(key=lambda x: x['current_stock'])
+        return rows[:limit] if limit else rows
+    except Exception as e:
+        print(f"Error getting low stock products: {e}")
+        return []
+
+
+def _get_last_run():
+    """Get the start time of the last completed run"""
+    try:
+        response = get_client().table('reorder_alert_runs') \
+            .select('started_at') \
+            .not_.is_('finished_at', 'null') \
+            .order('started_at', desc=True) \
+            .limit(1) \
+            .execute()
+        if response.data:
+            return datetime.fromisoformat(response.data[0]['started_at'].replace('Z', '+00:00'))
+    except Exception as e:
+        print(f"⚠️ Could not read last reorder alert run: {str(e)}")
+    return None
+
+
+def _load_alert_state(product_ids=None):
+    """Load already-alerted products, optionally only for the given ids"""
+    supabase = get_client()
+    state = {}
+
+    if product_ids is None:
+        offset = 0
+        while True:
+            response = supabase.table('reorder_alert_state') \
+                .select('business_id, product_id') \
+                .order('product_id') \
+                .range(offset, offset + PAGE_SIZE - 1) \
+                .execute()
+            data = response.data or []
+            for row in data:
+                state[row['product_id']] = row['business_id']
+            if len(data) < PAGE_SIZE:
+                return state
+            offset += PAGE_SIZE
+
+    for chunk in _chunks(product_ids):
+        response = supabase.table('reorder_alert_state') \
+            .select('business_id, product_id') \
+            .in_('product_id', chunk) \
+            .execute()
+        for row in response.data or []:
+            state[row['product_id']] = row['business_id']
+    return state
+
+
+def diff_stock_status(rows, alerted, full_scan):
+    """
+    Diff stock status against the alert state
+
+    Args:
+        rows: Stock status rows from fetch_stock_status
+        alerted: Dict of product_id -> business_id already alerted on
+        full_scan: True if rows cover every low-stock product (rows may also hold
+            products that are not low)
+
+    Returns:
+        tuple: (newly_low rows, recovered product ids)
+    """
+    newly_low = [row for row in rows if row['is_low'] and row['id'] not in alerted]
+
+    if full_scan:
+        low_ids = {row['id'] for row in rows if row['is_low']}
+        recovered = [pid for pid in alerted if pid not in low_ids]
+    else:
+        recovered = [row['id'] for row in rows if not row['is_low'] and row['id'] in alerted]
+
+    return newly_low, recovered
+
+
+def _get_recipients(business_ids):
+    """Get business info and alert recipients (admins and managers) per business"""
+    supabase = get_client()
+    businesses = {}
+    recipients = {bid: set() for bid in business_ids}
+
+    for chunk in _chunks(business_ids):
+        response = supabase.table('businesses') \
+            .select('id, business_name, business_email, business_phone, address, logo_url, user_id') \
+            .in_('id', chunk) \
+            .execute()
+        for business in response.data or []:
+            businesses[business['id']] = business
+            if business.get('business_email'):
+                recipients[business['id']].add(business['business_email'])
+
+        response = supabase.table('users') \
+            .select('email, business_id, role, is_admin') \
+            .in_('business_id', chunk) \
+            .eq('is_active', True) \
+            .execute()
+        for user in response.data or []:
+            if user.get('is_admin') or user.get('role') in ('admin', 'manager'):
+                recipients[user['business_id']].add(user['email'])
+
+    return businesses, recipients
+
+
+def send_digests(newly_low):
+    """
+    Render one digest per business and send it to that business's recipients
+
+    Returns:
+        tuple: (dict of business_id -> emails delivered for businesses that got at
+        least one, set of business ids whose digest could not be sent)
+    """
+    by_business = {}
+    for row in newly_low:
+        by_business.setdefault(row['business_id'], []).append(row)
+
+    if not by_business:
+        return {}, set()
+
+    businesses, recipients = _get_recipients(list(by_business.keys()))
+    sent = {}
+    failed = set()
+
+    for business_id, products in by_business.items():
+        business = businesses.get(business_id)
+        to_list = sorted(recipients.get(business_id) or [])
+        if not business or not to_list:
+            continue
+
+        products.sort(key=lambda x: x['current_stock'])
+        html, text = generate_reorder_alert_email(business, products, business.get('logo_url'))
+        subject = f"Reorder Alert: {len(products)} item(s) low on stock - {business.get('business_name')}"
+        delivered = send_bulk_email(to_list, subject, html, text)
+        if delivered:
+            sent[business_id] = delivered
+        else:
+            failed.add(business_id)
+            print(f"⚠️ Reorder digest for business {business_id} not delivered, will retry next run")
+
+    return sent, failed
+
+
+def _save_alert_state(newly_low, recovered):
+    supabase = get_client()
+    now = datetime.now(timezone.utc).isoformat()
+
+    if newly_low:
+        supabase.table('reorder_alert_state').upsert([{
+            'business_id': row['business_id'],
+            'product_id': row['id'],
+            'current_stock': row['current_stock'],
+            'alerted_at': now,
+        } for row in newly_low], on_conflict='product_id').execute()
+
+    for chunk in _chunks(recovered):
+        supabase.table('reorder_alert_state').delete().in_('product_id', chunk).execute()
+
+
+def run_reorder_alerts(full=False):
+    """
+    Run one reorder-alert pass
+
+    Args:
+        full: Rescan every low-stock product instead of only products touched since the last run
+
+    Returns:
+        dict: Summary of the run
+    """
+    if not _run_lock.acquire(blocking=False):
+        print("⚠️ Reorder alert run already in progress")
+        return {'skipped': True}
+
+    try:
+        supabase = get_client()
+        started_at = datetime.now(timezone.utc)
+        since = None if full else _get_last_run()
+        full_scan = since is None
+
+        run = supabase.table('reorder_alert_runs').insert({
+            'started_at': started_at.isoformat(),
+            'full_scan': full_scan,
+        }).execute()
+        run_id = run.data[0]['id'] if run.data else None
+
+        rows = fetch_stock_status(since=since)
+        alerted = _load_alert_state(None if full_scan else [row['id'] for row in rows])
+        newly_low, recovered = diff_stock_status(rows, alerted, full_scan)
+
+        # Only products whose digest went out count as alerted; the rest alert next run
+        sent, failed = send_digests(newly_low)
+        emails_sent = sum(sent.values())
+        alerted_rows = [row for row in newly_low if row['business_id'] in sent]
+        _save_alert_state(alerted_rows, recovered)
+
+        summary = {
+            'full_scan': full_scan,
+            'checked': len(rows),
+            'newly_low': len(newly_low),
+            'recovered': len(recovered),
+            'emails_sent': emails_sent,
+            'undelivered': len(failed),
+        }
+
+        if run_id:
+            update = {
+                'products_checked': len(rows),
+                'products_alerted': len(alerted_rows),
+                'products_recovered': len(recovered),
+                'emails_sent': emails_sent,
+            }
+            # An unfinished run does not move the watermark, so undelivered products are fetched again
+            if not failed:
+                update['finished_at'] = datetime.now(timezone.utc).isoformat()
+            supabase.table('reorder_alert_runs').update(update).eq('id', run_id).execute()
+
+        print(f"✅ Reorder alerts: {summary}")
+        return summary
+
+    except Exception as e:
+        print(f"❌ Reorder alert run failed: {str(e)}")
+        return {'error': str(e)}
+    finally:
+        _run_lock.release()
+
+
+def _scheduler_loop(interval_minutes, full_first=False):
+    full = full_first
+    while True:
+        run_reorder_alerts(full=full)
+        full = False
+        time.sleep(interval_minutes * 60)
+
+
+def start_scheduler(interval_minutes=None):
+    """Start the reorder-alert scheduler in a daemon thread (once per process)"""
+    global _scheduler_thread
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return _scheduler_thread
+
+    interval = interval_minutes or Config.REORDER_ALERT_INTERVAL_MINUTES
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, args=(interval,), daemon=True)
+    _scheduler_thread.start()
+    print(f"🔄 Reorder alert scheduler started (every {interval} min)")
+    return _scheduler_thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send reorder-alert digests for low stock products')
+    parser.add_argument('--full', action='store_true', help='Rescan every product instead of changes since the last run')
+    parser.add_argument('--loop', action='store_true', help='Keep running on the configured interval')
+    args = parser.parse_args()
+
+    if args.loop:
+        _scheduler_loop(Config.REORDER_ALERT_INTERVAL_MINUTES, full_first=args.full)
+    else:
+        run_reorder_alerts(full=args.full)
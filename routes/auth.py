@@ -1,21 +1,21 @@
 # routes/auth.py
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 import pyotp
 from datetime import datetime, timezone, timedelta  # Added timezone
 import cloudinary
 import cloudinary.uploader
 from supabase import create_client, Client
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import threading
 import time
 import json
 import os
 from dateutil import parser  # Added for parsing ISO datetime
 from functools import wraps
+from mail_service import build_message, get_mailer
+import login_pipeline
+import passwords
+import authz
+import rate_limiter
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -53,14 +53,26 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def require_principal():
+    """Cached principal of the logged-in user, or a redirect to the login page"""
+    principal = authz.current()
+    if principal is None:
+        flash('Please login to access this page', 'warning')
+        return None, redirect(url_for('auth.login'))
+    if not principal.is_active:
+        session.clear()
+        flash('Your account has been deactivated', 'error')
+        return None, redirect(url_for('auth.login'))
+    return principal, None
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Please login to access this page', 'warning')
-            return redirect(url_for('auth.login'))
+        principal, denied = require_principal()
+        if denied:
+            return denied
         
-        if not session.get('is_admin') and session.get('user_role') != 'admin':
+        if not principal.is_admin:
             flash('Administrator access required', 'error')
             return redirect(url_for('dashboard'))
         
@@ -78,45 +90,48 @@ def role_required(required_roles):
         @role_required('admin')  # Requires admin role
         @role_required(['admin', 'manager'])  # Requires either admin or manager
     """
+    # Normalize required_roles to a list (once, when the route is decorated)
+    if isinstance(required_roles, str):
+        roles_list = [required_roles]
+    elif isinstance(required_roles, (list, tuple, set, frozenset)):
+        roles_list = list(required_roles)
+    else:
+        roles_list = None
+    
+    if roles_list:
+        # Create friendly error message
+        if len(roles_list) == 1:
+            role_display = roles_list[0].capitalize()
+            error_msg = f'{role_display} access required'
+        else:
+            # Format: "Admin, Manager, or Cashier access required"
+            formatted_roles = [r.capitalize() for r in roles_list[:-1]]
+            if len(formatted_roles) > 1:
+                formatted_roles = ', '.join(formatted_roles)
+            else:
+                formatted_roles = formatted_roles[0] if formatted_roles else ''
+            
+            last_role = roles_list[-1].capitalize()
+            if formatted_roles:
+                error_msg = f'{formatted_roles} or {last_role} access required'
+            else:
+                error_msg = f'{last_role} access required'
+    allowed_roles = frozenset(roles_list or ())
+    
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Check if user is logged in
-            if 'user_id' not in session:
-                flash('Please login to access this page', 'warning')
-                return redirect(url_for('auth.login'))
-            
-            user_role = session.get('user_role', 'employee')
+            # Check if user is logged in (and still active)
+            principal, denied = require_principal()
+            if denied:
+                return denied
             
-            # Normalize required_roles to a list
-            if isinstance(required_roles, str):
-                roles_list = [required_roles]
-            elif isinstance(required_roles, list):
-                roles_list = required_roles
-            else:
+            if roles_list is None:
                 flash('Invalid role configuration', 'error')
                 return redirect(url_for('dashboard'))
             
             # Check if user has required role
-            if user_role not in roles_list:
-                # Create friendly error message
-                if len(roles_list) == 1:
-                    role_display = roles_list[0].capitalize()
-                    error_msg = f'{role_display} access required'
-                else:
-                    # Format: "Admin, Manager, or Cashier access required"
-                    formatted_roles = [r.capitalize() for r in roles_list[:-1]]
-                    if len(formatted_roles) > 1:
-                        formatted_roles = ', '.join(formatted_roles)
-                    else:
-                        formatted_roles = formatted_roles[0] if formatted_roles else ''
-                    
-                    last_role = roles_list[-1].capitalize()
-                    if formatted_roles:
-                        error_msg = f'{formatted_roles} or {last_role} access required'
-                    else:
-                        error_msg = f'{last_role} access required'
-                
+            if not principal.has_role(allowed_roles):
                 flash(error_msg, 'error')
                 return redirect(url_for('dashboard'))
             
@@ -184,50 +199,24 @@ def parse_iso_datetime(iso_string):
         return datetime.fromisoformat(iso_string.replace('Z', '+00:00'))
 
 def send_email_async(to_email, subject, html_content, text_content=None):
-    """Send email in background thread for performance"""
-    def send():
-        try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = f"ThriveOS - {subject}"
-            
-            # Get email credentials
-            mail_username = get_config_value('MAIL_USERNAME')
-            mail_password = get_config_value('MAIL_PASSWORD')
-            
-            # Remove spaces from password if present
-            if mail_password:
-                mail_password = mail_password.replace(' ', '')
-            
-            msg['From'] = mail_username
-            msg['To'] = to_email
-            
-            if text_content:
-                msg.attach(MIMEText(text_content, 'plain'))
-            msg.attach(MIMEText(html_content, 'html'))
-            
-            mail_server = get_config_value('MAIL_SERVER', 'smtp.gmail.com')
-            mail_port = get_config_value('MAIL_PORT', 587)
-            
-            print(f"📧 Attempting to send email to {to_email}")
-            print(f"   Using server: {mail_server}:{mail_port}")
-            
-            with smtplib.SMTP(mail_server, mail_port) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                server.login(mail_username, mail_password)
-                server.send_message(msg)
-            
-            print(f"✅ Email sent to {to_email}")
-            
-        except Exception as e:
-            print(f"❌ Email sending failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-    
-    thread = threading.Thread(target=send)
-    thread.daemon = True
-    thread.start()
+    """Queue email on the pooled SMTP sender for background delivery"""
+    try:
+        mail_username = get_config_value('MAIL_USERNAME')
+        mail_password = get_config_value('MAIL_PASSWORD')
+        mail_server = get_config_value('MAIL_SERVER', 'smtp.gmail.com')
+        mail_port = get_config_value('MAIL_PORT', 587)
+
+        msg = build_message(to_email, f"ThriveOS - {subject}", html_content, text_content, mail_username)
+
+        mailer = get_mailer(mail_server, mail_port, mail_username, mail_password, use_tls=True)
+        mailer.enqueue(msg)
+
+        print(f"📧 Email to {to_email} queued via {mail_server}:{mail_port}")
+
+    except Exception as e:
+        print(f"❌ Email queueing failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
 
 def generate_otp_email_html(otp_code, user_name=None):
     """Generate beautiful OTP email template"""
@@ -280,53 +269,59 @@ def login():
             flash('Please fill in all fields', 'error')
             return render_template('auth/login.html')
         
+        # Too many failed attempts for this email or IP: refuse without touching the database
+        retry_after = rate_limiter.login_blocked(request.remote_addr, email)
+        if retry_after:
+            flash(f'Too many failed login attempts. Please try again in {rate_limiter.describe_wait(retry_after)}.', 'error')
+            return render_template('auth/login.html'), 429, {'Retry-After': str(retry_after)}
+        
         try:
             supabase = get_supabase()
             
             # Include business_id in the select
             response = supabase.table('users').select(
-                'id,email,password_hash,email_verified,first_name,last_login,login_count,role,is_admin,business_id'
+                'id,email,password_hash,email_verified,first_name,last_login,login_count,role,role_id,is_admin,is_active,business_id'
             ).eq('email', email).limit(1).execute()
             
             if response.data:
                 user = response.data[0]
                 
-                # Verify password
-                if check_password_hash(user['password_hash'], password):
+                # Verify password (new_hash is set when the hash predates the current settings)
+                valid, new_hash = passwords.verify_password(user['password_hash'], password)
+                if valid and user.get('is_active') is False:
+                    flash('Your account has been deactivated. Please contact your administrator.', 'error')
+                    return render_template('auth/login.html')
+                if valid:
+                    rate_limiter.login_succeeded(email)
                     if user['email_verified']:
-                        # Update login stats
-                        supabase.table('users').update({
-                            'last_login': get_utc_now().isoformat(),
-                            'login_count': (user.get('login_count') or 0) + 1
-                        }).eq('id', user['id']).execute()
-                        
                         # Set session with all required information
                         session['user_id'] = user['id']
                         session['user_email'] = user['email']
                         session['user_name'] = f"{user.get('first_name', '')}"
                         session['user_role'] = user.get('role', 'user')
                         session['is_admin'] = user.get('is_admin', False)
-                        session['business_id'] = user.get('business_id')  # THIS IS CRITICAL
-                        
-                        # If business_id is not in users table, try to get it from businesses table
-                        if not session['business_id']:
-                            # Try to find user's business
-                            business_response = supabase.table('business_users').select(
-                                'business_id'
-                            ).eq('user_id', user['id']).limit(1).execute()
-                            
-                            if business_response.data:
-                                session['business_id'] = business_response.data[0]['business_id']
+                        # Permissions are resolved here once, then checked from memory by the decorators
+                        principal = authz.prime(user, supabase)
+                        if principal:
+                            session['user_role'] = principal.role
+                            session['is_admin'] = principal.is_admin
+                        # From the users row, else the cached business_users membership
+                        session['business_id'] = login_pipeline.resolve_business(supabase, user)  # THIS IS CRITICAL
                         
-                        # Log login
-                        supabase.table('auth_logs').insert({
+                        # Login stats and the auth log are written in the background, batched
+                        now = get_utc_now().isoformat()
+                        writer = login_pipeline.get_writer()
+                        writer.login(supabase, user['id'], user.get('login_count'), now)
+                        if new_hash:
+                            writer.rehash(supabase, user['id'], user['password_hash'], new_hash)
+                        writer.log(supabase, {
                             'user_id': user['id'],
                             'ip_address': request.remote_addr,
                             'user_agent': request.user_agent.string,
                             'action': 'login',
                             'status': 'success',
-                            'created_at': get_utc_now().isoformat()
-                        }).execute()
+                            'created_at': now
+                        })
                         
                         processing_time = round((time.time() - start_time) * 1000, 2)
                         print(f"✅ Login successful for {email} in {processing_time}ms")
@@ -355,18 +350,20 @@ def login():
                         flash('Please verify your email first. A new verification code has been sent.', 'warning')
                         return redirect(url_for('auth.verify_email'))
                 else:
+                    rate_limiter.login_failed(request.remote_addr, email)
                     # Log failed attempt
-                    supabase.table('auth_logs').insert({
+                    login_pipeline.get_writer().log(supabase, {
                         'ip_address': request.remote_addr,
                         'user_agent': request.user_agent.string,
                         'action': 'login',
                         'status': 'failed',
                         'details': json.dumps({'email': email}),
                         'created_at': get_utc_now().isoformat()
-                    }).execute()
+                    })
                     
                     flash('Invalid credentials. Please try again.', 'error')
             else:
+                rate_limiter.login_failed(request.remote_addr, email)
                 flash('Invalid credentials. Please try again.', 'error')
                 
         except Exception as e:
@@ -414,7 +411,7 @@ def register():
                 return redirect(url_for('auth.login'))
             
             # Hash password
-            password_hash = generate_password_hash(password)
+            password_hash = passwords.hash_password(password)
             
             # Generate OTP
             otp_secret = pyotp.random_base32()
@@ -889,7 +886,7 @@ def reset_password(token):
                 return render_template('auth/reset_password.html', token=token)
             
             # Update password and clear reset token
-            password_hash = generate_password_hash(password)
+            password_hash = passwords.hash_password(password)
             
             print(f"📝 Updating password for user {user['id']}...")
             
@@ -938,14 +935,14 @@ def logout():
     if 'user_id' in session:
         try:
             supabase = get_supabase()
-            supabase.table('auth_logs').insert({
+            login_pipeline.get_writer().log(supabase, {
                 'user_id': session['user_id'],
                 'ip_address': request.remote_addr,
                 'user_agent': request.user_agent.string,
                 'action': 'logout',
                 'status': 'success',
                 'created_at': get_utc_now().isoformat()
-            }).execute()
+            })
         except Exception as e:
             print(f"❌ Logout logging error: {str(e)}")
     
@@ -1,9 +1,10 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from routes.auth import login_required
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import uuid
 from supabase import create_client
 from config import Config
+import analytics
 
 # Create Supabase client
 supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
@@ -209,50 +210,47 @@ def customers_stats():
             'top_customers': []
         }
         
-        customers_map = {}
-        total_transactions = 0
-        
-        for sale in response.data:
-            # Skip if no customer info
-            if not sale.get('customer_name') and not sale.get('customer_phone') and not sale.get('customer_email'):
-                continue
-            
-            customer_key = sale.get('customer_phone') or sale.get('customer_email') or sale.get('customer_name')
-            
-            if customer_key not in customers_map:
-                customers_map[customer_key] = {
-                    'name': sale.get('customer_name', ''),
-                    'phone': sale.get('customer_phone', ''),
-                    'email': sale.get('customer_email', ''),
-                    'total_spent': 0,
-                    'transactions': 0
-                }
-                stats['total_customers'] += 1
-            
-            customers_map[customer_key]['total_spent'] += float(sale.get('total_amount', 0))
-            customers_map[customer_key]['transactions'] += 1
-            stats['total_revenue'] += float(sale.get('total_amount', 0))
-            total_transactions += 1
+        # Sales without any customer info are skipped
+        frame = analytics.Frame.from_rows(
+            response.data,
+            customer=(('customer_phone', 'customer_email', 'customer_name'), 'string'),
+            total_amount=('total_amount', 'float'),
+            created_at=('created_at', 'timestamp')
+        ).filter('customer')
         
-        # Calculate average transaction value
-        if total_transactions > 0:
-            stats['average_transaction'] = stats['total_revenue'] / total_transactions
-        
-        # Get top 5 customers by total spent
-        top_customers = sorted(customers_map.values(), key=lambda x: x['total_spent'], reverse=True)[:5]
-        stats['top_customers'] = top_customers
+        customer_totals = frame.group_totals('customer', 'total_amount')
+        stats['total_customers'] = len(customer_totals)
+        stats['total_revenue'] = frame.sum('total_amount')
+        stats['average_transaction'] = frame.mean('total_amount')
         
         # Count active customers (made purchase in last 30 days)
-        thirty_days_ago = datetime.now().timestamp() - (30 * 24 * 60 * 60)
+        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+        recent = frame.filter('created_at', thirty_days_ago)
+        active_keys = set(recent.group_sums('customer', 'total_amount'))
+        stats['active_customers'] = len(active_keys)
+        
+        # Get top 5 customers by total spent (details from each customer's first sale)
+        top_keys = [key for key, _ in frame.top('customer', 'total_amount', 5)]
+        details = {}
         for sale in response.data:
-            if sale.get('created_at'):
-                sale_time = datetime.fromisoformat(sale['created_at'].replace('Z', '+00:00')).timestamp()
-                if sale_time > thirty_days_ago:
-                    customer_key = sale.get('customer_phone') or sale.get('customer_email') or sale.get('customer_name')
-                    if customer_key and customer_key in customers_map:
-                        if 'active' not in customers_map[customer_key]:
-                            customers_map[customer_key]['active'] = True
-                            stats['active_customers'] += 1
+            customer_key = sale.get('customer_phone') or sale.get('customer_email') or sale.get('customer_name')
+            if customer_key in top_keys and customer_key not in details:
+                details[customer_key] = sale
+                if len(details) == len(top_keys):
+                    break
+        
+        for customer_key in top_keys:
+            sale = details[customer_key]
+            customer = {
+                'name': sale.get('customer_name', ''),
+                'phone': sale.get('customer_phone', ''),
+                'email': sale.get('customer_email', ''),
+                'total_spent': customer_totals[customer_key]['amount'],
+                'transactions': customer_totals[customer_key]['count']
+            }
+            if customer_key in active_keys:
+                customer['active'] = True
+            stats['top_customers'].append(customer)
         
         return jsonify(stats)
     
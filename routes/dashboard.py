@@ -1,7 +1,11 @@
-from flask import Blueprint, render_template, jsonify, session
+from flask import Blueprint, render_template, jsonify, session, request
 from routes.auth import login_required, get_supabase, get_utc_now
 from datetime import datetime, date, timedelta
 import json
+import reorder_alerts
+import analytics
+import profit
+import trend_cube
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -52,12 +56,20 @@ def get_today_sales(business_id):
         
         sales = response.data if response.data else []
         
-        total_sales = len(sales)
-        total_revenue = sum(float(sale.get('total_amount', 0)) for sale in sales)
-        total_tax = sum(float(sale.get('tax_amount', 0)) for sale in sales)
-        total_discount = sum(float(sale.get('discount_amount', 0)) for sale in sales)
-        completed_sales = len([s for s in sales if s.get('payment_status') == 'completed'])
-        pending_sales = len([s for s in sales if s.get('payment_status') == 'pending'])
+        frame = analytics.Frame.from_rows(
+            sales,
+            total_amount=('total_amount', 'float'),
+            tax_amount=('tax_amount', 'float'),
+            discount_amount=('discount_amount', 'float'),
+            payment_status=('payment_status', 'string')
+        )
+        
+        total_sales = len(frame)
+        total_revenue = frame.sum('total_amount')
+        total_tax = frame.sum('tax_amount')
+        total_discount = frame.sum('discount_amount')
+        completed_sales = frame.count_where('payment_status', 'completed')
+        pending_sales = frame.count_where('payment_status', 'pending')
         
         return {
             'total_sales': total_sales,
@@ -88,20 +100,19 @@ def get_today_expenses(business_id):
         
         expenses = response.data if response.data else []
         
-        total_expenses = len(expenses)
-        total_amount = sum(float(expense.get('amount', 0)) for expense in expenses)
-        approved_expenses = len([e for e in expenses if e.get('status') == 'approved'])
+        frame = analytics.Frame.from_rows(
+            expenses,
+            amount=('amount', 'float'),
+            category=('category', 'string', 'Uncategorized'),
+            status=('status', 'string')
+        )
         
-        # Top categories
-        categories = {}
-        for expense in expenses:
-            category = expense.get('category', 'Uncategorized')
-            amount = float(expense.get('amount', 0))
-            if category not in categories:
-                categories[category] = 0
-            categories[category] += amount
+        total_expenses = len(frame)
+        total_amount = frame.sum('amount')
+        approved_expenses = frame.count_where('status', 'approved')
         
-        top_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:3]
+        # Top categories
+        top_categories = frame.top('category', 'amount', 3)
         
         return {
             'total_expenses': total_expenses,
@@ -115,48 +126,8 @@ def get_today_expenses(business_id):
         return None
 
 def get_low_stock_products(business_id):
-    """Get low stock products using product_lots table"""
-    try:
-        supabase = get_supabase()
-        
-        # Get all products with product_lots
-        response = supabase.table('products').select(
-            'id, name, sku, selling_price, image_url, reorder_level'
-        ).eq('business_id', business_id)\
-         .eq('is_active', True)\
-         .execute()
-        
-        products = response.data if response.data else []
-        
-        low_stock_products = []
-        for product in products:
-            # Get stock from product_lots
-            lots_response = supabase.table('product_lots').select(
-                'quantity'
-            ).eq('product_id', product['id']).execute()
-            
-            current_stock = 0
-            if lots_response.data:
-                current_stock = sum(lot['quantity'] for lot in lots_response.data)
-            
-            reorder_level = product.get('reorder_level', 0)
-            
-            if current_stock <= reorder_level:
-                low_stock_products.append({
-                    'id': product['id'],
-                    'name': product['name'],
-                    'sku': product.get('sku', 'N/A'),
-                    'current_stock': current_stock,
-                    'reorder_level': reorder_level,
-                    'selling_price': float(product.get('selling_price', 0)),
-                    'image_url': product.get('image_url')
-                })
-        
-        return sorted(low_stock_products, key=lambda x: x['current_stock'])[:5]
-        
-    except Exception as e:
-        print(f"Error getting low stock products: {e}")
-        return []
+    """Get the five lowest-stock products from one bulk stock query"""
+    return reorder_alerts.get_low_stock_products(business_id, limit=5)
 
 def get_recent_activity(business_id):
     """Get recent system activity"""
@@ -247,6 +218,15 @@ def get_weekly_sales_trend(business_id):
         today = date.today()
         week_ago = today - timedelta(days=6)  # Last 7 days including today
         
+        # Pre-aggregated daily totals from the trend cube
+        cube = trend_cube.get_series(supabase, business_id, 'sales', 'day', week_ago, today)
+        if cube is not None:
+            totals = cube['series'].get('all', {}).get('amount', [0] * len(cube['periods']))
+            return {
+                'labels': trend_cube.series_labels(cube['periods'], 'day'),
+                'data': totals
+            }
+        
         response = supabase.table('sales').select(
             'created_at, total_amount'
         ).eq('business_id', business_id)\
@@ -256,38 +236,19 @@ def get_weekly_sales_trend(business_id):
         
         sales = response.data if response.data else []
         
-        # Initialize daily totals
-        daily_totals = {}
-        current_date = week_ago
-        while current_date <= today:
-            daily_totals[current_date.isoformat()] = 0
-            current_date += timedelta(days=1)
+        frame = analytics.Frame.from_rows(
+            sales,
+            total_amount=('total_amount', 'float'),
+            day=('created_at', 'day')
+        )
         
-        # Sum sales by day
-        for sale in sales:
-            try:
-                sale_date = datetime.fromisoformat(sale['created_at'].replace('Z', '+00:00')).date()
-                amount = float(sale.get('total_amount', 0))
-                date_key = sale_date.isoformat()
-                if date_key in daily_totals:
-                    daily_totals[date_key] += amount
-            except:
-                continue
+        # Daily totals for every day of the week, zero-filled
+        daily = frame.daily('day', 'total_amount', week_ago, today)
         
         # Format for chart
-        labels = []
-        data = []
-        
-        current_date = week_ago
-        while current_date <= today:
-            day_name = current_date.strftime('%a')
-            labels.append(day_name)
-            data.append(daily_totals[current_date.isoformat()])
-            current_date += timedelta(days=1)
-        
         return {
-            'labels': labels,
-            'data': data
+            'labels': [date.fromisoformat(entry['date']).strftime('%a') for entry in daily],
+            'data': [entry['amount'] for entry in daily]
         }
         
     except Exception as e:
@@ -299,67 +260,83 @@ def get_category_sales_distribution(business_id):
     try:
         supabase = get_supabase()
         
-        # Get sales with product details using sale_items table
-        sales_response = supabase.table('sales').select(
-            'id, created_at'
-        ).eq('business_id', business_id)\
-         .gte('created_at', (date.today() - timedelta(days=30)).isoformat())\
-         .limit(50)\
-         .execute()
-        
-        sales = sales_response.data if sales_response.data else []
-        
-        # Get sale items for each sale
-        category_totals = {}
-        for sale in sales:
-            # Get sale items - adjust based on your actual sale_items table structure
-            try:
-                # Try to get sale items from your actual table structure
-                # Adjust this based on your actual sale_items table
-                items_response = supabase.rpc('get_sale_items', {'sale_id': sale['id']}).execute()
-            except:
-                # If RPC doesn't exist, try direct table query
+        # Category totals for the last 30 days from the trend cube
+        today = date.today()
+        category_totals = None
+        cube_totals = trend_cube.get_totals(supabase, business_id, 'sales', 'category', today - timedelta(days=30), today)
+        if cube_totals is not None:
+            category_ids = [member for member, _ in cube_totals if member]
+            names = {}
+            if category_ids:
+                categories_response = supabase.table('categories').select('id, name').in_('id', category_ids).execute()
+                names = {row['id']: row['name'] for row in categories_response.data or []}
+            category_totals = {}
+            for member, amount in cube_totals:
+                category_name = names.get(member, 'Uncategorized')
+                category_totals[category_name] = category_totals.get(category_name, 0) + amount
+        
+        if category_totals is None:
+            # Get sales with product details using sale_items table
+            sales_response = supabase.table('sales').select(
+                'id, created_at'
+            ).eq('business_id', business_id)\
+             .gte('created_at', (date.today() - timedelta(days=30)).isoformat())\
+             .limit(50)\
+             .execute()
+        
+            sales = sales_response.data if sales_response.data else []
+        
+            # Get sale items for each sale
+            category_totals = {}
+            for sale in sales:
+                # Get sale items - adjust based on your actual sale_items table structure
                 try:
-                    items_response = supabase.table('sale_items').select(
-                        'product_id, quantity, unit_price'
-                    ).eq('sale_id', sale['id']).execute()
-                except Exception as items_error:
-                    print(f"Error getting sale items: {items_error}")
-                    continue
+                    # Try to get sale items from your actual table structure
+                    # Adjust this based on your actual sale_items table
+                    items_response = supabase.rpc('get_sale_items', {'sale_id': sale['id']}).execute()
+                except:
+                    # If RPC doesn't exist, try direct table query
+                    try:
+                        items_response = supabase.table('sale_items').select(
+                            'product_id, quantity, unit_price'
+                        ).eq('sale_id', sale['id']).execute()
+                    except Exception as items_error:
+                        print(f"Error getting sale items: {items_error}")
+                        continue
             
-            items = items_response.data if hasattr(items_response, 'data') and items_response.data else []
+                items = items_response.data if hasattr(items_response, 'data') and items_response.data else []
             
-            for item in items:
-                # Get product category
-                product_response = supabase.table('products').select(
-                    'category_id'
-                ).eq('id', item.get('product_id')).limit(1).execute()
+                for item in items:
+                    # Get product category
+                    product_response = supabase.table('products').select(
+                        'category_id'
+                    ).eq('id', item.get('product_id')).limit(1).execute()
                 
-                if product_response.data:
-                    category_id = product_response.data[0].get('category_id')
-                    if category_id:
-                        # Get category name
-                        category_response = supabase.table('categories').select(
-                            'name'
-                        ).eq('id', category_id).limit(1).execute()
+                    if product_response.data:
+                        category_id = product_response.data[0].get('category_id')
+                        if category_id:
+                            # Get category name
+                            category_response = supabase.table('categories').select(
+                                'name'
+                            ).eq('id', category_id).limit(1).execute()
                         
-                        if category_response.data:
-                            category_name = category_response.data[0].get('name', 'Uncategorized')
+                            if category_response.data:
+                                category_name = category_response.data[0].get('name', 'Uncategorized')
+                            else:
+                                category_name = 'Uncategorized'
                         else:
                             category_name = 'Uncategorized'
                     else:
                         category_name = 'Uncategorized'
-                else:
-                    category_name = 'Uncategorized'
                 
-                # Calculate amount based on available fields
-                quantity = item.get('quantity', 1)
-                price = item.get('unit_price') or item.get('price') or item.get('selling_price', 0)
-                amount = float(price) * int(quantity)
+                    # Calculate amount based on available fields
+                    quantity = item.get('quantity', 1)
+                    price = item.get('unit_price') or item.get('price') or item.get('selling_price', 0)
+                    amount = float(price) * int(quantity)
                 
-                if category_name not in category_totals:
-                    category_totals[category_name] = 0
-                category_totals[category_name] += amount
+                    if category_name not in category_totals:
+                        category_totals[category_name] = 0
+                    category_totals[category_name] += amount
         
         # If we don't have enough data, use mock data
         if not category_totals:
@@ -403,7 +380,7 @@ def get_profit_summary(business_id):
          .execute()
         
         sales = sales_response.data if sales_response.data else []
-        total_revenue = sum(float(sale.get('total_amount', 0)) for sale in sales)
+        total_revenue = analytics.Frame.from_rows(sales, total_amount=('total_amount', 'float')).sum('total_amount')
         
         # Get today's expenses
         expenses_response = supabase.table('expenses').select(
@@ -414,19 +391,25 @@ def get_profit_summary(business_id):
          .execute()
         
         expenses = expenses_response.data if expenses_response.data else []
-        total_expenses = sum(float(expense.get('amount', 0)) for expense in expenses)
+        total_expenses = analytics.Frame.from_rows(expenses, amount=('amount', 'float')).sum('amount')
+        
+        # Cost of goods sold today from the daily rollup
+        cogs_summary = profit.get_cogs_summary(supabase, business_id, today, today)
+        cost_of_goods_sold = cogs_summary['cogs']
         
-        # Calculate profit (simple calculation for now)
-        # In a real system, you'd also subtract cost of goods sold
-        profit = total_revenue - total_expenses
-        profit_margin = (profit / total_revenue * 100) if total_revenue > 0 else 0
+        # Calculate profit against the rollup's net sales (paid, pre-tax), the base COGS is measured on
+        gross_profit = cogs_summary['gross_profit']
+        net_profit = gross_profit - total_expenses
+        profit_margin = (net_profit / cogs_summary['revenue'] * 100) if cogs_summary['revenue'] > 0 else 0
         
         return {
             'revenue': total_revenue,
+            'cost_of_goods_sold': cost_of_goods_sold,
+            'gross_profit': gross_profit,
             'expenses': total_expenses,
-            'profit': profit,
+            'profit': net_profit,
             'profit_margin': profit_margin,
-            'is_profitable': profit >= 0
+            'is_profitable': net_profit >= 0
         }
         
     except Exception as e:
@@ -548,6 +531,48 @@ def dashboard_charts():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@dashboard_bp.route('/api/dashboard/trends')
+@login_required
+def dashboard_trends():
+    """
+    API endpoint for pre-aggregated trend series
+    
+    Query: fact (sales|expenses), grain (day|week|month), dimension
+    (all|payment_method|status|cashier|category) and periods (how many, ending today)
+    """
+    try:
+        business_id = get_user_business_id()
+        if not business_id:
+            return jsonify({'error': 'No business found'}), 400
+        
+        fact = request.args.get('fact', 'sales')
+        grain = request.args.get('grain', 'day')
+        dimension = request.args.get('dimension', 'all')
+        period_count = min(max(request.args.get('periods', 7, type=int), 1), 366)
+        
+        if fact not in trend_cube.DIMENSIONS or grain not in trend_cube.GRAINS \
+                or dimension not in trend_cube.DIMENSIONS[fact]:
+            return jsonify({'error': 'Invalid fact, grain or dimension'}), 400
+        
+        # Walk back from today to the start of the earliest requested period
+        today = date.today()
+        start = trend_cube.period_start(today, grain)
+        for _ in range(period_count - 1):
+            start = trend_cube.period_start(start - timedelta(days=1), grain)
+        
+        cube = trend_cube.get_series(get_supabase(), business_id, fact, grain, start, today, dimension)
+        if cube is None:
+            return jsonify({'error': 'Trend data unavailable'}), 503
+        
+        return jsonify({
+            'success': True,
+            'labels': trend_cube.series_labels(cube['periods'], grain),
+            **cube
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @dashboard_bp.route('/api/dashboard/low-stock')
 @login_required
 def dashboard_low_stock():
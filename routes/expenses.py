@@ -4,6 +4,8 @@ from datetime import datetime, date
 import uuid
 from supabase import create_client
 from config import Config
+import analytics
+import trend_cube
 
 # Create Supabase client
 supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
@@ -248,6 +250,7 @@ def add_expense():
             response = supabase.table('expenses').insert(expense_data).execute()
             
             if response.data:
+                trend_cube.invalidate(business_id)
                 flash('Expense added successfully!', 'success')
                 return redirect(url_for('expenses.expenses_list'))
             else:
@@ -314,6 +317,7 @@ def edit_expense(expense_id):
                     .execute()
                 
                 if update_response.data:
+                    trend_cube.invalidate(business_id)
                     flash('Expense updated successfully!', 'success')
                     return redirect(url_for('expenses.expenses_list'))
                 else:
@@ -358,6 +362,7 @@ def delete_expense(expense_id):
             .execute()
         
         if response.data:
+            trend_cube.invalidate(business_id)
             flash('Expense deleted successfully!', 'success')
         else:
             flash('Failed to delete expense', 'danger')
@@ -394,46 +399,26 @@ def expenses_stats():
         response = query.execute()
         expenses = response.data
         
+        frame = analytics.Frame.from_rows(
+            expenses,
+            amount=('amount', 'float'),
+            category=('category', 'string', 'Uncategorized'),
+            payment_method=('payment_method', 'string', 'Cash'),
+            status=('status', 'string', 'approved')
+        )
+        
         # Calculate statistics
         stats = {
-            'total_expenses': len(expenses),
-            'total_amount': 0,
-            'average_expense': 0,
-            'by_category': {},
-            'by_payment_method': {},
-            'by_status': {},
+            'total_expenses': len(frame),
+            'total_amount': frame.sum('amount'),
+            'average_expense': frame.mean('amount'),
+            'by_category': frame.group_sums('category', 'amount'),
+            'by_payment_method': frame.group_sums('payment_method', 'amount'),
+            'by_status': frame.group_sums('status', 'amount'),
+            'distribution': frame.describe('amount'),
             'recent_expenses': []
         }
         
-        # Process expenses
-        for expense in expenses:
-            amount = float(expense.get('amount', 0))
-            
-            # Update totals
-            stats['total_amount'] += amount
-            
-            # Group by category
-            category = expense.get('category', 'Uncategorized')
-            if category not in stats['by_category']:
-                stats['by_category'][category] = 0
-            stats['by_category'][category] += amount
-            
-            # Group by payment method
-            payment_method = expense.get('payment_method', 'Cash')
-            if payment_method not in stats['by_payment_method']:
-                stats['by_payment_method'][payment_method] = 0
-            stats['by_payment_method'][payment_method] += amount
-            
-            # Group by status
-            status = expense.get('status', 'approved')
-            if status not in stats['by_status']:
-                stats['by_status'][status] = 0
-            stats['by_status'][status] += amount
-        
-        # Calculate average
-        if stats['total_expenses'] > 0:
-            stats['average_expense'] = stats['total_amount'] / stats['total_expenses']
-        
         # Get recent expenses (last 5)
         recent_response = supabase.table('expenses')\
             .select('*')\
@@ -456,6 +441,18 @@ def get_monthly_expense_totals(business_id):
         start_date = f"{current_year}-01-01"
         end_date = f"{current_year}-12-31"
         
+        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
+                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        
+        # Pre-aggregated monthly totals from the trend cube
+        cube = trend_cube.get_series(supabase, business_id, 'expenses', 'month',
+                                     date(current_year, 1, 1), date(current_year, 12, 31))
+        if cube is not None:
+            return {
+                'labels': months,
+                'data': cube['series'].get('all', {}).get('amount', [0] * 12)
+            }
+        
         response = supabase.table('expenses')\
             .select('expense_date, amount')\
             .eq('business_id', business_id)\
@@ -463,22 +460,17 @@ def get_monthly_expense_totals(business_id):
             .lte('expense_date', end_date)\
             .execute()
         
+        frame = analytics.Frame.from_rows(
+            response.data,
+            month=('expense_date', 'month'),
+            amount=('amount', 'float')
+        )
+        
         # Initialize monthly totals
         monthly_totals = {month: 0 for month in range(1, 13)}
-        
-        for expense in response.data:
-            try:
-                expense_date = datetime.fromisoformat(expense['expense_date'].replace('Z', '+00:00'))
-                month = expense_date.month
-                amount = float(expense.get('amount', 0))
-                monthly_totals[month] += amount
-            except:
-                continue
+        monthly_totals.update(frame.group_sums('month', 'amount'))
         
         # Format for chart
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        
         chart_data = {
             'labels': months,
             'data': [monthly_totals[i] for i in range(1, 13)]
@@ -493,24 +485,27 @@ def get_monthly_expense_totals(business_id):
 def get_category_totals(business_id):
     """Get expense totals by category"""
     try:
+        # Pre-aggregated category totals from the trend cube
+        sorted_categories = trend_cube.get_totals(supabase, business_id, 'expenses', 'category')
+        if sorted_categories is not None:
+            return {
+                'labels': [cat for cat, _ in sorted_categories],
+                'data': [amount for _, amount in sorted_categories]
+            }
+        
         response = supabase.table('expenses')\
             .select('category, amount')\
             .eq('business_id', business_id)\
             .execute()
         
-        category_totals = {}
-        
-        for expense in response.data:
-            category = expense.get('category', 'Uncategorized')
-            amount = float(expense.get('amount', 0))
-            
-            if category not in category_totals:
-                category_totals[category] = 0
-            
-            category_totals[category] += amount
+        frame = analytics.Frame.from_rows(
+            response.data,
+            category=('category', 'string', 'Uncategorized'),
+            amount=('amount', 'float')
+        )
         
         # Sort by amount descending
-        sorted_categories = sorted(category_totals.items(), key=lambda x: x[1], reverse=True)
+        sorted_categories = frame.top('category', 'amount', n=None)
         
         # Format for chart
         chart_data = {
@@ -11,6 +11,8 @@ from urllib.parse import unquote
 
 from routes.auth import get_utc_now, admin_required, get_supabase
 from config import Config
+import catalog_snapshot
+from product_search import search_products
 from cloudinary_utils import upload_to_cloudinary, delete_from_cloudinary, optimize_image_url, get_image_thumbnail
 
 products_bp = Blueprint('products_inventory', __name__, url_prefix='/products-inventory')
@@ -28,30 +30,6 @@ def require_business_context(f):
     return decorated_function
 
 
-def role_required(roles):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                flash('Please log in to access this page', 'error')
-                return redirect(url_for('auth.login'))
-            
-            user_role = session.get('user_role', 'employee')
-            
-            if isinstance(roles, str):
-                required_roles = [roles]
-            else:
-                required_roles = roles
-            
-            if user_role not in required_roles:
-                flash('You do not have permission to access this page', 'error')
-                return redirect(url_for('dashboard'))
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
-
 # Helper function to create audit log entries
 def create_audit_log(product_id, action_type, field_name=None, old_value=None, new_value=None, notes=None):
     """Create an audit log entry"""
@@ -596,6 +574,8 @@ def create_product():
                 
                 supabase.table('inventory_movements').insert(movement_data).execute()
             
+            catalog_snapshot.mark_changed(business_id, [product_id])
+            
             flash('Product created successfully', 'success')
             return redirect(url_for('products_inventory.products_list'))
         
@@ -795,6 +775,7 @@ def edit_product(product_id):
                 .execute()
             
             if response.data:
+                catalog_snapshot.mark_changed(business_id, [product_id])
                 if changed_fields:
                     flash(f'Product updated successfully. {len(changed_fields)} field(s) changed.', 'success')
                 else:
@@ -883,6 +864,7 @@ def delete_product(product_id):
             .execute()
         
         if response.data:
+            catalog_snapshot.mark_changed(business_id, [product_id])
             flash('Product deleted successfully', 'success')
         else:
             flash('Failed to delete product', 'error')
@@ -1023,7 +1005,7 @@ def view_product(product_id):
 @products_bp.route('/api/search', methods=['GET'])
 @admin_required
 def search_products_api():
-    """API endpoint to search products"""
+    """API endpoint to search products (ranked, paginated with ?page=&per_page=)"""
     try:
         query = request.args.get('q', '').strip()
         supabase = get_supabase()
@@ -1032,16 +1014,22 @@ def search_products_api():
         if not query:
             return jsonify({'success': False, 'error': 'Search query required'})
         
-        response = supabase.table('products') \
-            .select('id, name, sku, selling_price, image_url') \
-            .or_(f'name.ilike.%{query}%,sku.ilike.%{query}%,barcode.ilike.%{query}%') \
-            .eq('business_id', business_id) \
-            .limit(10) \
-            .execute()
+        result = search_products(
+            supabase,
+            business_id,
+            query,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 10, type=int),
+            active_only=request.args.get('active_only') == 'true'
+        )
         
         return jsonify({
             'success': True,
-            'products': response.data if response.data else []
+            'products': result['products'],
+            'total': result['total'],
+            'page': result['page'],
+            'per_page': result['per_page'],
+            'pages': result['pages']
         })
         
     except Exception as e:
@@ -1223,6 +1211,8 @@ def adjust_inventory():
         
         supabase.table('inventory_movements').insert(movement_data).execute()
         
+        catalog_snapshot.mark_changed(business_id, [product_id])
+        
         # Create audit log
         create_audit_log(
             product_id=product_id,
@@ -1577,14 +1567,15 @@ def clear_old_audit_logs():
         from datetime import datetime, timedelta
         cutoff_date = datetime.now() - timedelta(days=days)
         
-        # Delete old logs
+        # Delete old logs (the created_at bound limits the delete to old monthly partitions;
+        # whole months past the global retention are dropped by partitions.py instead)
         response = supabase.table('product_audit_logs') \
-            .delete() \
+            .delete(count='exact', returning='minimal') \
             .eq('business_id', business_id) \
             .lt('created_at', cutoff_date.isoformat()) \
             .execute()
         
-        deleted_count = len(response.data) if response.data else 0
+        deleted_count = response.count or 0
         
         flash(f'Cleared {deleted_count} audit logs older than {days} days', 'success')
         return redirect(url_for('products_inventory.product_audit_logs'))
@@ -5,6 +5,9 @@ from decimal import Decimal
 import uuid
 from supabase import create_client
 from config import Config
+import history_archive
+import analytics
+import profit
 import io
 from xhtml2pdf import pisa
 import tempfile
@@ -89,79 +92,68 @@ def get_business_info(business_id):
 def get_sales_summary(business_id, start_date, end_date):
     """Get sales summary for the given period"""
     try:
+        # Months before the archive watermark are read from Parquet, the rest from Supabase
+        archive_until, live_start = history_archive.split_range(business_id, 'sales', start_date, end_date)
+        
         # Get sales data
-        sales_response = supabase.table('sales').select(
-            'invoice_number, customer_name, total_amount, tax_amount, discount_amount, subtotal, payment_status, created_at'
-        ).eq('business_id', business_id)\
-         .gte('created_at', start_date)\
-         .lte('created_at', end_date)\
-         .order('created_at', desc=True).execute()
+        sales = []
+        if live_start:
+            sales_response = supabase.table('sales').select(
+                'invoice_number, customer_name, total_amount, tax_amount, discount_amount, subtotal, payment_status, created_at'
+            ).eq('business_id', business_id)\
+             .gte('created_at', live_start)\
+             .lte('created_at', end_date)\
+             .order('created_at', desc=True).execute()
+            
+            sales = sales_response.data if sales_response.data else []
         
-        sales = sales_response.data if sales_response.data else []
+        archived = history_archive.sales_aggregates(business_id, start_date, end_date) if archive_until else None
+        
+        # Load the rows into columns once and aggregate column-wise
+        frame = analytics.Frame.from_rows(
+            sales,
+            total_amount=('total_amount', 'float'),
+            tax_amount=('tax_amount', 'float'),
+            discount_amount=('discount_amount', 'float'),
+            subtotal=('subtotal', 'float'),
+            payment_status=('payment_status', 'string', 'pending'),
+            day=('created_at', 'day')
+        )
         
         # Calculate totals
-        total_sales = len(sales)
-        total_revenue = sum(float(sale.get('total_amount', 0)) for sale in sales)
-        total_tax = sum(float(sale.get('tax_amount', 0)) for sale in sales)
-        total_discount = sum(float(sale.get('discount_amount', 0)) for sale in sales)
-        total_subtotal = sum(float(sale.get('subtotal', 0)) for sale in sales)
+        total_sales = len(frame)
+        total_revenue = frame.sum('total_amount')
+        total_tax = frame.sum('tax_amount')
+        total_discount = frame.sum('discount_amount')
+        total_subtotal = frame.sum('subtotal')
+        
+        if archived:
+            total_sales += archived['count']
+            total_revenue += archived['total_revenue']
+            total_tax += archived['total_tax']
+            total_discount += archived['total_discount']
+            total_subtotal += archived['total_subtotal']
         
         # Get payment status breakdown
-        payment_statuses = {}
-        for sale in sales:
-            status = sale.get('payment_status', 'pending')
-            amount = float(sale.get('total_amount', 0))
-            if status not in payment_statuses:
-                payment_statuses[status] = {'count': 0, 'amount': 0}
-            payment_statuses[status]['count'] += 1
-            payment_statuses[status]['amount'] += amount
-        
-        # Get daily sales trend
-        daily_trend_response = supabase.table('sales').select(
-            'created_at, total_amount'
-        ).eq('business_id', business_id)\
-         .gte('created_at', start_date)\
-         .lte('created_at', end_date)\
-         .execute()
-        
-        daily_trend = {}
-        daily_counts = {}
-        for sale in daily_trend_response.data if daily_trend_response.data else []:
-            try:
-                sale_date_str = sale['created_at']
-                if isinstance(sale_date_str, str):
-                    # Parse ISO date string
-                    if 'T' in sale_date_str:
-                        sale_date = datetime.fromisoformat(sale_date_str.replace('Z', '+00:00')).date()
-                    else:
-                        # Try parsing as simple date
-                        sale_date = datetime.strptime(sale_date_str, '%Y-%m-%d').date()
-                else:
-                    # If it's already a date object
-                    sale_date = sale_date_str
-                
-                amount = float(sale.get('total_amount', 0))
-                date_key = sale_date.isoformat() if hasattr(sale_date, 'isoformat') else str(sale_date)
-                
-                if date_key not in daily_trend:
-                    daily_trend[date_key] = 0
-                    daily_counts[date_key] = 0
-                
-                daily_trend[date_key] += amount
-                daily_counts[date_key] += 1
-            except Exception as date_error:
-                print(f"Error parsing date in sales: {date_error}")
-                continue
+        payment_statuses = frame.group_totals('payment_status', 'total_amount')
+        
+        if archived:
+            for status, values in archived['payment_statuses'].items():
+                if status not in payment_statuses:
+                    payment_statuses[status] = {'count': 0, 'amount': 0}
+                payment_statuses[status]['count'] += values['count']
+                payment_statuses[status]['amount'] += values['amount']
+        
+        # Get daily sales trend (from the rows already loaded)
+        daily_trend = {entry['date']: entry for entry in frame.daily('day', 'total_amount')}
+        if archived:
+            for date_key, values in archived['daily'].items():
+                entry = daily_trend.setdefault(date_key, {'date': date_key, 'amount': 0, 'count': 0})
+                entry['amount'] += values['amount']
+                entry['count'] += values['count']
         
         # Sort daily trend by date
-        sorted_dates = sorted(daily_trend.keys())
-        sorted_daily_trend = []
-        for date_key in sorted_dates:
-            sorted_daily_trend.append({
-                'date': date_key,
-                'amount': daily_trend[date_key],
-                'count': daily_counts.get(date_key, 0)
-            })
+        sorted_daily_trend = [daily_trend[date_key] for date_key in sorted(daily_trend)]
         
         return {
             'total_sales': total_sales,
@@ -192,39 +184,49 @@ def get_sales_summary(business_id, start_date, end_date):
 def get_expenses_summary(business_id, start_date, end_date):
     """Get expenses summary for the given period"""
     try:
-        # Get expenses data
-        expenses_response = supabase.table('expenses').select(
+        # Months before the archive watermark are read from Parquet, the rest from Supabase
+        archive_until, live_start = history_archive.split_range(business_id, 'expenses', start_date, end_date)
+        
+        # Get expenses data (below the watermark, only expenses entered after their month was archived)
+        expenses_query = supabase.table('expenses').select(
             'expense_date, vendor, description, category, amount, payment_method, status'
         ).eq('business_id', business_id)\
          .gte('expense_date', start_date)\
-         .lte('expense_date', end_date)\
-         .order('expense_date', desc=True).execute()
+         .lte('expense_date', end_date)
+        if archive_until:
+            expenses_query = expenses_query.or_(f'expense_date.gte.{archive_until.isoformat()},archived_at.is.null')
+        expenses_response = expenses_query.order('expense_date', desc=True).execute()
         
         expenses = expenses_response.data if expenses_response.data else []
         
+        archived = history_archive.expense_aggregates(business_id, start_date, end_date) if archive_until else None
+        
+        frame = analytics.Frame.from_rows(
+            expenses,
+            amount=('amount', 'float'),
+            category=('category', 'string', 'Uncategorized'),
+            status=('status', 'string', 'approved')
+        )
+        
         # Calculate totals
-        total_expenses = len(expenses)
-        total_amount = sum(float(expense.get('amount', 0)) for expense in expenses)
-        
-        # Get category breakdown
-        categories = {}
-        for expense in expenses:
-            category = expense.get('category', 'Uncategorized')
-            amount = float(expense.get('amount', 0))
-            if category not in categories:
-                categories[category] = {'count': 0, 'amount': 0}
-            categories[category]['count'] += 1
-            categories[category]['amount'] += amount
-        
-        # Get status breakdown
-        statuses = {}
-        for expense in expenses:
-            status = expense.get('status', 'approved')
-            amount = float(expense.get('amount', 0))
-            if status not in statuses:
-                statuses[status] = {'count': 0, 'amount': 0}
-            statuses[status]['count'] += 1
-            statuses[status]['amount'] += amount
+        total_expenses = len(frame)
+        total_amount = frame.sum('amount')
+        
+        if archived:
+            total_expenses += archived['count']
+            total_amount += archived['total_amount']
+        
+        # Get category and status breakdowns
+        categories = frame.group_totals('category', 'amount')
+        statuses = frame.group_totals('status', 'amount')
+        
+        if archived:
+            for breakdown, archived_breakdown in ((categories, archived['categories']), (statuses, archived['statuses'])):
+                for key, values in archived_breakdown.items():
+                    if key not in breakdown:
+                        breakdown[key] = {'count': 0, 'amount': 0}
+                    breakdown[key]['count'] += values['count']
+                    breakdown[key]['amount'] += values['amount']
         
         return {
             'total_expenses': total_expenses,
@@ -255,14 +257,20 @@ def get_profit_loss_summary(business_id, start_date, end_date):
         # Get expenses summary
         expenses_summary = get_expenses_summary(business_id, start_date, end_date)
         
+        # Cost of goods sold from the daily rollup (FIFO lot cost recorded at checkout)
+        cogs_summary = profit.get_cogs_summary(supabase, business_id, start_date, end_date)
+        
         # Calculate profit/loss
         total_revenue = sales_summary['total_revenue']
         total_expenses = expenses_summary['total_amount']
-        gross_profit = total_revenue
+        cost_of_goods_sold = cogs_summary['cogs']
+        # Margins use the rollup's net sales (paid, pre-tax, less refunds), the base COGS is measured on
+        net_sales = cogs_summary['revenue']
+        gross_profit = cogs_summary['gross_profit']
         net_profit = gross_profit - total_expenses
         
         # Calculate profit margin
-        profit_margin = (net_profit / total_revenue * 100) if total_revenue > 0 else 0
+        profit_margin = (net_profit / net_sales * 100) if net_sales > 0 else 0
         
         return {
             'period': {
@@ -271,6 +279,7 @@ def get_profit_loss_summary(business_id, start_date, end_date):
             },
             'revenue': {
                 'total': total_revenue,
+                'net_sales': net_sales,
                 'average_sale': sales_summary['average_sale'],
                 'total_sales': sales_summary['total_sales']
             },
@@ -280,12 +289,15 @@ def get_profit_loss_summary(business_id, start_date, end_date):
                 'total_expenses': expenses_summary['total_expenses']
             },
             'profit_loss': {
+                'cost_of_goods_sold': cost_of_goods_sold,
                 'gross_profit': gross_profit,
+                'gross_margin': cogs_summary['gross_margin'],
                 'net_profit': net_profit,
                 'profit_margin': profit_margin
             },
             'sales_summary': sales_summary,
-            'expenses_summary': expenses_summary
+            'expenses_summary': expenses_summary,
+            'cogs_summary': cogs_summary
         }
     
     except Exception as e:
@@ -306,12 +318,15 @@ def get_profit_loss_summary(business_id, start_date, end_date):
                 'total_expenses': 0
             },
             'profit_loss': {
+                'cost_of_goods_sold': 0,
                 'gross_profit': 0,
+                'gross_margin': 0,
                 'net_profit': 0,
                 'profit_margin': 0
             },
             'sales_summary': None,
-            'expenses_summary': None
+            'expenses_summary': None,
+            'cogs_summary': None
         }
 
 @reports_bp.route('/reports')
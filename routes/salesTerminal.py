@@ -9,9 +9,21 @@ import uuid
 import time
 from urllib.parse import quote
 
-from routes.auth import get_utc_now, role_required, get_supabase
+from routes.auth import get_utc_now, role_required, get_supabase, require_principal
 from config import Config
 from pesapal import PesaPal
+from cart_store import get_session_cart, save_session_cart, clear_session_cart
+import catalog_snapshot
+import product_index
+import profit
+import refund_engine
+import sales_history as sales_history_pages
+import audit_trail
+import receipts
+import printer_registry
+import trend_cube
+import authz
+from payment_reconciler import apply_payment_status, enqueue_ipn
 from functools import lru_cache
 from datetime import datetime, timedelta
 import concurrent.futures
@@ -28,14 +40,11 @@ sales_bp = Blueprint('sales_terminal', __name__, url_prefix='/sales-terminal')
 def sales_access_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Please login to access this page', 'warning')
-            return redirect(url_for('auth.login'))
+        principal, denied = require_principal()
+        if denied:
+            return denied
         
-        user_role = session.get('user_role', 'employee')
-        allowed_roles = ['admin', 'manager', 'cashier', 'sales', 'employee']
-        
-        if user_role not in allowed_roles:
+        if not principal.has_role(authz.SALES_ROLES):
             flash('Sales access required', 'error')
             return redirect(url_for('dashboard'))
         
@@ -150,20 +159,23 @@ def generate_invoice_number(supabase, business_id):
     return f"INV-{date_str}-{sequence:04d}"
 
 
-def handle_cart_operation(action, supabase, business_id):
-    """Handle cart operations efficiently"""
-    product_id = request.form.get('product_id')
-    quantity = int(request.form.get('quantity', 1))
-    
-    cart = session.get('cart', {})
-    
-    if action == 'clear_cart':
-        session['cart'] = {}
-        session.modified = True
-        flash('Cart cleared', 'success')
-        return redirect(url_for('sales_terminal.terminal'))
+def get_cart_product(supabase, product_id, business_id):
+    """Get the cart fields of an active product from the product index, falling back to a cached query"""
+    try:
+        row = product_index.get_index(supabase, business_id).get(product_id)
+        if row:
+            product = product_index.product_dict(row)
+            return {
+                'id': product['id'],
+                'name': product['name'],
+                'price': product['selling_price'],
+                'tax_rate': product['tax_rate'],
+                'unit': product['unit'],
+                'stock': product['stock']
+            }
+    except Exception as e:
+        print(f"⚠️ Product index unavailable: {str(e)}")
     
-    # For add/update, first check if product exists in cache
     cache_key = f'product_{product_id}_{business_id}'
     product_data = memory_cache.get(cache_key)
     
@@ -174,56 +186,124 @@ def handle_cart_operation(action, supabase, business_id):
             .eq('id', product_id) \
             .eq('business_id', business_id) \
             .eq('is_active', True) \
-            .single() \
+            .limit(1) \
             .execute()
         
         if not product_response.data:
-            flash('Product not found or inactive', 'error')
-            return redirect(url_for('sales_terminal.terminal'))
+            return None
         
-        product = product_response.data
+        product = product_response.data[0]
         product_data = {
             'id': product['id'],
             'name': product['name'],
             'price': float(product['selling_price']),
-            'tax_rate': float(product.get('tax_rate', 0)),
+            'tax_rate': float(product.get('tax_rate') or 0),
             'unit': product.get('unit', '')
         }
         memory_cache.set(cache_key, product_data, timeout=300)
     
+    return product_data
+
+def resolve_product_code(supabase, business_id, code):
+    """
+    Find the product id for a scanned barcode or typed SKU
+
+    The index answers most lookups; a miss is checked against the database once
+    (the snapshot may not have caught up with a new code yet).
+    """
+    if not code:
+        return None
+    try:
+        row = product_index.get_index(supabase, business_id).lookup_code(code)
+        if row:
+            return row[catalog_snapshot.ID]
+    except Exception as e:
+        print(f"⚠️ Product index unavailable: {str(e)}")
+    
+    # Quoted so commas, dots and parentheses in the code are not read as filter syntax
+    code = code.strip()
+    quoted = '"' + code.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    response = supabase.table('products') \
+        .select('id') \
+        .eq('business_id', business_id) \
+        .eq('is_active', True) \
+        .or_(f'barcode.eq.{quoted},sku.eq.{quoted}') \
+        .limit(1) \
+        .execute()
+    if not response.data:
+        return None
+    
+    product_id = response.data[0]['id']
+    catalog_snapshot.mark_changed(business_id, [product_id])
+    return product_id
+
+def apply_cart_action(action, cart, product_id, quantity, supabase, business_id):
+    """
+    Apply a cart action to a Cart
+    
+    Returns:
+        tuple: (success, message, http_status)
+    """
+    if action == 'clear_cart':
+        cart.clear()
+        return True, 'Cart cleared', 200
+    
+    if not product_id:
+        return False, 'Product is required', 400
+    
+    # Removing never needs the product record
+    if action == 'remove_from_cart' or (action == 'update_cart' and quantity <= 0):
+        if product_id in cart:
+            cart.remove(product_id)
+            return True, 'Item removed from cart', 200
+        return True, None, 200
+    
+    if action == 'update_cart' and product_id not in cart:
+        return True, None, 200
+    
+    if quantity <= 0:
+        return False, 'Please enter a valid quantity', 400
+    
+    product_data = get_cart_product(supabase, product_id, business_id)
+    if not product_data:
+        return False, 'Product not found or inactive', 404
+    
     # Check stock only when adding new items or increasing quantity
-    if action == 'add_to_cart' or (action == 'update_cart' and product_id in cart):
-        current_qty = cart.get(product_id, {}).get('quantity', 0)
-        new_qty = current_qty + quantity if action == 'add_to_cart' else quantity
-        
-        if new_qty > current_qty:  # Only check stock if increasing quantity
+    current_qty = cart.quantity(product_id)
+    new_qty = current_qty + quantity if action == 'add_to_cart' else quantity
+    
+    if new_qty > current_qty:
+        stock = product_data.get('stock')
+        if stock is None or new_qty > stock:
+            # Indexed stock can lag writes from other workers; confirm before refusing
             stock = get_product_stock_fast(supabase, product_id)
-            
-            if new_qty > stock:
-                flash(f'Insufficient stock. Only {stock} available.', 'error')
-                return redirect(url_for('sales_terminal.terminal'))
+        
+        if new_qty > stock:
+            return False, f'Insufficient stock. Only {stock} available.', 409
     
-    # Update cart
     if action == 'add_to_cart':
-        if product_id in cart:
-            cart[product_id]['quantity'] += quantity
-        else:
-            cart[product_id] = {
-                **product_data,
-                'quantity': quantity
-            }
-        flash(f'Added {quantity} {product_data["name"]} to cart', 'success')
+        cart.add(product_id, quantity, product_data)
+        return True, f'Added {quantity} {product_data["name"]} to cart', 200
+    
+    cart.set_quantity(product_id, quantity)
+    return True, 'Cart updated', 200
+
+def handle_cart_operation(action, supabase, business_id):
+    """Handle cart form posts (non-JavaScript fallback for the cart API)"""
+    product_id = request.form.get('product_id') or \
+        resolve_product_code(supabase, business_id, request.form.get('barcode'))
+    quantity = int(request.form.get('quantity', 1))
+    
+    cart = get_session_cart()
+    success, message, _ = apply_cart_action(action, cart, product_id, quantity, supabase, business_id)
     
-    elif action == 'update_cart':
-        if quantity <= 0 and product_id in cart:
-            del cart[product_id]
-            flash('Item removed from cart', 'success')
-        elif product_id in cart:
-            cart[product_id]['quantity'] = quantity
-            flash('Cart updated', 'success')
+    if action == 'clear_cart':
+        clear_session_cart()
+    elif success:
+        save_session_cart(cart)
     
-    session['cart'] = cart
-    session.modified = True
+    if message:
+        flash(message, 'success' if success else 'error')
     return redirect(url_for('sales_terminal.terminal'))
 
 def get_product_stock_fast(supabase, product_id):
@@ -428,6 +508,10 @@ def terminal():
         supabase = get_supabase()
         business_id = session.get('business_id')
         
+        # Tills identify themselves once with ?terminal=<name> (receipt printer routing)
+        if request.args.get('terminal'):
+            session['terminal_id'] = request.args.get('terminal').strip()[:64]
+        
         # POST requests
         if request.method == 'POST':
             action = request.form.get('action')
@@ -453,11 +537,10 @@ def terminal():
             products = products_future.result()
             today_total = today_sales_future.result()
         
-        # Get cart from session
-        cart = session.get('cart', {})
-        
-        # Calculate totals (optimized)
-        totals = calculate_cart_totals_fast(cart)
+        # Get cart from the server-side store (totals are kept incrementally)
+        session_cart = get_session_cart()
+        cart = session_cart.to_dict()
+        totals = session_cart.totals()
         
         # Cache frequently accessed data
         cache_key = f'terminal_data_{business_id}_{datetime.now().strftime("%Y%m%d%H")}'
@@ -486,12 +569,118 @@ def terminal():
     
     
 
+# Cart API (JSON) - lets the terminal patch the cart without re-rendering the catalogue
+
+def cart_response(cart, success=True, message=None, status=200):
+    """JSON body with the updated cart lines and totals"""
+    return jsonify({
+        'success': success,
+        'message': message,
+        'cart': {
+            'items': [cart.item(product_id) for product_id in cart.lines],
+            'count': len(cart)
+        },
+        'totals': cart.totals()
+    }), status
+
+def cart_api_action(action):
+    data = request.get_json(silent=True) or request.form
+    supabase = get_supabase()
+    business_id = session.get('business_id')
+    product_id = data.get('product_id')
+    
+    if not product_id and data.get('barcode'):
+        product_id = resolve_product_code(supabase, business_id, data.get('barcode'))
+        if not product_id:
+            return jsonify({'success': False, 'message': 'No product matches that code'}), 404
+    
+    try:
+        quantity = int(data.get('quantity', 0 if action == 'remove_from_cart' else 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid quantity'}), 400
+    
+    cart = get_session_cart()
+    success, message, status = apply_cart_action(
+        action, cart, product_id, quantity, supabase, business_id
+    )
+    
+    if action == 'clear_cart':
+        clear_session_cart()
+    elif success:
+        save_session_cart(cart)
+    
+    return cart_response(cart, success, message, status)
+
+@sales_bp.route('/api/cart', methods=['GET'])
+@sales_access_required
+def cart_api():
+    """Current cart and totals"""
+    return cart_response(get_session_cart())
+
+@sales_bp.route('/api/cart/totals', methods=['GET'])
+@sales_access_required
+def cart_totals_api():
+    """Cart totals only"""
+    cart = get_session_cart()
+    return jsonify({'success': True, 'count': len(cart), 'totals': cart.totals()})
+
+@sales_bp.route('/api/cart/add', methods=['POST'])
+@sales_access_required
+def cart_add_api():
+    """Add a product to the cart by product_id or scanned barcode/SKU"""
+    return cart_api_action('add_to_cart')
+
+@sales_bp.route('/api/cart/update', methods=['POST'])
+@sales_access_required
+def cart_update_api():
+    """Set a cart line's quantity (0 removes it)"""
+    return cart_api_action('update_cart')
+
+@sales_bp.route('/api/cart/remove', methods=['POST'])
+@sales_access_required
+def cart_remove_api():
+    """Remove a product from the cart"""
+    return cart_api_action('remove_from_cart')
+
+@sales_bp.route('/api/cart/clear', methods=['POST'])
+@sales_access_required
+def cart_clear_api():
+    """Empty the cart"""
+    return cart_api_action('clear_cart')
+
+@sales_bp.route('/api/catalog', methods=['GET'])
+@sales_access_required
+def catalog_api():
+    """Versioned catalogue snapshot, or only the changes after ?since=<version>"""
+    try:
+        snapshot = catalog_snapshot.get_snapshot(get_supabase(), session.get('business_id'))
+        
+        since = request.args.get('since', type=int)
+        compress = 'gzip' in request.accept_encodings
+        etag, body = snapshot.render(since, compress=compress)
+        
+        if etag.strip('"') in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+            if compress:
+                response.headers['Content-Encoding'] = 'gzip'
+        
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+        
+    except Exception as e:
+        print(f"❌ Error serving catalog: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not load catalog'}), 500
+
 @sales_bp.route('/payment', methods=['GET', 'POST'])
 @sales_access_required
 def process_payment():
     """Process payment page"""
     try:
-        cart = session.get('cart', {})
+        cart = get_session_cart().to_dict()
         
         if not cart:
             flash('Cart is empty', 'error')
@@ -563,29 +752,17 @@ def process_payment():
                 flash('Failed to create sale record', 'error')
                 return redirect(url_for('sales_terminal.process_payment'))
             
-            # Create sale items and update inventory
+            # Cost price fallback for lots without one (and for quantity not covered by any lot)
+            product_costs = profit.get_product_costs(supabase, cart.keys())
+            
+            # Update inventory and create sale items
+            sale_items = []
             for product_id, item in cart.items():
-                # Create sale item
-                sale_item_id = str(uuid.uuid4())
-                sale_item_data = {
-                    'id': sale_item_id,
-                    'sale_id': sale_id,
-                    'product_id': product_id,
-                    'product_name': item['name'],
-                    'sku': item.get('sku'),
-                    'quantity': item['quantity'],
-                    'unit_price': item['price'],
-                    'tax_rate': item['tax_rate'],
-                    'total_price': item['price'] * item['quantity'],
-                    'created_at': get_utc_now().isoformat()
-                }
-                
-                supabase.table('sale_items').insert(sale_item_data).execute()
-                
-                # Update inventory
+                # Consume lots FIFO, recording the cost of each unit taken
                 quantity_to_deduct = item['quantity']
+                cost_amount = 0
                 lots_response = supabase.table('product_lots') \
-                    .select('id, quantity, lot_number') \
+                    .select('id, quantity, lot_number, cost_price') \
                     .eq('product_id', product_id) \
                     .gt('quantity', 0) \
                     .order('created_at') \
@@ -600,6 +777,8 @@ def process_payment():
                         deduct_quantity = min(quantity_to_deduct, lot_quantity)
                         
                         if deduct_quantity > 0:
+                            lot_cost = profit.unit_cost(lot, product_costs.get(product_id, 0))
+                            
                             # Update lot quantity
                             supabase.table('product_lots') \
                                 .update({'quantity': lot_quantity - deduct_quantity}) \
@@ -614,6 +793,7 @@ def process_payment():
                                 'lot_id': lot['id'],
                                 'movement_type': 'OUT',
                                 'quantity': deduct_quantity,
+                                'unit_cost': lot_cost,
                                 'reference': f'Sale: {invoice_number}',
                                 'created_by': user_id,
                                 'created_at': get_utc_now().isoformat()
@@ -621,16 +801,51 @@ def process_payment():
                             
                             supabase.table('inventory_movements').insert(movement_data).execute()
                             
+                            cost_amount += lot_cost * deduct_quantity
                             quantity_to_deduct -= deduct_quantity
+                
+                if quantity_to_deduct > 0:
+                    cost_amount += product_costs.get(product_id, 0) * quantity_to_deduct
+                
+                # Create sale item (the rollup trigger adds it to the day's revenue and COGS)
+                sale_item_id = str(uuid.uuid4())
+                sale_item_data = {
+                    'id': sale_item_id,
+                    'sale_id': sale_id,
+                    'product_id': product_id,
+                    'product_name': item['name'],
+                    'sku': item.get('sku'),
+                    'quantity': item['quantity'],
+                    'unit_price': item['price'],
+                    'tax_rate': item['tax_rate'],
+                    'total_price': item['price'] * item['quantity'],
+                    'cost_amount': round(cost_amount, 2),
+                    'created_at': get_utc_now().isoformat()
+                }
+                
+                supabase.table('sale_items').insert(sale_item_data).execute()
+                sale_items.append(sale_item_data)
             
             # Clear cart
-            session['cart'] = {}
-            session.modified = True
+            clear_session_cart()
+            
+            # Stock changed for every product sold
+            catalog_snapshot.mark_changed(business_id, list(cart.keys()))
+            trend_cube.invalidate(business_id)
+            sales_history_pages.invalidate(business_id)
+            
+            # Render the receipt once; views and reprints read the stored copy
+            sale_receipt = receipts.record_sale(supabase, business_id, sale_data, sale_items, session.get('user_name'))
+            
+            # Queued on the printer spooler; checkout does not wait for the printer
+            if sale_receipt and payment_status == 'completed':
+                printer_registry.print_receipt(supabase, business_id, sale_receipt['escpos'],
+                                               session.get('terminal_id'), label=f'receipt {invoice_number}')
             
             # Handle PesaPal payment
             if payment_method == 'pesapal':
-                # Initialize PesaPal
-                pesapal = PesaPal()
+                # Initialize PesaPal (credentials, token and IPN id are cached per business)
+                pesapal = PesaPal(business_id)
                 
                 # Prepare payment details
                 reference_id = invoice_number
@@ -688,7 +903,6 @@ def process_payment():
             return redirect(url_for('sales_terminal.receipt', sale_id=sale_id))
         
         # GET request - show payment form
-        cart = session.get('cart', {})
         totals = calculate_cart_totals(cart) if cart else {'total': 0}
         
         return render_template('sales/payment.html', 
@@ -735,23 +949,8 @@ def pesapal_callback():
             flash('Could not verify payment status', 'error')
             return redirect(url_for('sales_terminal.terminal'))
         
-        # Normalize payment status
-        payment_status_desc = payment_status.get('payment_status_description', '').upper()
-        if 'COMPLETED' in payment_status_desc:
-            normalized_status = 'completed'
-        elif 'PENDING' in payment_status_desc:
-            normalized_status = 'pending'
-        else:
-            normalized_status = 'failed'
-        
-        # Update sale status
-        supabase.table('sales') \
-            .update({
-                'payment_status': normalized_status,
-                'updated_at': get_utc_now().isoformat()
-            }) \
-            .eq('id', sale_id) \
-            .execute()
+        # Normalize and record payment status on the session and sale
+        normalized_status = apply_payment_status(payment_session, payment_status, supabase)
         
         if normalized_status == 'completed':
             flash('Payment completed successfully!', 'success')
@@ -768,250 +967,261 @@ def pesapal_callback():
         flash(f'Error processing payment: {str(e)}', 'error')
         return redirect(url_for('sales_terminal.terminal'))
 
+@sales_bp.route('/pesapal-ipn', methods=['GET', 'POST'])
+def pesapal_ipn():
+    """Receive PesaPal IPN notifications and queue them for verification"""
+    data = request.args if request.method == 'GET' else (request.get_json(silent=True) or request.form)
+    
+    order_tracking_id = data.get('OrderTrackingId')
+    merchant_reference = data.get('OrderMerchantReference')
+    notification_type = data.get('OrderNotificationType', 'IPNCHANGE')
+    
+    if not order_tracking_id:
+        return jsonify({
+            'orderNotificationType': notification_type,
+            'orderTrackingId': order_tracking_id,
+            'orderMerchantReference': merchant_reference,
+            'status': 500
+        }), 400
+    
+    # Acknowledge immediately; the reconciler verifies the status in the background
+    enqueue_ipn(order_tracking_id, merchant_reference, notification_type)
+    
+    return jsonify({
+        'orderNotificationType': notification_type,
+        'orderTrackingId': order_tracking_id,
+        'orderMerchantReference': merchant_reference,
+        'status': 200
+    })
+
 @sales_bp.route('/receipt/<sale_id>')
 @sales_access_required
 def receipt(sale_id):
-    """View receipt for a sale"""
+    """View receipt for a sale (pre-rendered at checkout, see receipts.py)"""
     try:
         supabase = get_supabase()
         business_id = session.get('business_id')
         
-        # Get sale details
-        sale_response = supabase.table('sales') \
-            .select('*, users(first_name, last_name)') \
-            .eq('id', sale_id) \
-            .eq('business_id', business_id) \
-            .execute()
+        sale_receipt = receipts.get_receipt(supabase, business_id, sale_id)
         
-        if not sale_response.data:
+        if not sale_receipt:
             flash('Sale not found', 'error')
             return redirect(url_for('sales_terminal.terminal'))
         
-        sale = sale_response.data[0]
-        
-        # Get sale items
-        items_response = supabase.table('sale_items') \
-            .select('*') \
-            .eq('sale_id', sale_id) \
-            .execute()
+        return sale_receipt['html']
         
-        items = items_response.data if items_response.data else []
+    except Exception as e:
+        flash(f'Error loading receipt: {str(e)}', 'error')
+        print(e)
+        return redirect(url_for('sales_terminal.terminal'))
+
+
+@sales_bp.route('/receipt/<sale_id>/escpos')
+@sales_access_required
+def receipt_escpos(sale_id):
+    """Raw ESC/POS bytes of a receipt for thermal printers"""
+    try:
+        supabase = get_supabase()
+        business_id = session.get('business_id')
         
-        # Get business info
-        business_response = supabase.table('businesses') \
-            .select('*') \
-            .eq('id', business_id) \
-            .execute()
-            
-        print(business_response.data)
+        sale_receipt = receipts.get_receipt(supabase, business_id, sale_id)
         
-        business = business_response.data[0] if business_response.data else {}
-        current_time = datetime.now()
-        auto_print = request.args.get('print') == 'true'
-        return render_template('sales/receipt.html',
-                             sale=sale,
-                             items=items,
-                             business=business,
-                             current_time=current_time,
-                             auto_print=auto_print)
+        if not sale_receipt:
+            return jsonify({'success': False, 'message': 'Sale not found'}), 404
         
+        invoice_number = sale_receipt['payload']['sale'].get('invoice_number') or sale_id
+        response = current_app.response_class(sale_receipt['escpos'], mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename="{invoice_number}.bin"'
+        return response
         
     except Exception as e:
-        flash(f'Error loading receipt: {str(e)}', 'error')
-        print(e)
-        return redirect(url_for('sales_terminal.terminal'))
+        print(f"❌ Error loading receipt: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not load receipt'}), 500
 
 
-# Simple in-memory cache
-_sales_cache = {}
-_cache_lock = threading.RLock()
+@sales_bp.route('/receipt/<sale_id>/print', methods=['POST'])
+@sales_access_required
+def print_receipt(sale_id):
+    """Reprint a receipt on this terminal's printer"""
+    try:
+        supabase = get_supabase()
+        business_id = session.get('business_id')
+        
+        sale_receipt = receipts.get_receipt(supabase, business_id, sale_id)
+        
+        if not sale_receipt:
+            return jsonify({'success': False, 'message': 'Sale not found'}), 404
+        
+        invoice_number = sale_receipt['payload']['sale'].get('invoice_number')
+        if not printer_registry.print_receipt(supabase, business_id, sale_receipt['escpos'],
+                                              session.get('terminal_id'), label=f'reprint {invoice_number}'):
+            return jsonify({'success': False, 'message': 'No receipt printer is set up'}), 400
+        
+        return jsonify({'success': True, 'message': 'Receipt sent to printer'})
+        
+    except Exception as e:
+        print(f"❌ Error printing receipt: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not print receipt'}), 500
 
-def get_cached_sales(business_id, cache_key):
-    """Thread-safe cache get"""
-    with _cache_lock:
-        return _sales_cache.get(cache_key)
 
-def set_cached_sales(business_id, cache_key, data, ttl_minutes=5):
-    """Thread-safe cache set with TTL"""
-    with _cache_lock:
-        _sales_cache[cache_key] = {
-            'data': data,
-            'expires': datetime.now() + timedelta(minutes=ttl_minutes)
-        }
+@sales_bp.route('/printers', methods=['GET', 'POST'])
+@role_required(['admin', 'manager'])
+def printers():
+    """List the business's receipt printers with their status, or register one"""
+    try:
+        supabase = get_supabase()
+        business_id = session.get('business_id')
+        
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or request.form
+            printer_type = data.get('printer_type', 'network')
+            if not data.get('name') or printer_type not in ['network', 'usb']:
+                return jsonify({'success': False, 'message': 'Name and a network or usb type are required'}), 400
+            if printer_type == 'network' and not data.get('address'):
+                return jsonify({'success': False, 'message': 'Network printers need an address'}), 400
+            
+            printer_data = {
+                'business_id': business_id,
+                'name': data.get('name').strip(),
+                'terminal_id': (data.get('terminal_id') or '').strip() or None,
+                'printer_type': printer_type,
+                'address': (data.get('address') or '').strip() or None,
+                'port': int(data.get('port') or 9100),
+                'vendor_id': data.get('vendor_id') or None,
+                'product_id': data.get('product_id') or None,
+                'priority': int(data.get('priority') or 0),
+                'created_by': session.get('user_id')
+            }
+            response = supabase.table('printers').insert(printer_data).execute()
+            printer_registry.invalidate(business_id)
+            return jsonify({'success': True, 'printer': response.data[0] if response.data else printer_data})
+        
+        return jsonify({
+            'success': True,
+            'terminal_id': session.get('terminal_id'),
+            'printers': printer_registry.status(supabase, business_id)
+        })
+        
+    except Exception as e:
+        print(f"❌ Error managing printers: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not load printers'}), 500
 
-def clear_expired_cache():
-    """Clear expired cache entries"""
-    with _cache_lock:
-        now = datetime.now()
-        expired_keys = [
-            key for key, value in _sales_cache.items()
-            if value['expires'] < now
-        ]
-        for key in expired_keys:
-            del _sales_cache[key]
 
-@sales_bp.route('/history')
-@sales_access_required
-def sales_history():
-    """View sales history - Optimized with concurrency and caching"""
+@sales_bp.route('/printers/<printer_id>/remove', methods=['POST'])
+@role_required(['admin', 'manager'])
+def remove_printer(printer_id):
+    """Take a printer out of the registry"""
     try:
         supabase = get_supabase()
         business_id = session.get('business_id')
         
-        # Generate cache key based on filters
-        cache_key = f"sales_history_{business_id}_{hash(frozenset(request.args.items()))}"
+        supabase.table('printers') \
+            .update({'is_active': False, 'updated_at': get_utc_now().isoformat()}) \
+            .eq('id', printer_id) \
+            .eq('business_id', business_id) \
+            .execute()
+        printer_registry.invalidate(business_id)
         
-        # Try to get from cache first
-        cached_data = get_cached_sales(business_id, cache_key)
-        if cached_data and cached_data['expires'] > datetime.now():
-            return render_template('sales/history.html', **cached_data['data'])
+        return jsonify({'success': True, 'message': 'Printer removed'})
         
-        # Get filter parameters
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        payment_method = request.args.get('payment_method')
-        status = request.args.get('status')
+    except Exception as e:
+        print(f"❌ Error removing printer: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not remove printer'}), 500
+
+
+@sales_bp.route('/printers/reprint-day', methods=['POST'])
+@role_required(['admin', 'manager'])
+def reprint_day():
+    """Reprint every receipt of a day as one streamed print job"""
+    try:
+        supabase = get_supabase()
+        business_id = session.get('business_id')
         
-        # Build base query
-        query = supabase.table('sales') \
-            .select('id, invoice_number, created_at, customer_name, customer_phone, ' +
-                   'total_amount, tax_amount, payment_method, payment_status, refund_amount') \
-            .eq('business_id', business_id) \
-            .order('created_at', desc=True)
-        
-        # Apply filters
-        if start_date:
-            query = query.gte('created_at', f'{start_date}T00:00:00')
-        if end_date:
-            query = query.lte('created_at', f'{end_date}T23:59:59')
-        if payment_method:
-            query = query.eq('payment_method', payment_method)
-        if status:
-            query = query.eq('payment_status', status)
-        
-        # Execute sales query (main data)
-        sales_response = query.execute()
-        sales = sales_response.data if sales_response.data else []
-        
-        if not sales:
-            # Empty result - cache it anyway
-            result_data = {
-                'sales': [],
-                'today_total': 0,
-                'payment_method_counts': [],
-                'current_date': date.today().isoformat()
-            }
-            set_cached_sales(business_id, cache_key, result_data, 1)
-            return render_template('sales/history.html', **result_data)
+        data = request.get_json(silent=True) or request.form
+        day = data.get('date') or date.today().isoformat()
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date'}), 400
         
-        # Parallel fetching of sale items for all sales
-        sales_with_items = fetch_sale_items_concurrently(supabase, sales)
+        queued = printer_registry.reprint_day(supabase, business_id, day, session.get('terminal_id'))
+        if queued is None:
+            return jsonify({'success': False, 'message': 'No receipt printer is set up'}), 400
         
-        # Parallel calculation of statistics
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            # Submit parallel tasks
-            today_total_future = executor.submit(
-                fetch_today_sales_total, 
-                supabase, 
-                business_id
-            )
-            payment_stats_future = executor.submit(
-                calculate_payment_method_stats, 
-                sales
-            )
-            
-            # Get results
-            today_total = today_total_future.result()
-            payment_method_counts = payment_stats_future.result()
-        
-        # Prepare result data
-        result_data = {
-            'sales': sales_with_items,
-            'today_total': today_total,
-            'payment_method_counts': payment_method_counts,
-            'current_date': date.today().isoformat()
-        }
+        return jsonify({'success': True, 'message': f'{queued} receipts sent to printer', 'count': queued})
         
-        # Cache the result
-        set_cached_sales(business_id, cache_key, result_data, 5)
+    except Exception as e:
+        print(f"❌ Error reprinting receipts: {str(e)}")
+        return jsonify({'success': False, 'message': 'Could not reprint receipts'}), 500
+
+
+@sales_bp.route('/history')
+@sales_access_required
+def sales_history():
+    """View sales history (keyset pages, see sales_history.py)"""
+    try:
+        supabase = get_supabase()
+        business_id = session.get('business_id')
         
-        # Clean up expired cache in background
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-        executor.submit(clear_expired_cache)
-        executor.shutdown(wait=False)
+        filters = sales_history_pages.clean_filters(request.args)
+        page = sales_history_pages.fetch_page(
+            supabase, business_id, filters,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=request.args.get('per_page', sales_history_pages.PAGE_SIZE, type=int)
+        )
         
-        return render_template('sales/history.html', **result_data)
+        return render_template('sales/history.html',
+                             sales=page['sales'],
+                             next_cursor=page['next_cursor'],
+                             prev_cursor=page['prev_cursor'],
+                             filters=filters,
+                             cashiers=sales_history_pages.fetch_cashiers(supabase, business_id),
+                             today_total=fetch_today_sales_total(supabase, business_id),
+                             payment_method_counts=calculate_payment_method_stats(supabase, business_id, filters, page['sales']),
+                             current_date=date.today().isoformat())
         
     except Exception as e:
         flash(f'Error loading sales history: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
-def fetch_sale_items_concurrently(supabase, sales):
-    """Fetch sale items for multiple sales in parallel"""
-    if not sales:
-        return sales
-    
-    # Group sales for batch processing
-    sale_ids = [sale['id'] for sale in sales]
-    
-    # Fetch all sale items in one query
-    items_response = supabase.table('sale_items') \
-        .select('sale_id, product_name, quantity, unit_price') \
-        .in_('sale_id', sale_ids[:100])\
-        .execute()
-    
-    sale_items_dict = {}
-    if items_response.data:
-        for item in items_response.data:
-            sale_id = item['sale_id']
-            if sale_id not in sale_items_dict:
-                sale_items_dict[sale_id] = []
-            sale_items_dict[sale_id].append(item)
-    
-    # Enrich sales with item data
-    sales_with_items = []
-    for sale in sales:
-        sale_items = sale_items_dict.get(sale['id'], [])
-        
-        # Calculate totals
-        item_count = len(sale_items)
-        total_quantity = sum(item.get('quantity', 0) for item in sale_items)
-        
-        # Create enriched sale object
-        enriched_sale = dict(sale)
-        enriched_sale.update({
-            'item_count': item_count,
-            'total_quantity': total_quantity,
-            'sale_items': sale_items
-        })
-        
-        sales_with_items.append(enriched_sale)
-    
-    return sales_with_items
-
-@lru_cache(maxsize=128)
 def fetch_today_sales_total(supabase, business_id):
-    """Fetch today's sales total with caching"""
+    """Today's completed sales total (trend cube, falling back to a query)"""
+    today = date.today()
+    cube = trend_cube.get_series(supabase, business_id, 'sales', 'day', today, today, 'status')
+    if cube is not None:
+        return cube['series'].get('completed', {}).get('amount', [0])[0]
+    
     try:
-        today = date.today()
-        today_start = today.isoformat() + "T00:00:00"
-        today_end = today.isoformat() + "T23:59:59"
-        
-        # Use aggregated query for better performance
         response = supabase.table('sales') \
-            .select('total_amount', count='exact') \
+            .select('total_amount') \
             .eq('business_id', business_id) \
             .eq('payment_status', 'completed') \
-            .gte('created_at', today_start) \
-            .lte('created_at', today_end) \
+            .gte('created_at', today.isoformat() + "T00:00:00") \
+            .lte('created_at', today.isoformat() + "T23:59:59") \
             .execute()
         
-        return sum(sale['total_amount'] for sale in (response.data or []))
+        return sum(float(sale['total_amount']) for sale in (response.data or []))
     except:
         return 0
 
-def calculate_payment_method_stats(sales):
-    """Calculate payment method statistics"""
+def calculate_payment_method_stats(supabase, business_id, filters, sales):
+    """
+    Sales count per payment method, most used first
+    
+    Covers the filtered date range from the trend cube when only dates are
+    filtered; otherwise (or without the cube) the current page.
+    """
+    if not set(filters) - {'start_date', 'end_date'}:
+        try:
+            start = date.fromisoformat(filters['start_date']) if filters.get('start_date') else None
+            end = date.fromisoformat(filters['end_date']) if filters.get('end_date') else None
+        except ValueError:
+            start = end = None
+        counts = trend_cube.get_totals(supabase, business_id, 'sales', 'payment_method', start, end, value='count')
+        if counts is not None:
+            return counts
+    
     payment_counts = {}
     for sale in sales:
         method = sale.get('payment_method', 'unknown')
@@ -1020,7 +1230,6 @@ def calculate_payment_method_stats(sales):
     return sorted(payment_counts.items(), key=lambda x: x[1], reverse=True)
 
 
-
 @sales_bp.route('/refund/<sale_id>', methods=['GET', 'POST'])
 @sales_access_required
 def refund_sale(sale_id):
@@ -1070,192 +1279,59 @@ def refund_sale(sale_id):
         flash(f'Error processing refund: {str(e)}', 'error')
         return redirect(url_for('sales_terminal.sales_history'))
 def process_full_refund(supabase, sale_id, business_id):
-    """Process full refund of a sale"""
+    """Process full refund of a sale (restocks every item)"""
     try:
-        # Get original sale
-        sale_response = supabase.table('sales') \
-            .select('*') \
-            .eq('id', sale_id) \
-            .eq('business_id', business_id) \
-            .single() \
-            .execute()
-        
-        if not sale_response.data:
-            flash('Sale not found', 'error')
-            return redirect(url_for('sales_terminal.sales_history'))
-        
-        sale = sale_response.data
-        
-        # Get sale items to restock
-        items_response = supabase.table('sale_items') \
-            .select('*') \
-            .eq('sale_id', sale_id) \
-            .execute()
-        
-        sale_items = items_response.data if items_response.data else []
-        
-        # Start a transaction
-        refund_id = str(uuid.uuid4())
-        
-        # 1. Create refund record - FIXED: use 'payment_method' not 'refund_method'
-        refund_data = {
-            'id': refund_id,
-            'business_id': business_id,
-            'sale_id': sale_id,
-            'refund_amount': sale['total_amount'],
-            'refund_reason': request.form.get('reason', 'Customer request'),
-            'refunded_by': session.get('user_id'),
-            'payment_method': sale['payment_method'],  # Changed from 'refund_method'
-            'status': 'completed',
-            'notes': request.form.get('notes', '')
-        }
-        
-        supabase.table('refunds').insert(refund_data).execute()
-        
-        # 2. Update sale status
-        supabase.table('sales') \
-            .update({
-                'payment_status': 'refunded',
-                'refund_id': refund_id,
-                'refund_amount': sale['total_amount'],
-                'updated_at': datetime.utcnow().isoformat()
-            }) \
-            .eq('id', sale_id) \
-            .execute()
+        result = refund_engine.process_refund(
+            supabase, sale_id, business_id, session.get('user_id'),
+            reason=request.form.get('reason', 'Customer request'),
+            notes=request.form.get('notes', ''),
+            restock=True
+        )
         
-        # 3. Restock products
-        for item in sale_items:
-            # Find product lots and restock
-            lots_response = supabase.table('product_lots') \
-                .select('*') \
-                .eq('product_id', item['product_id']) \
-                .order('expiry_date') \
-                .execute()
-            
-            if lots_response.data:
-                # Add to first lot (FIFO)
-                lot = lots_response.data[0]
-                new_quantity = lot['quantity'] + item['quantity']
-                
-                supabase.table('product_lots') \
-                    .update({'quantity': new_quantity}) \
-                    .eq('id', lot['id']) \
-                    .execute()
-            else:
-                # Create new lot for returned items
-                new_lot = {
-                    'id': str(uuid.uuid4()),
-                    'business_id': business_id,
-                    'product_id': item['product_id'],
-                    'quantity': item['quantity'],
-                    'purchase_price': item['unit_price'],
-                    'selling_price': item['unit_price'],
-                    'expiry_date': (datetime.utcnow() + timedelta(days=365)).isoformat(),
-                    'batch_number': f'REFUND-{refund_id[:8]}'
-                }
-                supabase.table('product_lots').insert(new_lot).execute()
-        
-        # 4. Create audit log
-        audit_log = {
-            'id': str(uuid.uuid4()),
-            'business_id': business_id,
-            'user_id': session.get('user_id'),
-            'action': 'refund',
-            'description': f'Full refund processed for sale {sale["invoice_number"]}',
-            'details': {
-                'sale_id': sale_id,
-                'refund_id': refund_id,
-                'amount': sale['total_amount'],
-                'reason': request.form.get('reason', 'Customer request')
-            },
-            'created_at': datetime.utcnow().isoformat()
-        }
-        supabase.table('audit_logs').insert(audit_log).execute()
+        catalog_snapshot.mark_changed(business_id, result['restocked_products'])
+        trend_cube.invalidate(business_id)
+        sales_history_pages.invalidate(business_id)
+        receipts.discard(sale_id)
         
-        flash(f'Successfully refunded UGX {sale["total_amount"]:.2f}', 'success')
+        flash(f"Successfully refunded UGX {float(result['refund_amount']):.2f}", 'success')
         return redirect(url_for('sales_terminal.sales_history'))
         
+    except refund_engine.RefundError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('sales_terminal.sales_history'))
     except Exception as e:
         flash(f'Error processing refund: {str(e)}', 'error')
         return redirect(url_for('sales_terminal.sales_history'))
 
 def process_partial_refund(supabase, sale_id, business_id):
-    """Process partial refund"""
+    """Process partial refund (amount only, items are not restocked)"""
     try:
         # Get form data
         refund_amount = float(request.form.get('refund_amount', 0))
         reason = request.form.get('reason', 'Partial refund - customer request')
         
-        # Get original sale
-        sale_response = supabase.table('sales') \
-            .select('*') \
-            .eq('id', sale_id) \
-            .eq('business_id', business_id) \
-            .single() \
-            .execute()
-        
-        if not sale_response.data:
-            flash('Sale not found', 'error')
-            return redirect(url_for('sales_terminal.sales_history'))
-        
-        sale = sale_response.data
-        
         if refund_amount <= 0:
             flash('Refund amount must be greater than 0', 'error')
             return redirect(url_for('sales_terminal.refund_sale', sale_id=sale_id))
         
-        if refund_amount > sale['total_amount']:
-            flash('Refund amount cannot exceed original sale amount', 'error')
-            return redirect(url_for('sales_terminal.refund_sale', sale_id=sale_id))
-        
-        # Create refund record - FIXED: use 'payment_method'
-        refund_id = str(uuid.uuid4())
-        refund_data = {
-            'id': refund_id,
-            'business_id': business_id,
-            'sale_id': sale_id,
-            'refund_amount': refund_amount,
-            'refund_reason': reason,
-            'refunded_by': session.get('user_id'),
-            'payment_method': sale['payment_method'],  # Changed from 'refund_method'
-            'status': 'completed',
-            'notes': request.form.get('notes', '')
-        }
-        
-        supabase.table('refunds').insert(refund_data).execute()
-        
-        # Update sale with partial refund info
-        supabase.table('sales') \
-            .update({
-                'payment_status': 'partially_refunded',
-                'refund_amount': refund_amount,
-                'refund_id': refund_id,
-                'updated_at': datetime.utcnow().isoformat()
-            }) \
-            .eq('id', sale_id) \
-            .execute()
+        result = refund_engine.process_refund(
+            supabase, sale_id, business_id, session.get('user_id'),
+            amount=refund_amount,
+            reason=reason,
+            notes=request.form.get('notes', ''),
+            restock=False
+        )
         
-        # Create audit log
-        audit_log = {
-            'id': str(uuid.uuid4()),
-            'business_id': business_id,
-            'user_id': session.get('user_id'),
-            'action': 'partial_refund',
-            'description': f'Partial refund of UGX {refund_amount:.2f} for sale {sale["invoice_number"]}',
-            'details': {
-                'sale_id': sale_id,
-                'refund_id': refund_id,
-                'original_amount': sale['total_amount'],
-                'refund_amount': refund_amount,
-                'reason': reason
-            },
-            'created_at': datetime.utcnow().isoformat()
-        }
-        supabase.table('audit_logs').insert(audit_log).execute()
+        trend_cube.invalidate(business_id)
+        sales_history_pages.invalidate(business_id)
+        receipts.discard(sale_id)
         
-        flash(f'Successfully processed partial refund of UGX {refund_amount:.2f}', 'success')
+        flash(f"Successfully processed partial refund of UGX {float(result['refund_amount']):.2f}", 'success')
         return redirect(url_for('sales_terminal.sales_history'))
         
+    except refund_engine.RefundError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('sales_terminal.refund_sale', sale_id=sale_id))
     except Exception as e:
         flash(f'Error processing partial refund: {str(e)}', 'error')
         return redirect(url_for('sales_terminal.refund_sale', sale_id=sale_id))
@@ -1288,93 +1364,44 @@ def audit_logs():
         supabase = get_supabase()
         business_id = session.get('business_id')
         
-        # --- Get filter parameters ---
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        action_filter = request.args.get('action')
-        user_id_filter = request.args.get('user_id')
-        page = int(request.args.get('page', 1))
-        limit = 20
-        
-        # --- Base query ---
-        query = supabase.table('audit_logs').select('*', count='exact').eq('business_id', business_id)
-        
-        if start_date:
-            query = query.gte('created_at', f'{start_date}T00:00:00')
-        if end_date:
-            query = query.lte('created_at', f'{end_date}T23:59:59')
-        if action_filter:
-            query = query.eq('action', action_filter)
-        if user_id_filter:
-            query = query.eq('user_id', user_id_filter)
-        
-        # Pagination
-        start_index = (page - 1) * limit
-        end_index = start_index + limit - 1
-        query = query.order('created_at', desc=True).range(start_index, end_index)
-        
-        # Execute query
-        response = query.execute()
-        logs = response.data if response.data else []
-        total_count = response.count or 0
-        total_pages = (total_count + limit - 1) // limit
-        
-        # --- Fetch user info for logs ---
-        user_ids = {log['user_id'] for log in logs if log.get('user_id')}
-        users_map = {}
-        if user_ids:
-            users_response = supabase.table('users').select('id, first_name, last_name, role').in_('id', list(user_ids)).execute()
-            if users_response.data:
-                users_map = {u['id']: u for u in users_response.data}
-        
-        # Add user info to logs
-        for log in logs:
-            user_info = users_map.get(log.get('user_id'))
-            if user_info:
-                log['user_name'] = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip()
-                log['user_role'] = user_info.get('role')
-        
-        # --- Statistics in Python ---
+        filters = audit_trail.clean_filters(request.args)
+        page = audit_trail.fetch_page(
+            supabase,
+            business_id,
+            filters,
+            after=request.args.get('after'),
+            before=request.args.get('before')
+        )
+        facets = audit_trail.get_facets(supabase, business_id)
+        
+        total_logs = page['total']
+        if total_logs is None and not filters and facets['refreshed_at']:
+            total_logs = sum(action['count'] for action in facets['actions'])
+        
+        # --- Statistics from the facet snapshot ---
         today_str = datetime.now().date().isoformat()
-        today_logs_count = sum(1 for log in logs if log.get('created_at', '').startswith(today_str))
-        
-        # Top user
-        user_counter = {}
-        for log in logs:
-            uid = log.get('user_id')
-            if uid:
-                user_counter[uid] = user_counter.get(uid, 0) + 1
+        today_logs_count = audit_trail.count_since(supabase, business_id, f'{today_str}T00:00:00')
+        
         top_user = None
-        if user_counter:
-            top_user_id = max(user_counter, key=user_counter.get)
-            u = users_map.get(top_user_id)
-            if u:
-                top_user = {'name': f"{u.get('first_name', '')} {u.get('last_name', '')}".strip(), 'role': u.get('role')}
-        
-        # Most common action
-        action_counter = {}
-        for log in logs:
-            act = log.get('action')
-            if act:
-                action_counter[act] = action_counter.get(act, 0) + 1
-        common_action = max(action_counter, key=action_counter.get) if action_counter else None
-        
-        # --- Get all users for filter dropdown ---
-        all_users_resp = supabase.table('users').select('id, first_name, last_name, role').eq('business_id', business_id).order('first_name').execute()
-        users = all_users_resp.data if all_users_resp.data else []
-        for u in users:
-            u['name'] = f"{u.get('first_name', '')} {u.get('last_name', '')}".strip()
+        if facets['users'] and facets['users'][0]['count']:
+            top_user = {'name': facets['users'][0]['name'], 'role': facets['users'][0]['role']}
+        
+        common_action = None
+        if facets['actions'] and facets['actions'][0]['count']:
+            common_action = facets['actions'][0]['value']
         
         return render_template(
             'sales/logs.html',
-            logs=logs,
-            total_logs=total_count,
+            logs=page['logs'],
+            total_logs=total_logs,
             today_logs=today_logs_count,
             top_user=top_user,
             common_action=common_action,
-            users=users,
-            page=page,
-            pages=total_pages,
+            actions=sorted(facets['actions'], key=lambda action: action['label']),
+            users=sorted(facets['users'], key=lambda user: user['name']),
+            next_cursor=page['next_cursor'],
+            prev_cursor=page['prev_cursor'],
+            filters=filters,
             current_date=today_str,
             time_ago=time_ago
             
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from routes.auth import login_required
 from supabase import create_client
 from config import Config
+from pesapal import invalidate_pesapal_credentials
 import json
 
 # Create Supabase client
@@ -35,12 +36,18 @@ def save_pesapal_settings(business_id, consumer_key, consumer_secret, ipn_url):
         
         if existing:
             # Update existing settings
-            response = supabase.table('business_settings').update({
+            update_data = {
                 'pesapal_consumer_key': consumer_key,
                 'pesapal_consumer_secret': consumer_secret,
                 'pesapal_ipn_url': ipn_url,
                 'updated_at': 'now()'
-            }).eq('id', existing['id']).execute()
+            }
+            # IPN ids belong to one PesaPal account: new credentials must register again
+            if (existing.get('pesapal_consumer_key') != consumer_key
+                    or existing.get('pesapal_consumer_secret') != consumer_secret):
+                update_data['pesapal_ipn_id'] = None
+                update_data['pesapal_ipn_registered_url'] = None
+            response = supabase.table('business_settings').update(update_data).eq('id', existing['id']).execute()
         else:
             # Create new settings
             response = supabase.table('business_settings').insert({
@@ -52,6 +59,9 @@ def save_pesapal_settings(business_id, consumer_key, consumer_secret, ipn_url):
                 'updated_at': 'now()'
             }).execute()
         
+        # Cached PesaPal credentials and token are stale now
+        invalidate_pesapal_credentials(business_id)
+        
         return response.data is not None
     except Exception as e:
         print(f"Error saving PesaPal settings: {e}")
@@ -1,7 +1,6 @@
 # utils/decorators.py
 from functools import wraps
 from flask import flash, redirect, url_for, session, current_app
-from flask_login import current_user
 import json
 from supabase import create_client, Client
 import os
@@ -13,7 +12,8 @@ import json
 from datetime import datetime
 from urllib.parse import unquote
 
-from routes.auth import get_utc_now, send_email_async 
+from routes.auth import get_utc_now, send_email_async, admin_required
+import authz
 import html
 
 
@@ -46,31 +46,6 @@ _supabase_last_init = 0
 _cache_duration = 300  # 5 minutes cache
 
 
-def role_required(roles):
-    """Decorator to require specific role(s)"""
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if not current_user.is_authenticated:
-                flash('Please log in to access this page', 'error')
-                return redirect(url_for('auth.login'))
-            
-            # Get user role from session or database
-            user_role = session.get('user_role', 'employee')
-            
-            if isinstance(roles, str):
-                required_roles = [roles]
-            else:
-                required_roles = roles
-            
-            if user_role not in required_roles:
-                flash('You do not have permission to access this page', 'error')
-                return redirect(url_for('dashboard'))
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
 def get_supabase() -> Client:
     """Optimized Supabase client with connection pooling"""
     global _supabase_client, _supabase_last_init
@@ -102,21 +77,6 @@ def get_supabase() -> Client:
 
 
 
-# Decorator to check if user is admin
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Please login to access this page', 'warning')
-            return redirect(url_for('auth.login'))
-        
-        if not session.get('is_admin') and session.get('user_role') != 'admin':
-            flash('Administrator access required', 'error')
-            return redirect(url_for('dashboard'))
-        
-        return f(*args, **kwargs)
-    return decorated_function
-
 # Log audit trail
 def log_audit_action(action, target_type=None, target_id=None, old_values=None, new_values=None):
     try:
@@ -600,8 +560,8 @@ def add_employee():
         temp_password = ''.join(secrets.choice(alphabet) for i in range(12))
         
         # Hash the password
-        from werkzeug.security import generate_password_hash
-        password_hash = generate_password_hash(temp_password)
+        from passwords import hash_password
+        password_hash = hash_password(temp_password)
         
         # Prepare user data - AUTO VERIFY admin-created employees
         user_data = {
@@ -773,6 +733,7 @@ def manage_employee(user_id):
             if update_data:
                 update_data['updated_at'] = get_utc_now().isoformat()
                 result = supabase.table('users').update(update_data).eq('id', user_id).execute()
+                authz.invalidate_user(user_id)
                 
                 if result.data:
                     # Log the action
@@ -794,6 +755,7 @@ def manage_employee(user_id):
                 })\
                 .eq('id', user_id)\
                 .execute()
+            authz.invalidate_user(user_id)
             
             if result.data:
                 # Log the action
@@ -880,6 +842,7 @@ def add_role():
         
         # Insert new role
         result = supabase.table('user_roles').insert(role_data).execute()
+        authz.invalidate_roles()
         
         if result.data:
             role_id = result.data[0]['id']
@@ -938,6 +901,7 @@ def manage_role(role_id):
             if update_data:
                 update_data['updated_at'] = get_utc_now().isoformat()
                 result = supabase.table('user_roles').update(update_data).eq('id', role_id).execute()
+                authz.invalidate_roles()
                 
                 if result.data:
                     # Log the action
@@ -971,6 +935,7 @@ def manage_role(role_id):
             
             # Delete role
             result = supabase.table('user_roles').delete().eq('id', role_id).execute()
+            authz.invalidate_roles()
             
             if result.data:
                 # Log the action
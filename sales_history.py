@@ -0,0 +1,190 @@
+# sales_history.py
+"""
+Keyset-paginated sales history.
+
+Pages are read newest first along sales(business_id, created_at, id), and the
+cursor is the (created_at, id) of the page's first or last row. Every page
+costs one bounded sales query plus one bulk sale_items query, however far
+back it is. Filters (date range, status, payment method, cashier and invoice
+search) are applied by PostgREST.
+
+Pages are cached per business and filter set. invalidate() is called when a
+business records or refunds a sale, which drops all of its cached pages.
+"""
+import base64
+import threading
+import time
+import uuid
+from datetime import datetime
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+CACHE_TTL_SECONDS = 300
+FILTERS = ('start_date', 'end_date', 'status', 'payment_method', 'cashier', 'q')
+
+SALE_COLUMNS = 'id, invoice_number, created_at, customer_name, customer_phone, ' \
+               'total_amount, tax_amount, payment_method, payment_status, refund_amount, sold_by'
+
+_cache = {}
+_versions = {}
+_cache_lock = threading.Lock()
+
+
+def encode_cursor(sale):
+    raw = f"{sale['created_at']}|{sale['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, sale_id = raw.split('|', 1)
+        datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        return created_at, str(uuid.UUID(sale_id))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def clean_filters(args):
+    """The supported filters from request args, without empty values"""
+    return {key: args.get(key).strip() for key in FILTERS if args.get(key) and args.get(key).strip()}
+
+
+def invalidate(business_id):
+    """Drop every cached page of a business (call after a sale or refund)"""
+    with _cache_lock:
+        _versions[business_id] = _versions.get(business_id, 0) + 1
+        for key in [key for key in _cache if key[0] == business_id]:
+            del _cache[key]
+
+
+def _apply_filters(query, filters):
+    if filters.get('start_date'):
+        query = query.gte('created_at', f"{filters['start_date']}T00:00:00")
+    if filters.get('end_date'):
+        query = query.lte('created_at', f"{filters['end_date']}T23:59:59")
+    if filters.get('status'):
+        query = query.eq('payment_status', filters['status'])
+    if filters.get('payment_method'):
+        query = query.eq('payment_method', filters['payment_method'])
+    if filters.get('cashier'):
+        try:
+            query = query.eq('sold_by', str(uuid.UUID(filters['cashier'])))
+        except ValueError:
+            pass
+    if filters.get('q'):
+        # Invoice search (trigram index, see migrations/0006)
+        term = filters['q'].replace('%', '').replace(',', '').replace('(', '').replace(')', '')
+        query = query.ilike('invoice_number', f'%{term}%')
+    return query
+
+
+def _keyset(query, cursor, before):
+    """Rows strictly after (older than) or before (newer than) the cursor row"""
+    created_at, sale_id = cursor
+    op = 'lt' if before else 'gt'
+    return query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{sale_id})')
+
+
+def attach_items(supabase, sales):
+    """Add sale_items, item_count and total_quantity to each sale with one bulk query"""
+    if not sales:
+        return sales
+
+    items_response = supabase.table('sale_items') \
+        .select('sale_id, product_name, quantity, unit_price') \
+        .in_('sale_id', [sale['id'] for sale in sales]) \
+        .execute()
+
+    items_by_sale = {}
+    for item in items_response.data or []:
+        items_by_sale.setdefault(item['sale_id'], []).append(item)
+
+    for sale in sales:
+        sale_items = items_by_sale.get(sale['id'], [])
+        sale.update({
+            'item_count': len(sale_items),
+            'total_quantity': sum(item.get('quantity', 0) for item in sale_items),
+            'sale_items': sale_items
+        })
+    return sales
+
+
+def fetch_page(supabase, business_id, filters=None, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    One page of sales history, newest first
+
+    Args:
+        filters: See FILTERS
+        after: Cursor of the last row of the previous page (next page)
+        before: Cursor of the first row of the following page (previous page)
+
+    Returns:
+        dict: sales (with items), next_cursor, prev_cursor, per_page
+    """
+    filters = filters or {}
+    per_page = min(max(int(per_page), 1), MAX_PAGE_SIZE)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if not after_key else None
+
+    key = (business_id, tuple(sorted(filters.items())), after, before, per_page)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        version = _versions.get(business_id, 0)
+
+    query = supabase.table('sales') \
+        .select(SALE_COLUMNS) \
+        .eq('business_id', business_id)
+    query = _apply_filters(query, filters)
+
+    if before_key:
+        # Walk towards newer rows, then flip back to newest first
+        query = _keyset(query, before_key, before=False)
+        rows = query.order('created_at').order('id').limit(per_page + 1).execute().data or []
+        has_more = len(rows) > per_page
+        sales = list(reversed(rows[:per_page]))
+        has_newer, has_older = has_more, True
+    else:
+        if after_key:
+            query = _keyset(query, after_key, before=True)
+        rows = query.order('created_at', desc=True).order('id', desc=True).limit(per_page + 1).execute().data or []
+        sales = rows[:per_page]
+        has_newer, has_older = bool(after_key), len(rows) > per_page
+
+    attach_items(supabase, sales)
+
+    page = {
+        'sales': sales,
+        'next_cursor': encode_cursor(sales[-1]) if sales and has_older else None,
+        'prev_cursor': encode_cursor(sales[0]) if sales and has_newer else None,
+        'per_page': per_page
+    }
+
+    with _cache_lock:
+        if _versions.get(business_id, 0) == version:
+            _cache[key] = (now + CACHE_TTL_SECONDS, page)
+            # Expired pages go when the cache grows
+            if len(_cache) > 1000:
+                for stale in [k for k, v in _cache.items() if v[0] <= now]:
+                    del _cache[stale]
+    return page
+
+
+def fetch_cashiers(supabase, business_id):
+    """Users of a business for the cashier filter"""
+    try:
+        response = supabase.table('users') \
+            .select('id, first_name, last_name, email') \
+            .eq('business_id', business_id) \
+            .order('first_name') \
+            .execute()
+        return response.data or []
+    except Exception as e:
+        print(f"⚠️ Could not load cashiers: {str(e)}")
+        return []
@@ -0,0 +1,186 @@
+# trend_cube.py
+"""
+Chart series served from the trend cube (migrations/0004).
+
+Database triggers keep per-business count and amount totals per day, week
+and month for every dimension member, so a chart series is one row per
+period and member however many sales or expenses it covers. Results are
+cached per business for TREND_CUBE_CACHE_SECONDS; invalidate() drops a
+business's entries after writes made through the app.
+
+Every reader returns None when the cube cannot be queried (e.g. before the
+migration is applied) so callers can fall back to scanning rows.
+"""
+import threading
+import time
+from datetime import date, timedelta
+
+from config import Config
+
+PAGE_SIZE = 1000
+
+GRAINS = ('day', 'week', 'month')
+DIMENSIONS = {
+    'sales': ('all', 'payment_method', 'status', 'cashier', 'category'),
+    'expenses': ('all', 'category', 'status', 'payment_method', 'cashier'),
+}
+
+_cache = {}
+_versions = {}
+_cache_lock = threading.Lock()
+
+
+def period_start(value, grain):
+    """First day of the day/week (Monday)/month containing `value`"""
+    if grain == 'week':
+        return value - timedelta(days=value.weekday())
+    if grain == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def next_period(value, grain):
+    if grain == 'week':
+        return value + timedelta(days=7)
+    if grain == 'month':
+        return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return value + timedelta(days=1)
+
+
+def periods(start, end, grain):
+    """Period start dates covering [start, end]"""
+    result = []
+    current = period_start(start, grain)
+    while current <= end:
+        result.append(current)
+        current = next_period(current, grain)
+    return result
+
+
+def invalidate(business_id):
+    """Forget cached series for a business (call after writing sales or expenses)"""
+    with _cache_lock:
+        _versions[business_id] = _versions.get(business_id, 0) + 1
+        for key in [key for key in _cache if key[0] == business_id]:
+            del _cache[key]
+
+
+def _cached(key, load):
+    """Return a cached result or load it; results loaded across an invalidate() are not kept"""
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        version = _versions.get(key[0], 0)
+
+    result = load()
+
+    if result is not None:
+        with _cache_lock:
+            if _versions.get(key[0], 0) == version:
+                _cache[key] = (now + Config.TREND_CUBE_CACHE_SECONDS, result)
+    return result
+
+
+def _query(supabase, business_id, fact, grain, dimension, start=None, end=None):
+    if grain not in GRAINS or dimension not in DIMENSIONS.get(fact, ()):
+        raise ValueError(f'Unknown cube slice: {fact}/{grain}/{dimension}')
+
+    try:
+        rows = []
+        offset = 0
+        while True:
+            query = supabase.table('trend_cube') \
+                .select('period, member, count, amount') \
+                .eq('business_id', business_id) \
+                .eq('fact', fact) \
+                .eq('grain', grain) \
+                .eq('dimension', dimension)
+            if start:
+                query = query.gte('period', period_start(start, grain).isoformat())
+            if end:
+                query = query.lte('period', end.isoformat())
+            data = query.order('period').order('member').range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            rows.extend(data)
+            if len(data) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+    except Exception as e:
+        print(f"⚠️ Trend cube unavailable: {str(e)}")
+        return None
+
+
+def get_series(supabase, business_id, fact, grain, start, end, dimension='all'):
+    """
+    Zero-filled series per dimension member
+
+    Returns:
+        dict: {'grain', 'dimension', 'periods': [ISO dates],
+               'series': {member: {'amount': [...], 'count': [...]}}}, or None
+    """
+    def load():
+        rows = _query(supabase, business_id, fact, grain, dimension, start, end)
+        if rows is None:
+            return None
+
+        period_keys = [period.isoformat() for period in periods(start, end, grain)]
+        index = {period: i for i, period in enumerate(period_keys)}
+        series = {}
+        for row in rows:
+            i = index.get(row['period'])
+            if i is None:
+                continue
+            entry = series.setdefault(row['member'], {
+                'amount': [0] * len(period_keys),
+                'count': [0] * len(period_keys)
+            })
+            entry['amount'][i] += float(row.get('amount') or 0)
+            entry['count'][i] += int(row.get('count') or 0)
+
+        return {
+            'grain': grain,
+            'dimension': dimension,
+            'periods': period_keys,
+            # Members whose facts were all deleted are left at zero in the cube
+            'series': {member: entry for member, entry in series.items() if any(entry['count'])}
+        }
+
+    return _cached((business_id, 'series', fact, grain, dimension, start.isoformat(), end.isoformat()), load)
+
+
+def get_totals(supabase, business_id, fact, dimension, start=None, end=None, value='amount'):
+    """
+    Totals per dimension member over [start, end] (all time when omitted), largest first
+
+    Whole months are read where the range allows, days elsewhere.
+
+    Returns:
+        list: [(member, amount or count)], or None
+    """
+    def load():
+        if (start and start.day != 1) or (end and next_period(end, 'day').day != 1):
+            rows = _query(supabase, business_id, fact, 'day', dimension, start, end)
+        else:
+            rows = _query(supabase, business_id, fact, 'month', dimension, start, end)
+        if rows is None:
+            return None
+
+        totals = {}
+        counts = {}
+        for row in rows:
+            totals[row['member']] = totals.get(row['member'], 0) + float(row.get('amount') or 0)
+            counts[row['member']] = counts.get(row['member'], 0) + int(row.get('count') or 0)
+        values = counts if value == 'count' else totals
+        return sorted(((member, values[member]) for member in totals if counts[member]),
+                      key=lambda item: item[1], reverse=True)
+
+    key = (business_id, 'totals', fact, dimension,
+           start.isoformat() if start else None, end.isoformat() if end else None, value)
+    return _cached(key, load)
+
+
+def series_labels(period_keys, grain):
+    """Chart labels for period start dates"""
+    formats = {'day': '%a', 'week': 'W%V %G', 'month': '%b'}
+    return [date.fromisoformat(period).strftime(formats[grain]) for period in period_keys]